@@ -0,0 +1,404 @@
+import argparse
+from collections import Counter, defaultdict
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import stat
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'src'))
+sys.path.insert(0, src_path)
+
+import genai_utils
+import git_utils
+import job_executor
+import metrics
+import state_store
+import sync_deploy_manager
+
+OWNER = 'bench'
+FAKE_HOST = 'bench.invalid'  # get_remote_url arma http://bench.invalid/...; git lo reescribe a los remotos locales
+
+# Stub de 'docker': responde a lo que usan docker_manager y container_state sin tocar un daemon real.
+# El estado de cada proyecto "levantado" se guarda como un archivo en BENCH_DOCKER_STATE.
+STUB_DOCKER = r'''#!/usr/bin/env python3
+import json, os, sys, time
+
+state_dir = os.environ['BENCH_DOCKER_STATE']
+delay = float(os.environ.get('BENCH_DOCKER_DELAY', '0'))
+output_lines = int(os.environ.get('BENCH_DOCKER_OUTPUT_LINES', '0'))
+args = sys.argv[1:]
+
+if args[:1] == ['ps']:
+    for project in sorted(os.listdir(state_dir)):
+        print(json.dumps({'Labels': f'com.docker.compose.project={project},com.docker.compose.service=app',
+                          'State': 'running', 'Status': 'Up 1 minute', 'Names': f'{project}-app-1'}))
+    sys.exit(0)
+
+if args[:1] == ['compose']:
+    rest, project, compose_file = args[1:], None, None
+    while rest and rest[0].startswith('-'):
+        if rest[0] == '-p':
+            project = rest[1]
+        elif rest[0] == '-f':
+            compose_file = rest[1]
+        rest = rest[2:]
+    command = rest[0] if rest else ''
+    marker = os.path.join(state_dir, project or 'default')
+    if command == 'config':
+        context = os.path.dirname(os.path.abspath(compose_file or 'docker-compose.yml'))
+        print(json.dumps({'services': {'app': {'build': {'context': context}, 'image': f'{project}-app'}}}))
+    elif command == 'ps':
+        state = 'running' if os.path.exists(marker) else 'exited'
+        print(json.dumps([{'Service': 'app', 'State': state, 'Health': ''}]))
+    elif command in ('build', 'up'):
+        time.sleep(delay)
+        for step in range(output_lines):
+            print(f'#{step} [app] benchmark step {step}')
+        if command == 'up':
+            open(marker, 'w').close()
+    elif command == 'down' and os.path.exists(marker):
+        os.remove(marker)
+    sys.exit(0)
+
+if args[:2] == ['image', 'inspect']:
+    print('sha256:benchmark')
+sys.exit(0)
+'''
+
+
+class StubModel:
+    """Modelo de IA simulado: responde con un mensaje fijo tras `latency` segundos."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, prompt, request_options=None):
+        time.sleep(self.latency)
+        return type('Response', (), {'text': 'chore: benchmark commit'})()
+
+
+class Recorder:
+    """Recibe los registros de metrics y guarda las muestras crudas por etapa, subprocesos y resultados."""
+
+    def __init__(self):
+        self.enabled = False
+        self.samples = defaultdict(list)
+        self.subprocesses = Counter()
+        self.outcomes = Counter()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+            self.subprocesses.clear()
+            self.outcomes.clear()
+
+    def __call__(self, name, value, labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            if name == 'pipeline_stage_duration_seconds':
+                self.samples[labels['stage']].append(value)
+            elif name == 'pipeline_llm_request_seconds':
+                self.samples['llm_request'].append(value)
+            elif name == 'pipeline_docker_command_seconds':
+                self.samples[f"docker_{labels['action']}"].append(value)
+            elif name == 'pipeline_task_duration_seconds':
+                self.samples[f"task_{labels['task']}"].append(value)
+            elif name == 'pipeline_job_queue_wait_seconds':
+                self.samples['queue_wait'].append(value)
+            elif name == 'pipeline_commands_total':
+                self.subprocesses[labels['operation'] or 'other'] += value
+            elif name == 'pipeline_task_outcomes_total':
+                outcome = labels['outcome'] + (f":{labels['stage']}" if labels['stage'] else '')
+                self.outcomes[f"{labels['task']}={outcome}"] += value
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Resume muestras en segundos como {'count', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms'}."""
+    return {
+        'count': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+        'p50_ms': round(_percentile(samples, 0.5) * 1000, 3),
+        'p95_ms': round(_percentile(samples, 0.95) * 1000, 3),
+        'max_ms': round(max(samples) * 1000, 3),
+    }
+
+
+def peak_rss_kb():
+    """Pico de memoria residente del proceso y de sus subprocesos (KiB). None si la plataforma no lo informa."""
+    if resource is None:
+        return {'self': None, 'children': None}
+    scale = 1024 if sys.platform == 'darwin' else 1  # macOS informa bytes, Linux KiB
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale,
+    }
+
+
+def git(*args, cwd=None):
+    subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True)
+
+
+def random_lines(rng, count):
+    return [''.join(rng.choices(string.ascii_letters + string.digits + ' ', k=60)) for _ in range(count)]
+
+
+def write_file(path, lines):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def fixture_file(folder, index):
+    # 20 archivos por carpeta para que el árbol tenga varios niveles, como un proyecto real
+    return os.path.join(folder, 'src', f'pkg{index // 20}', f'module{index}.py')
+
+
+def modify_files(folder, args, rng):
+    """Reescribe `diff_lines` líneas de `changed_files` archivos elegidos al azar."""
+    for index in rng.sample(range(args.files), min(args.changed_files, args.files)):
+        path = fixture_file(folder, index)
+        with open(path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        lines[:args.diff_lines] = random_lines(rng, args.diff_lines)
+        write_file(path, lines)
+
+
+def prepare_environment(root, args):
+    """Aísla git y docker del sistema: gitconfig propio, remotos locales y el stub de docker primero en el PATH."""
+    bin_dir = os.path.join(root, 'bin')
+    docker_state = os.path.join(root, 'docker-state')
+    os.makedirs(bin_dir)
+    os.makedirs(docker_state)
+    docker_path = os.path.join(bin_dir, 'docker')
+    with open(docker_path, 'w', encoding='utf-8') as f:
+        f.write(STUB_DOCKER.replace('/usr/bin/env python3', sys.executable, 1))
+    os.chmod(docker_path, os.stat(docker_path).st_mode | stat.S_IEXEC)
+
+    gitconfig = os.path.join(root, 'gitconfig')
+    remotes_url = 'file://' + os.path.join(root, 'remotes').replace(os.sep, '/') + '/'
+    with open(gitconfig, 'w', encoding='utf-8') as f:
+        f.write(f'[user]\n\tname = {OWNER}\n\temail = {OWNER}@{FAKE_HOST}\n'
+                f'[init]\n\tdefaultBranch = main\n'
+                f'[url "{remotes_url}"]\n\tinsteadOf = http://{FAKE_HOST}/\n')
+
+    os.environ.update({
+        'GIT_CONFIG_GLOBAL': gitconfig,
+        'GIT_CONFIG_NOSYSTEM': '1',
+        'PATH': bin_dir + os.pathsep + os.environ.get('PATH', ''),
+        'BENCH_DOCKER_STATE': docker_state,
+        'BENCH_DOCKER_DELAY': str(args.docker_delay),
+        'BENCH_DOCKER_OUTPUT_LINES': str(args.docker_output_lines),
+    })
+
+
+def create_fixture(root, index, args, rng):
+    """Crea el remoto bare, la copia de trabajo del bot y una copia 'upstream' que simula a otro desarrollador."""
+    name = f'bench{index}'
+    remote = os.path.join(root, 'remotes', OWNER, f'{name}.git')
+    work = os.path.join(root, 'work', name)
+    upstream = os.path.join(root, 'upstream', name)
+
+    git('init', '--bare', remote)
+    git('init', work)
+    for file_index in range(args.files):
+        write_file(fixture_file(work, file_index), random_lines(rng, args.file_lines))
+    write_file(os.path.join(work, 'Dockerfile'), ['FROM scratch', 'COPY src /src'])
+    write_file(os.path.join(work, 'docker-compose.yml'), ['services:', '  app:', '    build: .'])
+    git('add', '-A', cwd=work)
+    git('commit', '-q', '-m', 'Initial fixture', cwd=work)
+    git('branch', '-M', 'main', cwd=work)
+    git('config', 'pull.rebase', 'true', cwd=work)
+    git('push', '-q', remote, 'main', cwd=work)
+    git('clone', '-q', remote, upstream)
+    git('config', 'pull.rebase', 'true', cwd=upstream)
+
+    return {
+        'folder_path': work,
+        'repo_name': name,
+        'interval': 60,
+        'option': 'push_and_pull',
+        'github_user': OWNER,
+        'gitea_url': FAKE_HOST,
+        'git_branch': 'main',
+        'docker_compose_file': os.path.join(work, 'docker-compose.yml'),
+        'docker_compose_project_name': name,
+        'deploy_strategy': args.deploy_strategy,
+    }, upstream
+
+
+def wait_idle():
+    while job_executor.get_in_flight_count() or job_executor.get_queue_depth():
+        time.sleep(0.005)
+
+
+def run_round(task_name, tasks):
+    """Encola la tarea en todos los proyectos a la vez, como un tick del scheduler, y espera a que terminen."""
+    start = time.monotonic()
+    for folder_path, project_tasks in tasks.items():
+        job_executor.submit(folder_path, project_tasks[task_name])
+    wait_idle()
+    return time.monotonic() - start
+
+
+def run_scenario(scenario, tasks, configs, upstreams, args, rng, recorder):
+    task_name = 'commit_and_push' if scenario == 'push' else 'pull_and_deploy'
+
+    def mutate():
+        for config, upstream in zip(configs, upstreams):
+            if scenario == 'push':
+                modify_files(config['folder_path'], args, rng)
+            else:
+                git('pull', '-q', cwd=upstream)
+                modify_files(upstream, args, rng)
+                git('commit', '-q', '-am', 'Upstream change', cwd=upstream)
+                git('push', '-q', cwd=upstream)
+
+    recorder.enabled = False
+    for _ in range(args.warmup):
+        mutate()
+        run_round(task_name, tasks)
+
+    recorder.reset()
+    rounds = []
+    for _ in range(args.rounds):
+        mutate()
+        recorder.enabled = True
+        rounds.append(run_round(task_name, tasks))
+        recorder.enabled = False
+
+    return {
+        'task': task_name,
+        'wall_time_s': round(sum(rounds), 4),
+        'round_time_ms': summarize(rounds),
+        'stages': {stage: summarize(samples) for stage, samples in sorted(recorder.samples.items())},
+        'subprocesses': {'total': sum(recorder.subprocesses.values()),
+                         'per_round': round(sum(recorder.subprocesses.values()) / max(1, args.rounds), 2),
+                         'by_operation': dict(sorted(recorder.subprocesses.items()))},
+        'outcomes': dict(sorted(recorder.outcomes.items())),
+    }
+
+
+def repo_version():
+    try:
+        result = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el rendimiento del ciclo de sync y deploy contra repositorios locales, sin red ni Docker real.")
+    parser.add_argument('--projects', type=int, default=4, help='Cantidad de proyectos simulados.')
+    parser.add_argument('--files', type=int, default=200, help='Archivos por repositorio.')
+    parser.add_argument('--file-lines', type=int, default=40, help='Líneas por archivo.')
+    parser.add_argument('--changed-files', type=int, default=5, help='Archivos modificados por ronda y proyecto.')
+    parser.add_argument('--diff-lines', type=int, default=10, help='Líneas modificadas por archivo.')
+    parser.add_argument('--rounds', type=int, default=5, help='Rondas medidas por escenario.')
+    parser.add_argument('--warmup', type=int, default=1, help='Rondas previas no medidas (preparan los repositorios).')
+    parser.add_argument('--scenario', choices=('push', 'pull', 'both'), default='both')
+    parser.add_argument('--max-workers', type=int, default=job_executor.DEFAULT_MAX_WORKERS)
+    parser.add_argument('--deploy-strategy', default='incremental')
+    parser.add_argument('--llm-latency', type=float, default=0.2, help='Segundos de respuesta del modelo simulado.')
+    parser.add_argument('--docker-delay', type=float, default=0.05, help='Segundos que tarda cada build/up simulado.')
+    parser.add_argument('--docker-output-lines', type=int, default=500, help='Líneas de salida de cada build/up simulado.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', help='Carpeta para los fixtures (por defecto, una temporal que se borra al terminar).')
+    parser.add_argument('--output', default='-', help="Archivo JSON de resultados ('-' para stdout).")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    if os.name == 'nt':
+        parser.error("El benchmark usa un stub de docker ejecutable y solo corre en Linux/macOS.")
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [%(levelname)s] %(message)s")
+
+    root = args.workdir or tempfile.mkdtemp(prefix='pipeline-bench-')
+    os.makedirs(root, exist_ok=True)
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    report = None
+    try:
+        prepare_environment(root, args)
+        setup_start = time.monotonic()
+        fixtures = [create_fixture(root, index, args, rng) for index in range(args.projects)]
+        configs = [config for config, _ in fixtures]
+        upstreams = [upstream for _, upstream in fixtures]
+        setup_time = time.monotonic() - setup_start
+
+        git_utils.configure(OWNER, f'{OWNER}@{FAKE_HOST}')
+        genai_utils.set_model(StubModel(args.llm_latency))
+        genai_utils.configure_queue(requests_per_minute=1_000_000)
+        job_executor.configure(args.max_workers)
+        state_store.configure(os.path.join(root, 'state.db'))
+        # Arranque diferido: las primeras ejecuciones quedan en el scheduler, que el benchmark no corre
+        sync_deploy_manager.configure_startup('deferred', 0)
+        for config in configs:
+            sync_deploy_manager.sync_project(config)
+        tasks = {}
+        for config in configs:
+            entry = sync_deploy_manager.projects[sync_deploy_manager.project_key(config)]
+            tasks[config['folder_path']] = {task.__name__: task for task in entry['tasks']}
+
+        metrics.add_listener(recorder)
+        scenarios = ('push', 'pull') if args.scenario == 'both' else (args.scenario,)
+        started = time.monotonic()
+        results = {scenario: run_scenario(scenario, tasks, configs, upstreams, args, rng, recorder) for scenario in scenarios}
+        report = {
+            'version': repo_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': {key: value for key, value in vars(args).items() if key not in ('output', 'workdir', 'log_level')},
+            'setup_time_s': round(setup_time, 4),
+            'wall_time_s': round(time.monotonic() - started, 4),
+            'peak_rss_kb': peak_rss_kb(),
+            'scenarios': results,
+        }
+    finally:
+        metrics.remove_listener(recorder)
+        sync_deploy_manager.cancel_jobs()
+        job_executor.shutdown(wait=True)
+        genai_utils.configure_queue()
+        state_store.close()
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if report is None:
+        # La preparación falló: la excepción original ya se propagó o se registró
+        return 1
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        for scenario, result in results.items():
+            print(f"{scenario}: {result['wall_time_s']}s en {args.rounds} rondas, "
+                  f"{result['subprocesses']['per_round']} subprocesos por ronda, resultados {result['outcomes']}")
+        print(f"Pico de memoria: {report['peak_rss_kb']} KiB. Resultados en {args.output}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,7 @@
 import argparse
-from logging.handlers import TimedRotatingFileHandler
 import os
 import time
 import logging
-import schedule
 import sys
 import signal
 from watchdog.observers import Observer
@@ -13,41 +11,41 @@ src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'src'))
 sys.path.insert(0, src_path)
 
 from config_manager import check_config_changes, load_config
-from sync_deploy_manager import cancel_jobs, sync_project
+from sync_deploy_manager import configure_maintenance, configure_startup, trigger_pull
+import cluster
+import command_manager
 import genai_utils
+import git_backend
 import git_utils
+import container_state
+import job_executor
+import log_pipeline
+import metrics
+import mirror_cache
+import state_store
+import timer_scheduler
+import webhook_server
+import watch_manager
 
 parser = argparse.ArgumentParser(description="Automatiza el push y pull de repositorios Git y despliega con Docker.")
 parser.add_argument('--config', type=str, default='config.json',
                     help='Ruta al archivo de configuración (ej. config/my_config.json). Por defecto es config.json en el directorio del script.')
 parser.add_argument('--logdir', type=str, default='logs',
                     help='Ruta al archivo de log (ej. /app/logs). Por defecto es logs en el directorio del script.')
+parser.add_argument('--statefile', type=str, default='pipeline_state.db',
+                    help='Ruta a la base SQLite con el estado de las tareas (ej. /app/data/state.db). Por defecto es pipeline_state.db en el directorio del script.')
+parser.add_argument('--instance-id', type=str, default=None,
+                    help='Identificador de esta instancia cuando varias comparten la configuración "cluster". Por defecto es <host>-<pid>.')
 args = parser.parse_args()
 
-log_format = "%(asctime)s [%(levelname)s] %(message)s"
-formatter = logging.Formatter(log_format)
-os.makedirs(args.logdir, exist_ok=True)
-file_handler = TimedRotatingFileHandler(
-    filename=os.path.join(args.logdir, "pipeline.log"),
-    when="midnight",         # Rota cada medianoche
-    interval=1,              # Cada día
-    backupCount=7,           # Mantiene 7 días
-    encoding="utf-8",        # Evita problemas con caracteres
-    utc=False                # Usa hora local
-)
-file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.INFO)
-
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
+# Los hilos solo encolan los registros; un hilo aparte escribe consola, pipeline.log y los archivos por proyecto
+log_pipeline.setup(args.logdir)
 
 running = True
+HEARTBEAT_INTERVAL = 60  # segundos
 config_file = args.config
 config_file_path = os.path.join(os.path.dirname(__file__), config_file)
+state_file_path = os.path.join(os.path.dirname(__file__), args.statefile)
 
 def check_config_and_schedule_jobs():
     config_changed = check_config_changes(config_file_path)
@@ -61,12 +59,24 @@ def check_config_and_schedule_jobs():
             return 
 
         git_utils.configure(config.get('github_user'), config.get('github_email'), config.get('github_token'))
+        git_backend.configure(config.get('git_backend'))
+        log_pipeline.configure(config.get('logging'))
         genai_utils.configure(config.get('google_api_key'))
-
-        cancel_jobs()
-        projects = config.get('projects', [])
-        for project_config in projects:
-            sync_project(project_config)
+        genai_utils.configure_queue(config.get('llm_concurrency'), config.get('llm_requests_per_minute'), config.get('llm_deadline'))
+        job_executor.configure(config.get('max_workers'))
+        command_manager.configure_timeouts(config.get('command_timeouts'))
+        container_state.configure(config.get('container_state_ttl'))
+        configure_startup(config.get('startup_mode'), config.get('startup_jitter'))
+        configure_maintenance(config.get('git_maintenance'))
+        mirror_cache.configure(config.get('mirror_cache'))
+
+        # Con varias instancias, cada una programa solo los proyectos sobre los que tiene lease
+        cluster.configure(config.get('cluster'), args.instance_id)
+        # Solo se agregan, quitan o reprograman los proyectos que cambiaron
+        cluster.set_projects(config.get('projects', []))
+        # Webhooks push: disparan el pull al instante; el intervalo queda como respaldo
+        webhook_server.configure(config.get('webhook'), trigger_pull)
+        metrics.configure(config.get('metrics'))
         logging.info("Configuración recargada y tareas reprogramadas.")
 
 def signal_handler(sig, frame):
@@ -87,9 +97,12 @@ class ConfigChangeHandler(FileSystemEventHandler):
             logging.debug(f"Evento de modificación detectado para: {event.src_path}")
             time.sleep(0.5) 
             check_config_and_schedule_jobs()
+            timer_scheduler.wake()
 
 def main():
 
+    # El estado persistente se abre antes de programar para retomar las tareas donde quedaron
+    state_store.configure(state_file_path)
     check_config_and_schedule_jobs()
 
     observer = Observer()
@@ -99,22 +112,33 @@ def main():
     logging.info(f"Watchdog iniciado para monitorear {config_file_path}.")
 
     try:
-        heartbeat_counter = 0
-        logging.info(f"Iniciando bucle principal. Tareas programadas: {len(schedule.get_jobs())}")
+        last_heartbeat = time.monotonic()
+        logging.info(f"Iniciando bucle principal. Tareas programadas: {len(timer_scheduler.get_jobs())}")
         while running:
-            schedule.run_pending()
-            time.sleep(1)
+            timer_scheduler.run_pending()
+            # Duerme hasta la próxima tarea vencida o hasta que un evento externo despierte al scheduler
+            timer_scheduler.wait(timeout=HEARTBEAT_INTERVAL)
             
             # Log de latido cada 60 segundos para confirmar que el loop está activo
-            heartbeat_counter += 1
-            if heartbeat_counter >= 60:
-                logging.debug(f"Bucle activo. Tareas programadas: {len(schedule.get_jobs())}")
-                heartbeat_counter = 0
+            if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                logging.debug(f"Bucle activo. Tareas programadas: {len(timer_scheduler.get_jobs())}, "
+                              f"en cola: {job_executor.get_queue_depth()}, en ejecución: {job_executor.get_in_flight_count()}")
+                last_heartbeat = time.monotonic()
     except KeyboardInterrupt:
         pass
     finally:
         observer.stop()
         observer.join()
+        watch_manager.stop()
+        webhook_server.stop()
+        metrics.stop()
+        cluster.stop()
+        # Se cortan los comandos en curso (su grupo de procesos) y se espera a que los workers terminen,
+        # antes de cerrar el estado y el log que todavía usan
+        job_executor.cancel_running()
+        job_executor.shutdown(wait=True)
+        state_store.close()
+        log_pipeline.stop()
 
 if __name__ == "__main__":
     signal.signal(signal.SIGINT, signal_handler)
@@ -0,0 +1,241 @@
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import job_executor
+import metrics
+import timer_scheduler
+from sync_deploy_manager import project_key, project_state_id, reconcile_projects
+
+DEFAULT_LEASE_TTL = 30       # segundos sin renovar tras los cuales una instancia se considera caída
+DEFAULT_RENEW_INTERVAL = 10  # segundos entre renovaciones
+INSTANCE_RETENTION = 10      # TTLs tras los cuales se borra el registro de una instancia caída
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS instances (
+    instance_id TEXT PRIMARY KEY,
+    hostname TEXT,
+    started_at REAL,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    project TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+_lock = threading.RLock()
+_settings = None
+_connection = None
+_job = None
+_projects = []        # configuración completa de proyectos (todas las instancias)
+_owned = set()        # ids de proyecto con lease de esta instancia
+_releasing = set()    # con lease propio pero asignados a otra instancia: se sueltan al terminar la tarea en curso
+_live_instances = []
+_renewed_at = 0.0     # última renovación exitosa de los leases
+
+
+def _default_instance_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def configure(settings=None, instance_id=None):
+    """
+    Activa la coordinación entre instancias ({'path', 'instance_id', 'lease_ttl', 'renew_interval'}).
+
+    Cada instancia registra un latido en una base SQLite compartida (`path`, por ejemplo en un
+    volumen común) y toma leases renovables sobre los proyectos que le asigna un hash consistente
+    entre las instancias vivas. Solo se programan los proyectos con lease propio; cuando una
+    instancia cae o se suma, los proyectos se redistribuyen. Sin configuración, esta instancia
+    ejecuta todos los proyectos.
+    """
+    global _settings
+    if settings:
+        settings = {
+            'path': settings.get('path'),
+            'instance_id': instance_id or settings.get('instance_id') or _default_instance_id(),
+            'lease_ttl': settings.get('lease_ttl', DEFAULT_LEASE_TTL),
+            'renew_interval': settings.get('renew_interval', DEFAULT_RENEW_INTERVAL),
+        }
+        if not settings['path']:
+            logging.error("La coordinación entre instancias requiere 'path' (base SQLite compartida). Se ejecutan todos los proyectos.")
+            settings = None
+        elif settings['renew_interval'] >= settings['lease_ttl']:
+            logging.warning("renew_interval debe ser menor que lease_ttl. Se usa un tercio del TTL.")
+            settings['renew_interval'] = settings['lease_ttl'] / 3
+    with _lock:
+        if settings == _settings:
+            return
+        stop()
+        if settings and _open(settings):
+            _settings = settings
+            _schedule_renewal()
+            logging.info(f"Instancia {settings['instance_id']} coordinada mediante {settings['path']} "
+                         f"(lease de {settings['lease_ttl']}s).")
+
+
+def is_enabled():
+    return _settings is not None
+
+
+def _open(settings):
+    global _connection
+    try:
+        directory = os.path.dirname(settings['path'])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Sin WAL: la base puede estar en un volumen compartido entre hosts
+        connection = sqlite3.connect(settings['path'], check_same_thread=False, isolation_level=None, timeout=10)
+        connection.executescript(_SCHEMA)
+        _connection = connection
+        return True
+    except (sqlite3.Error, OSError) as e:
+        logging.error(f"No se pudo abrir la base de coordinación {settings['path']}: {e}. Se ejecutan todos los proyectos.")
+        return False
+
+
+def _schedule_renewal():
+    global _job
+    _job = timer_scheduler.every(_settings['renew_interval']).seconds.tag('cluster').do(rebalance)
+
+
+def _score(instance_id, project):
+    """Rendezvous hashing: cada proyecto va a la instancia viva con el puntaje más alto."""
+    return hashlib.sha256(f"{instance_id}\0{project}".encode('utf-8')).digest()
+
+
+def assign(project, instances):
+    return max(instances, key=lambda instance_id: _score(instance_id, project))
+
+
+def _project_ids(configs):
+    return {project_state_id(project_key(config)): config for config in configs}
+
+
+def _sync_leases(projects):
+    """
+    Registra el latido, calcula qué proyectos corresponden a esta instancia y toma, renueva o
+    libera los leases en una sola transacción. Retorna (proyectos con lease propio, proyectos
+    que pasan a otra instancia y conservan el lease mientras termina su tarea en curso).
+    """
+    global _live_instances, _renewed_at
+    me = _settings['instance_id']
+    ttl = _settings['lease_ttl']
+    now = time.time()
+    connection = _connection
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute("INSERT INTO instances (instance_id, hostname, started_at, heartbeat) VALUES (?, ?, ?, ?) "
+                           "ON CONFLICT (instance_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                           (me, socket.gethostname(), now, now))
+        connection.execute("DELETE FROM instances WHERE heartbeat < ?", (now - ttl * INSTANCE_RETENTION,))
+        live = sorted(row[0] for row in connection.execute("SELECT instance_id FROM instances WHERE heartbeat >= ?", (now - ttl,)))
+
+        wanted = {project for project in projects if assign(project, live) == me}
+        # Un proyecto que pasa a otra instancia se suelta recién cuando termina lo que tiene en curso
+        # (ya no se programa, así que solo puede estar ocupado por la tarea que estaba corriendo)
+        busy = {project for project in _owned - wanted if project in projects and job_executor.is_busy(projects[project]['folder_path'])}
+        for project in wanted | busy:
+            connection.execute("INSERT INTO leases (project, owner, expires_at) VALUES (?, ?, ?) "
+                               "ON CONFLICT (project) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                               "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                               (project, me, now + ttl, now))
+        connection.execute(f"DELETE FROM leases WHERE owner = ? AND project NOT IN ({','.join('?' for _ in wanted | busy)})",
+                           (me, *(wanted | busy)))
+        owned = {row[0] for row in connection.execute("SELECT project FROM leases WHERE owner = ? AND expires_at > ?", (me, now))}
+        connection.execute("COMMIT")
+    except sqlite3.Error:
+        connection.execute("ROLLBACK")
+        raise
+    _live_instances = live
+    _renewed_at = now
+    return owned, owned & busy
+
+
+def _apply(owned, projects, releasing=frozenset()):
+    """
+    Programa los proyectos con lease propio. Los que se están entregando a otra instancia dejan
+    de programarse, pero su tarea en curso termina antes de soltar el lease.
+    """
+    global _owned, _releasing
+    gained, lost = owned - _owned, _owned - owned
+    if gained or lost or releasing != _releasing:
+        logging.info(f"Leases de {_settings['instance_id']}: {len(owned)} proyectos "
+                     f"({len(gained)} tomados, {len(lost)} liberados, {len(releasing)} en entrega) "
+                     f"entre {len(_live_instances)} instancias.")
+    _owned, _releasing = owned, set(releasing)
+    reconcile_projects([config for project, config in projects.items() if project in owned and project not in releasing],
+                       keep_running={project_key(projects[project]) for project in releasing if project in projects})
+
+
+def set_projects(configs):
+    """
+    Recibe la lista completa de proyectos de la configuración y programa los que le corresponden
+    a esta instancia (todos, si la coordinación está desactivada).
+    """
+    global _projects
+    with _lock:
+        _projects = list(configs)
+        if not is_enabled():
+            reconcile_projects(_projects)
+            return
+        rebalance(force=True)
+
+
+def rebalance(force=False):
+    """Renueva los leases y reprograma los proyectos si cambió la asignación."""
+    with _lock:
+        if not is_enabled():
+            return
+        projects = _project_ids(_projects)
+        try:
+            owned, releasing = _sync_leases(projects)
+        except sqlite3.Error as e:
+            logging.error(f"Error al renovar los leases en {_settings['path']}: {e}")
+            # Sin poder renovar, los leases propios vencen y otra instancia los toma: hay que soltarlos antes
+            if _owned and time.time() - _renewed_at >= _settings['lease_ttl'] - _settings['renew_interval']:
+                logging.warning(f"Leases vencidos sin renovar. Se dejan de ejecutar {len(_owned)} proyectos.")
+                _apply(set(), projects)
+            return
+        if force or owned != _owned or releasing != _releasing:
+            _apply(owned, projects, releasing)
+
+
+def get_owned_count():
+    with _lock:
+        return len(_owned)
+
+
+def get_live_instances_count():
+    with _lock:
+        return len(_live_instances) if is_enabled() else 1
+
+
+def stop():
+    """Libera los leases propios (otra instancia los toma en su próxima renovación) y cierra la base."""
+    global _settings, _connection, _job, _owned, _releasing, _live_instances
+    with _lock:
+        if _job is not None:
+            timer_scheduler.cancel_job(_job)
+            _job = None
+        if _connection is not None:
+            try:
+                _connection.execute("DELETE FROM leases WHERE owner = ?", (_settings['instance_id'],))
+                _connection.execute("DELETE FROM instances WHERE instance_id = ?", (_settings['instance_id'],))
+            except sqlite3.Error as e:
+                logging.warning(f"No se pudieron liberar los leases: {e}")
+            _connection.close()
+            _connection = None
+            logging.info(f"Instancia {_settings['instance_id']} retirada de la coordinación.")
+        _settings = None
+        _owned = set()
+        _releasing = set()
+        _live_instances = []
+
+
+metrics.register_gauge('pipeline_cluster_leases', get_owned_count)
+metrics.register_gauge('pipeline_cluster_instances', get_live_instances_count)
@@ -1,56 +1,432 @@
+import collections
+import contextlib
 import logging
+import os
+import selectors
+import signal
 import subprocess
 import threading
+import time
+import metrics
 
-def log_stream(stream, log_level):
-    """Lee un stream línea por línea y lo loguea."""
-    for line in iter(stream.readline, ''):
-        if line:
-            logging.log(log_level, f"  {line.strip()}")
-    stream.close()
+TAIL_LINES = 200             # líneas finales que se guardan para los reportes de error
+ERROR_TAIL_LINES = 50        # de ellas, cuántas se muestran en el log cuando un comando falla
+LOG_BURST = 200              # líneas que se reenvían al log sin límite al comenzar
+LOG_LINES_PER_SECOND = 20    # ritmo sostenido de reenvío al log una vez agotada la ráfaga
+MAX_LINE_LENGTH = 64 * 1024  # una "línea" sin salto de línea se corta a este tamaño
+READ_CHUNK = 64 * 1024
+KILL_GRACE = 5               # segundos entre SIGTERM y SIGKILL al terminar un proceso
+CANCEL_POLL_INTERVAL = 1     # cada cuánto se revisa si la tarea fue cancelada mientras el comando corre
 
-def execute_command(command, shell=False, cwd=None):
+# Tiempo máximo en segundos por tipo de operación (None o 0: sin límite). Se pueden
+# ajustar con 'command_timeouts' en la configuración.
+DEFAULT_TIMEOUTS = {
+    'git': 120,              # operaciones locales: status, add, commit, diff, config
+    'git_remote': 600,       # pull, push, ls-remote
+    'git_maintenance': 1800, # git maintenance run (commit-graph, repack, ...)
+    'docker': 120,           # consultas: ps, config, image inspect
+    'docker_build': 3600,    # docker compose build
+    'docker_deploy': 900,    # docker compose up/down, docker tag
+}
+
+_SIGKILL = getattr(signal, 'SIGKILL', signal.SIGTERM)  # Windows no define SIGKILL
+
+_timeouts = dict(DEFAULT_TIMEOUTS)
+_local = threading.local()
+
+
+def configure_timeouts(timeouts=None):
+    """Aplica los tiempos máximos por operación de la configuración sobre los valores por defecto."""
+    global _timeouts
+    merged = dict(DEFAULT_TIMEOUTS)
+    for operation, value in (timeouts or {}).items():
+        if operation not in DEFAULT_TIMEOUTS:
+            logging.warning(f"Operación desconocida en command_timeouts: {operation}. Debe ser una de {', '.join(DEFAULT_TIMEOUTS)}.")
+            continue
+        merged[operation] = value or None
+    _timeouts = merged
+
+
+def get_timeout(operation):
+    """Devuelve el tiempo máximo configurado para una operación, o None si no tiene límite."""
+    return _timeouts.get(operation)
+
+
+class CommandTimeoutError(subprocess.CalledProcessError):
+    """
+    El comando superó su tiempo máximo y su grupo de procesos fue terminado. Es un
+    CalledProcessError para que los manejadores existentes lo traten como un fallo.
+    """
+
+    def __init__(self, cmd, timeout, returncode=None, output=None, stderr=None, tail=(), log_dropped=0):
+        super().__init__(returncode, cmd, output=output, stderr=stderr)
+        self.timeout = timeout
+        self.tail = list(tail)
+        self.log_dropped = log_dropped
+
+    def __str__(self):
+        return f"Command '{self.cmd}' timed out after {self.timeout} seconds"
+
+
+class CommandCancelledError(subprocess.CalledProcessError):
+    """La tarea que lanzó el comando fue cancelada; el comando se terminó o no llegó a iniciarse."""
+
+    def __init__(self, cmd, returncode=None, output=None, stderr=None, tail=()):
+        super().__init__(returncode, cmd, output=output, stderr=stderr)
+        self.tail = list(tail)
+
+    def __str__(self):
+        return f"Command '{self.cmd}' cancelled"
+
+
+class CancelToken:
+    """
+    Permite cancelar desde otro hilo los comandos de una tarea en curso. Los comandos
+    que se ejecutan con el token activo (ver `cancellation`) se registran en él; al
+    cancelarlo se termina su grupo de procesos y los comandos siguientes no se inician.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self.timed_out = False    # algún comando de la tarea superó su tiempo máximo
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            processes = list(self._processes)
+        for process in processes:
+            _signal_group(process, signal.SIGTERM)
+
+    def _register(self, process):
+        with self._lock:
+            self._processes.add(process)
+            return not self.cancelled
+
+    def _unregister(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+
+@contextlib.contextmanager
+def cancellation(token):
+    """Asocia un CancelToken a los comandos que se ejecuten en este hilo dentro del bloque."""
+    previous = getattr(_local, 'token', None)
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def current_token():
+    return getattr(_local, 'token', None)
+
+
+def is_cancelled():
+    """True si la tarea en curso en este hilo fue cancelada."""
+    token = current_token()
+    return token is not None and token.cancelled
+
+
+class CommandResult(subprocess.CompletedProcess):
+    """
+    Resultado de run_command: como CompletedProcess, más las últimas líneas de salida, la
+    duración y cuántas líneas no se reenviaron al log por el límite de ritmo.
+    """
+
+    def __init__(self, args, returncode, stdout=None, stderr=None, tail=(), duration=0.0, log_dropped=0):
+        super().__init__(args, returncode, stdout, stderr)
+        self.tail = list(tail)
+        self.duration = duration
+        self.log_dropped = log_dropped
+
+
+class OutputLogger:
+    """
+    Reenvía al log las líneas de un comando con un token bucket: una ráfaga inicial de
+    `burst` líneas y luego `rate` líneas por segundo. Las que exceden el límite no se
+    loguean; se cuentan y se informan resumidas.
+    """
+
+    def __init__(self, burst=LOG_BURST, rate=LOG_LINES_PER_SECOND):
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.rate = rate
+        self.updated = time.monotonic()
+        self.dropped = 0
+        self.total_dropped = 0
+
+    def emit(self, level, line):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            self.dropped += 1
+            self.total_dropped += 1
+            return
+        self.tokens -= 1
+        self.flush()
+        logging.log(level, f"  {line}")
+
+    def flush(self):
+        if self.dropped:
+            logging.info(f"  ... {self.dropped} líneas omitidas del log")
+            self.dropped = 0
+
+
+class _StreamReader:
+    """Acumula la salida de un pipe: la divide en líneas para el log y el tail, y opcionalmente la guarda completa."""
+
+    def __init__(self, level, tail, logger, capture, encoding, errors):
+        self.level = level
+        self.tail = tail
+        self.logger = logger
+        self.captured = bytearray() if capture else None
+        self.encoding = encoding
+        self.errors = errors
+        self._pending = bytearray()
+
+    def feed(self, data):
+        if self.captured is not None:
+            self.captured += data
+        self._pending += data
+        while True:
+            index = self._pending.find(b'\n')
+            if index < 0:
+                if len(self._pending) >= MAX_LINE_LENGTH:
+                    self._line(self._pending[:MAX_LINE_LENGTH])
+                    del self._pending[:MAX_LINE_LENGTH]
+                    continue
+                break
+            self._line(self._pending[:index])
+            del self._pending[:index + 1]
+
+    def close(self):
+        if self._pending:
+            self._line(self._pending)
+            self._pending.clear()
+
+    def _line(self, raw):
+        line = bytes(raw).decode(self.encoding, self.errors).rstrip()
+        if not line:
+            return
+        self.tail.append(line)
+        if self.logger is not None:
+            self.logger.emit(self.level, line)
+
+    def text(self):
+        if self.captured is None:
+            return None
+        return bytes(self.captured).decode(self.encoding, self.errors)
+
+
+def _signal_group(process, sig):
+    """Envía una señal a todo el grupo de procesos del comando (incluye los hijos que haya lanzado)."""
+    try:
+        if os.name == 'nt':
+            # En Windows no hay grupos POSIX: taskkill /T termina el árbol de procesos
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+
+def _kill(process):
+    """Termina el grupo de procesos: SIGTERM (git limpia sus locks), y SIGKILL a lo que siga vivo tras KILL_GRACE."""
+    _signal_group(process, signal.SIGTERM)
+    try:
+        process.wait(KILL_GRACE)
+    except subprocess.TimeoutExpired:
+        pass
+    _signal_group(process, _SIGKILL)
+    try:
+        process.wait(KILL_GRACE)
+    except subprocess.TimeoutExpired:
+        logging.error(f"El proceso {process.pid} no terminó tras ser matado.")
+
+
+def _communicate_selector(process, readers, input_data, deadline, token):
+    """
+    Lee stdout y stderr (y escribe stdin) desde un único hilo con un selector.
+    Retorna False si vence el plazo o si la tarea se cancela.
+    """
+    with selectors.DefaultSelector() as selector:
+        for stream, reader in readers.items():
+            selector.register(stream, selectors.EVENT_READ, reader)
+        input_offset = 0
+        if input_data is not None:
+            if input_data:
+                os.set_blocking(process.stdin.fileno(), False)
+                selector.register(process.stdin, selectors.EVENT_WRITE)
+            else:
+                process.stdin.close()
+
+        while selector.get_map():
+            if token is not None and token.cancelled:
+                return False
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            if token is not None:
+                remaining = CANCEL_POLL_INTERVAL if remaining is None else min(remaining, CANCEL_POLL_INTERVAL)
+            for key, _ in selector.select(remaining):
+                if key.fileobj is process.stdin:
+                    try:
+                        input_offset += os.write(key.fd, input_data[input_offset:input_offset + READ_CHUNK])
+                    except BlockingIOError:
+                        continue
+                    except BrokenPipeError:
+                        input_offset = len(input_data)
+                    if input_offset >= len(input_data):
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                    continue
+                data = os.read(key.fd, READ_CHUNK)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    continue
+                key.data.feed(data)
+    return True
+
+
+def _communicate_blocking(process, readers, input_data, deadline, token):
+    """
+    Alternativa para Windows, donde los selectores no admiten pipes: la salida se procesa al terminar.
+    La cancelación termina el árbol de procesos desde CancelToken.cancel, lo que corta la espera.
+    """
+    timeout = None if deadline is None else max(0, deadline - time.monotonic())
+    try:
+        stdout, stderr = process.communicate(input_data, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return False
+    for data, reader in zip((stdout, stderr), readers.values()):
+        reader.feed(data or b'')
+    return True
+
+
+def run_command(command, cwd=None, input=None, check=False, timeout=None, operation=None, shell=False, env=None,
+                capture=True, log_output=False, stderr_level=logging.ERROR, encoding='utf-8', errors='replace'):
+    """
+    Ejecuta un comando leyendo stdout y stderr desde un único hilo, sin hilos auxiliares.
+
+    - capture: guarda la salida completa en result.stdout/result.stderr (texto). Sin captura solo se
+      conservan las últimas TAIL_LINES líneas en result.tail.
+    - log_output: reenvía la salida al log con límite de líneas por segundo.
+    - timeout: segundos máximos; si no se indica, se usa el configurado para `operation`
+      (ver DEFAULT_TIMEOUTS). Al vencer se termina el grupo de procesos y se lanza CommandTimeoutError.
+    - check: lanza subprocess.CalledProcessError si el código de salida no es 0.
+
+    Si la tarea del hilo se cancela (CancelToken), el comando se termina y se lanza
+    CommandCancelledError. Lanza FileNotFoundError si el ejecutable no existe, igual que subprocess.run.
+    """
+    if timeout is None and operation is not None:
+        timeout = get_timeout(operation)
+    token = current_token()
+    if token is not None and token.cancelled:
+        raise CommandCancelledError(command)
+    if isinstance(input, str):
+        input = input.encode(encoding, errors)
+    start = time.monotonic()
+    deadline = None if timeout is None else start + timeout
+    # Cada comando en su propio grupo de procesos, para poder terminar también a sus hijos
+    if os.name == 'nt':
+        group_options = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        group_options = {'start_new_session': True}
+    metrics.inc('pipeline_commands_total', operation=operation or '')
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+        shell=shell,
+        env=env,
+        **group_options
+    )
+    if token is not None and not token._register(process):
+        _kill(process)
+    tail = collections.deque(maxlen=TAIL_LINES)
+    logger = OutputLogger() if log_output else None
+    readers = {
+        process.stdout: _StreamReader(logging.INFO, tail, logger, capture, encoding, errors),
+        process.stderr: _StreamReader(stderr_level, tail, logger, capture, encoding, errors),
+    }
+    communicate = _communicate_blocking if os.name == 'nt' else _communicate_selector
+    try:
+        finished = communicate(process, readers, input, deadline, token)
+        if finished:
+            try:
+                process.wait(None if deadline is None else max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                finished = False
+        if not finished:
+            _kill(process)
+    except BaseException:
+        _kill(process)
+        raise
+    finally:
+        if token is not None:
+            token._unregister(process)
+        for stream in (process.stdin, process.stdout, process.stderr):
+            if stream is not None and not stream.closed:
+                stream.close()
+    for reader in readers.values():
+        reader.close()
+    log_dropped = 0
+    if logger is not None:
+        logger.flush()
+        log_dropped = logger.total_dropped
+
+    stdout, stderr = (reader.text() for reader in readers.values())
+    if token is not None and token.cancelled:
+        raise CommandCancelledError(command, process.returncode, stdout, stderr, tail)
+    if not finished:
+        if token is not None:
+            token.timed_out = True
+        raise CommandTimeoutError(command, timeout, process.returncode, stdout, stderr, tail, log_dropped)
+    result = CommandResult(command, process.returncode, stdout, stderr, tail, time.monotonic() - start, log_dropped)
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, command, stdout,
+                                            stderr if capture else '\n'.join(tail))
+    return result
+
+
+def _log_tail(tail, log_dropped):
+    """Si parte de la salida no llegó al log, muestra las últimas líneas para el diagnóstico."""
+    if log_dropped and tail:
+        lines = tail[-ERROR_TAIL_LINES:]
+        logging.error(f"Últimas {len(lines)} líneas de salida:\n" + '\n'.join(lines))
+
+
+def execute_command(command, shell=False, cwd=None, timeout=None, operation=None):
     """Ejecuta un comando del sistema y muestra la salida en tiempo real."""
+    if isinstance(command, str):
+        command = command.split()
+    cmd_str = ' '.join(command)
     try:
-        if isinstance(command, str):
-            command = command.split()
-        cmd_str = ' '.join(command)
         logging.info(f"Ejecutando comando: {cmd_str}")
         logging.info("-" * 40)  # Línea separadora
-        
-        process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=cwd,
-            shell=shell,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
-        )
-        
-        # Crear hilos para leer stdout y stderr simultáneamente
-        stdout_thread = threading.Thread(target=log_stream, args=(process.stdout, logging.INFO))
-        stderr_thread = threading.Thread(target=log_stream, args=(process.stderr, logging.ERROR)) # O logging.INFO si prefieres no marcar todo stderr como error
-
-        stdout_thread.start()
-        stderr_thread.start()
-
-        # Esperar a que el proceso termine
-        return_code = process.wait()
-
-        # Esperar a que los hilos terminen de leer la salida
-        stdout_thread.join()
-        stderr_thread.join()
-                
+
+        result = run_command(command, cwd=cwd, shell=shell, timeout=timeout, operation=operation, capture=False, log_output=True)
+
         logging.info("-" * 40)  # Línea separadora
-        logging.info(f"Comando {cmd_str} finalizado con código: {return_code}")
-                
-        return return_code == 0
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error al ejecutar el comando {' '.join(command)}: {e}")
-        logging.error(f"Salida del error {' '.join(command)}: {e.stderr}")
+        logging.info(f"Comando {cmd_str} finalizado con código: {result.returncode} ({result.duration:.1f}s)")
+        if result.returncode != 0:
+            _log_tail(result.tail, result.log_dropped)
+        return result.returncode == 0
+    except CommandTimeoutError as e:
+        logging.error(f"El comando {cmd_str} superó el tiempo máximo de {e.timeout}s y fue terminado.")
+        _log_tail(e.tail, e.log_dropped)
+        return False
+    except CommandCancelledError:
+        logging.warning(f"El comando {cmd_str} se interrumpió porque la tarea fue cancelada.")
         return False
     except FileNotFoundError:
-        logging.error(f"Error: {' '.join(command)} no se encontró en el sistema.")
-        return False
\ No newline at end of file
+        logging.error(f"Error: {cmd_str} no se encontró en el sistema.")
+        return False
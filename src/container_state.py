@@ -0,0 +1,116 @@
+import json
+import logging
+import subprocess
+import threading
+import time
+from command_manager import run_command
+
+DEFAULT_TTL = 10  # segundos
+
+PROJECT_LABEL = 'com.docker.compose.project'
+SERVICE_LABEL = 'com.docker.compose.service'
+
+_ttl = DEFAULT_TTL
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()  # una sola consulta en curso aunque varios workers la pidan a la vez
+_states = None       # {proyecto: {servicio: {'state': ..., 'health': ..., 'container': ...}}}
+_expires_at = 0.0
+
+
+def configure(ttl=None):
+    """Configura cuántos segundos se reutiliza el estado consultado."""
+    global _ttl
+    _ttl = DEFAULT_TTL if ttl is None else max(0, ttl)
+
+
+def _parse_labels(labels):
+    result = {}
+    for item in (labels or '').split(','):
+        key, _, value = item.partition('=')
+        if key:
+            result[key] = value
+    return result
+
+
+def _parse_health(status):
+    """Extrae el estado de salud del texto de 'docker ps' (ej. 'Up 2 hours (healthy)')."""
+    status = (status or '').lower()
+    for health in ('unhealthy', 'healthy', 'health: starting'):
+        if f'({health})' in status:
+            return 'starting' if health == 'health: starting' else health
+    return ''
+
+
+def parse_docker_ps(output):
+    """Agrupa por proyecto y servicio la salida de 'docker ps --format {{json .}}'."""
+    states = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        try:
+            container = json.loads(line)
+        except json.JSONDecodeError:
+            logging.debug(f"Línea de 'docker ps' no interpretable: {line}")
+            continue
+        labels = _parse_labels(container.get('Labels'))
+        project = labels.get(PROJECT_LABEL)
+        if not project:
+            continue
+        service = labels.get(SERVICE_LABEL, '')
+        current = {
+            'state': (container.get('State') or '').lower(),
+            'health': _parse_health(container.get('Status')),
+            'container': container.get('Names', ''),
+        }
+        services = states.setdefault(project, {})
+        # Con réplicas, un servicio se considera corriendo si alguno de sus contenedores lo está
+        if service not in services or current['state'] == 'running':
+            services[service] = current
+    return states
+
+
+def refresh():
+    """Consulta con una sola llamada a 'docker ps' el estado de todos los proyectos Compose."""
+    global _states, _expires_at
+    try:
+        result = run_command(
+            ['docker', 'ps', '--all', '--filter', f'label={PROJECT_LABEL}', '--format', '{{json .}}'],
+            check=True,
+            operation='docker'
+        )
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error consultando el estado de los contenedores: {e}")
+        logging.error(f"Salida de error:\n{e.stderr}")
+        return None
+    except FileNotFoundError:
+        logging.error("Error: 'docker' no se encontró en el sistema.")
+        return None
+    states = parse_docker_ps(result.stdout)
+    with _lock:
+        _states = states
+        _expires_at = time.monotonic() + _ttl
+    return states
+
+
+def get_states():
+    """Devuelve el estado de todos los proyectos, reutilizando la última consulta mientras no venza el TTL."""
+    with _refresh_lock:
+        with _lock:
+            if _states is not None and time.monotonic() < _expires_at:
+                return _states
+        return refresh()
+
+
+def get_project_services(project_name):
+    """Devuelve {servicio: {'state', 'health', 'container'}} de un proyecto, o None si no se pudo consultar."""
+    states = get_states()
+    if states is None:
+        return None
+    return states.get(project_name, {})
+
+
+def invalidate():
+    """Descarta el estado cacheado (por ejemplo, después de un despliegue)."""
+    global _expires_at
+    with _lock:
+        _expires_at = 0.0
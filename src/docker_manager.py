@@ -1,83 +1,344 @@
+import json
 import logging
+import os
 import subprocess
-from command_manager import execute_command
+import time
+from command_manager import execute_command, is_cancelled, run_command
+import container_state
+import metrics
+
+DEPLOY_STRATEGIES = ('incremental', 'recreate', 'build_then_swap')
+DEFAULT_HEALTH_TIMEOUT = 120  # segundos
+HEALTH_POLL_INTERVAL = 3      # segundos
 
 def is_docker_compose_project_running(project_name):
     """
     Verifica si algún servicio del proyecto Docker Compose está corriendo.
     Retorna True si al menos un contenedor está activo, False si no.
+
+    El estado sale de container_state, que consulta todos los proyectos con un único
+    'docker ps' y lo reutiliza durante unos segundos.
     """
-    try:
-        if not project_name:
-            logging.error("Error: El nombre del proyecto Docker Compose no esta configurado.")
-            return False
-        
-        logging.info(f"Verificando si el proyecto '{project_name}' está corriendo...")
-        result = subprocess.run(
-            ['docker', 'compose', '-p', project_name, 'ps', '--status=running'],
-            check=True,
-            capture_output=True,
-            text=True
-        )
-        output = result.stdout.strip()
-        
-        if project_name in output:
-            logging.info(f"Servicios en ejecución para el proyecto '{project_name}'.")
-            return True
-        else:
-            logging.info(f"No hay servicios corriendo para el proyecto '{project_name}'.")
-            return False
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error verificando el estado de los servicios Docker Compose: {e}")
-        logging.error(f"Salida estándar:\n{e.stdout}")
-        logging.error(f"Salida de error:\n{e.stderr}")
+    if not project_name:
+        logging.error("Error: El nombre del proyecto Docker Compose no esta configurado.")
         return False
-    except FileNotFoundError:
-        logging.error("Error: 'docker compose' no se encontró en el sistema.")
+
+    services = container_state.get_project_services(project_name)
+    if services is None:
         return False
 
-def execute_docker_compose(folder_path=None, docker_compose_file=None, project_name=None, env_file=None):
-    """Ejecuta los comandos de Docker Compose en la carpeta especificada o con el archivo especificado."""
+    running = sorted(name for name, state in services.items() if state['state'] == 'running')
+    if running:
+        unhealthy = sorted(name for name, state in services.items() if state['health'] == 'unhealthy')
+        logging.info(f"Servicios en ejecución para el proyecto '{project_name}': {', '.join(running)}.")
+        if unhealthy:
+            logging.warning(f"Servicios con healthcheck fallido en '{project_name}': {', '.join(unhealthy)}.")
+        return True
+    else:
+        logging.info(f"No hay servicios corriendo para el proyecto '{project_name}'.")
+        return False
+
+def execute_docker_compose(folder_path=None, docker_compose_file=None, project_name=None, env_file=None, changed_files=None, strategy='incremental',
+                           health_timeout=DEFAULT_HEALTH_TIMEOUT, one_shot_services=None):
+    """
+    Ejecuta los comandos de Docker Compose en la carpeta especificada o con el archivo especificado.
+
+    Con la estrategia 'incremental' y la lista de archivos modificados, solo se reconstruyen
+    y recrean los servicios afectados. Con 'build_then_swap' se construye mientras los
+    contenedores actuales siguen sirviendo, se reemplazan y se vuelve atrás si no pasan
+    el healthcheck (los servicios de `one_shot_services`, como migraciones, pueden terminar
+    con código 0). Si no se puede planificar, se hace el despliegue completo
+    (down, build --no-cache, up).
+
+    Retorna True si el despliegue terminó correctamente.
+    """
     
     try:
         if docker_compose_file and project_name:
-            execute_docker_compose_with_file(docker_compose_file, project_name, env_file)
+            if strategy not in DEPLOY_STRATEGIES:
+                logging.error(f"Estrategia de despliegue no válida: {strategy}. Debe ser una de {', '.join(DEPLOY_STRATEGIES)}. Usando 'recreate'.")
+                strategy = 'recreate'
+            if strategy == 'build_then_swap':
+                return execute_build_then_swap(folder_path, docker_compose_file, project_name, env_file, changed_files, health_timeout,
+                                               one_shot_services)
+            if strategy == 'incremental' and changed_files is not None:
+                plan = plan_deploy(folder_path, docker_compose_file, project_name, env_file, changed_files)
+                if plan is not None:
+                    return execute_deploy_plan(plan, docker_compose_file, project_name, env_file)
+                logging.warning(f"No se pudo planificar el despliegue de {project_name}. Se hace el despliegue completo.")
+            return execute_docker_compose_with_file(docker_compose_file, project_name, env_file)
         elif folder_path:
-            execute_docker_compose_with_folder(folder_path)
+            return execute_docker_compose_with_folder(folder_path)
         else:
             logging.error("Error: Debe proporcionar una carpeta o un archivo Docker Compose y un nombre de proyecto.")
-            return
+            return False
     except Exception as e:
         logging.exception(f"Error al ejecutar Docker Compose: {e}")
+        return False
+    finally:
+        container_state.invalidate()
 
 def execute_docker_compose_with_file(docker_compose_file, project_name, env_file):
     """Ejecuta los comandos de Docker Compose en la carpeta especificada."""
     logging.info(f"Ejecutando Docker Compose {project_name} con archivo: {docker_compose_file}")
     try:
-        if env_file:
-            execute_command(['docker', 'compose', '--env-file', env_file, '-f', docker_compose_file, '-p', project_name, 'down'])
-            execute_command(['docker', 'compose', '--env-file', env_file, '-f', docker_compose_file, '-p', project_name, 'build', '--no-cache'])
-            execute_command(['docker', 'compose', '--env-file', env_file, '-f', docker_compose_file, '-p', project_name, 'up', '-d'])
-        else:
-            execute_command(['docker', 'compose', '-f', docker_compose_file, '-p', project_name, 'down'])
-            execute_command(['docker', 'compose', '-f', docker_compose_file, '-p', project_name, 'build', '--no-cache'])
-            execute_command(['docker', 'compose', '-f', docker_compose_file, '-p', project_name, 'up', '-d'])
+        base = compose_base_command(docker_compose_file, project_name, env_file)
+        execute_command(base + ['down'], operation='docker_deploy')
+        # Si el build falla no se levantan las imágenes viejas como si el despliegue hubiera funcionado
+        if not _compose(base + ['build', '--no-cache'], project_name, 'build'):
+            logging.error(f"Error al construir las imágenes de {project_name}")
+            return False
+        return _compose(base + ['up', '-d'], project_name, 'up')
     except FileNotFoundError:
         logging.error("Error: 'docker compose' no se encontró en el sistema.")
+        return False
+
+def _compose(command, project_name, action):
+    """Ejecuta 'docker compose build' o 'up' registrando su duración en las métricas del proyecto Compose."""
+    operation = 'docker_build' if action == 'build' else 'docker_deploy'
+    with metrics.timer('pipeline_docker_command_seconds', project=project_name, action=action):
+        return execute_command(command, operation=operation)
+
+def compose_base_command(docker_compose_file, project_name, env_file=None):
+    """Devuelve el prefijo 'docker compose [--env-file] -f <archivo> -p <proyecto>'."""
+    command = ['docker', 'compose']
+    if env_file:
+        command += ['--env-file', env_file]
+    return command + ['-f', docker_compose_file, '-p', project_name]
+
+def get_compose_services(docker_compose_file, project_name, env_file=None):
+    """
+    Lee la configuración resuelta del proyecto con 'docker compose config --format json'.
+    Retorna {servicio: {'context': contexto de build absoluto o None si usa solo imagen,
+    'image': nombre de la imagen}}, o None si falla.
+    """
+    try:
+        result = run_command(compose_base_command(docker_compose_file, project_name, env_file) + ['config', '--format', 'json'],
+                             check=True, operation='docker')
+        config = json.loads(result.stdout)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error al leer la configuración de Docker Compose de {project_name}: {e}")
+        logging.error(f"Salida de error:\n{e.stderr}")
+        return None
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        logging.error(f"Error al leer la configuración de Docker Compose de {project_name}: {e}")
+        return None
+
+    services = {}
+    for name, service in (config.get('services') or {}).items():
+        build = service.get('build')
+        context = None
+        if isinstance(build, dict):
+            context = build.get('context')
+        elif isinstance(build, str):
+            context = build
+        # Los contextos remotos (git, URLs) no dependen de los archivos del repositorio local
+        if context and '://' not in context and not context.startswith('git@'):
+            context = os.path.abspath(context)
+        else:
+            context = None
+        image = service.get('image') or f"{project_name}-{name}"
+        services[name] = {'context': context, 'image': image}
+    return services
+
+def _is_within(path, directory):
+    try:
+        return os.path.commonpath([path, directory]) == directory
+    except ValueError:
+        return False
+
+def plan_deploy(folder_path, docker_compose_file, project_name, env_file, changed_files):
+    """
+    Mapea los archivos modificados (relativos a folder_path) sobre los contextos de build de los servicios.
+
+    Retorna un dict con:
+      - 'build': servicios a reconstruir (con caché de capas),
+      - 'recreate_all': True si cambió el archivo compose o el env_file (compose recrea solo lo que difiere),
+    o None si no se pudo leer la configuración.
+    """
+    services = get_compose_services(docker_compose_file, project_name, env_file)
+    if services is None:
+        return None
+
+    base = os.path.abspath(folder_path or os.getcwd())
+    changed = [os.path.abspath(os.path.join(base, path)) for path in changed_files]
+    config_files = {os.path.abspath(f) for f in (docker_compose_file, env_file) if f}
+
+    build = [name for name, service in services.items()
+             if service['context'] and any(_is_within(path, service['context']) for path in changed)]
+    recreate_all = any(path in config_files for path in changed)
+
+    logging.info(f"Plan de despliegue para {project_name}: reconstruir {build or 'ninguno'}"
+                 f"{', recrear servicios con configuración modificada' if recreate_all else ''}.")
+    return {'build': build, 'recreate_all': recreate_all, 'services': services}
+
+def execute_deploy_plan(plan, docker_compose_file, project_name, env_file=None):
+    """Ejecuta un plan de despliegue incremental: build con caché y up sin bajar el proyecto completo."""
+    base = compose_base_command(docker_compose_file, project_name, env_file)
+    if not plan['build'] and not plan['recreate_all']:
+        logging.info(f"Los cambios no afectan a ningún servicio de {project_name}. No se redespliega.")
+        return True
+
+    if plan['build']:
+        if not _compose(base + ['build'] + plan['build'], project_name, 'build'):
+            logging.error(f"Error al construir los servicios {plan['build']} de {project_name}")
+            return False
+        if not plan['recreate_all']:
+            return _compose(base + ['up', '-d', '--no-deps'] + plan['build'], project_name, 'up')
+    # 'up -d' sin lista de servicios: compose recrea solo los que tienen configuración o imagen distinta
+    return _compose(base + ['up', '-d'], project_name, 'up')
+
+def get_compose_service_states(docker_compose_file, project_name, env_file=None):
+    """
+    Devuelve {servicio: {'state': ..., 'health': ...}} leyendo 'docker compose ps --format json'.
+    'health' es '' si el servicio no define healthcheck. Retorna None si falla.
+    """
+    try:
+        result = run_command(compose_base_command(docker_compose_file, project_name, env_file) + ['ps', '--all', '--format', 'json'],
+                             check=True, operation='docker')
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        logging.error(f"Error al consultar el estado de los servicios de {project_name}: {e}")
+        return None
+    return parse_compose_ps(result.stdout)
+
+def parse_compose_ps(output):
+    """Interpreta la salida JSON de 'docker compose ps' (un arreglo o un objeto por línea, según la versión)."""
+    output = output.strip()
+    if not output:
+        return {}
+    try:
+        if output.startswith('['):
+            containers = json.loads(output)
+        else:
+            containers = [json.loads(line) for line in output.splitlines() if line.strip()]
+    except json.JSONDecodeError as e:
+        logging.error(f"No se pudo interpretar la salida de 'docker compose ps': {e}")
+        return None
+    states = {}
+    for container in containers:
+        states[container.get('Service')] = {
+            'state': (container.get('State') or '').lower(),
+            'health': (container.get('Health') or '').lower(),
+            'exit_code': container.get('ExitCode'),
+        }
+    return states
+
+def wait_until_healthy(docker_compose_file, project_name, env_file, services, timeout=DEFAULT_HEALTH_TIMEOUT, one_shot=()):
+    """
+    Espera a que los servicios estén 'healthy' (o 'running' si no tienen healthcheck).
+    Los servicios de `one_shot` (migraciones, inicializaciones declaradas en la configuración
+    del proyecto) también cuentan como sanos si terminaron con código 0.
+    Retorna False si alguno falla o no llega a estar sano antes del timeout.
+    """
+    deadline = time.monotonic() + timeout
+    pending = set(services)
+    while True:
+        states = get_compose_service_states(docker_compose_file, project_name, env_file) or {}
+        for name in list(pending):
+            state = states.get(name, {})
+            if name in one_shot and state.get('state') == 'exited' and state.get('exit_code') == 0:
+                pending.discard(name)
+                continue
+            if state.get('health') == 'unhealthy' or state.get('state') in ('exited', 'dead'):
+                logging.error(f"El servicio {name} de {project_name} no está sano: {state}")
+                return False
+            if state.get('state') == 'running' and state.get('health') in ('', 'healthy'):
+                pending.discard(name)
+        if not pending:
+            return True
+        if time.monotonic() >= deadline:
+            logging.error(f"Timeout esperando el healthcheck de {sorted(pending)} en {project_name}")
+            return False
+        if is_cancelled():
+            logging.warning(f"Espera del healthcheck de {project_name} interrumpida: la tarea fue cancelada.")
+            return False
+        time.sleep(HEALTH_POLL_INTERVAL)
+
+def _get_image_id(image):
+    try:
+        result = run_command(['docker', 'image', 'inspect', '--format', '{{.Id}}', image], check=True, operation='docker')
+        return result.stdout.strip() or None
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+def execute_build_then_swap(folder_path, docker_compose_file, project_name, env_file=None, changed_files=None, health_timeout=DEFAULT_HEALTH_TIMEOUT,
+                            one_shot_services=None):
+    """
+    Despliegue sin downtime: construye las imágenes mientras los contenedores actuales siguen
+    sirviendo, los reemplaza con 'up -d --no-deps', espera el healthcheck y, si falla,
+    restaura las imágenes anteriores y vuelve a levantar los servicios. Los servicios de
+    `one_shot_services` pasan el healthcheck si terminaron con código 0.
+
+    El rollback solo vuelve a etiquetar las imágenes: los cambios del archivo compose o del
+    env_file se mantienen.
+    """
+    base = compose_base_command(docker_compose_file, project_name, env_file)
+    if changed_files is not None:
+        plan = plan_deploy(folder_path, docker_compose_file, project_name, env_file, changed_files)
+    else:
+        services = get_compose_services(docker_compose_file, project_name, env_file)
+        plan = None if services is None else {
+            'build': [name for name, service in services.items() if service['context']],
+            'recreate_all': True,
+            'services': services,
+        }
+    if plan is None:
+        logging.error(f"No se pudo leer la configuración de {project_name}. Se cancela el despliegue build_then_swap.")
+        return False
+    if not plan['build'] and not plan['recreate_all']:
+        logging.info(f"Los cambios no afectan a ningún servicio de {project_name}. No se redespliega.")
+        return True
+
+    # Imágenes actuales para poder volver atrás
+    previous_images = {}
+    for name in plan['build']:
+        image = plan['services'][name]['image']
+        image_id = _get_image_id(image)
+        if image_id:
+            previous_images[name] = (image, image_id)
+
+    if plan['build'] and not _compose(base + ['build'] + plan['build'], project_name, 'build'):
+        logging.error(f"Error al construir {plan['build']} de {project_name}. Los contenedores actuales siguen activos.")
+        return False
+
+    swapped = list(plan['services']) if plan['recreate_all'] else plan['build']
+    # Solo los servicios declarados como one-shot pueden terminar; cualquier otro que salga es un fallo
+    one_shot = set(one_shot_services or ()) & set(swapped)
+    up_command = base + ['up', '-d'] if plan['recreate_all'] else base + ['up', '-d', '--no-deps'] + plan['build']
+    if _compose(up_command, project_name, 'up') and wait_until_healthy(docker_compose_file, project_name, env_file, swapped, health_timeout, one_shot):
+        logging.info(f"Despliegue build_then_swap de {project_name} completado.")
+        return True
+
+    if not previous_images:
+        logging.error(f"El despliegue de {project_name} falló y no hay imágenes anteriores para volver atrás.")
+        return False
+    logging.warning(f"El despliegue de {project_name} no pasó el healthcheck. Volviendo a las imágenes anteriores...")
+    for name, (image, image_id) in previous_images.items():
+        execute_command(['docker', 'tag', image_id, image], operation='docker_deploy')
+    if _compose(base + ['up', '-d', '--no-deps'] + list(previous_images), project_name, 'up'):
+        logging.info(f"Rollback de {project_name} completado: {sorted(previous_images)} "
+                     f"(solo imágenes; los cambios de configuración de compose se mantienen)")
+    else:
+        logging.error(f"Error al hacer rollback de {project_name}")
+    return False
 
 def execute_docker_compose_with_folder(folder_path):
     """Ejecuta los comandos de Docker Compose en la carpeta especificada."""
     logging.info(f"Ejecutando Docker Compose en: {folder_path}")
     try:
-        subprocess.run(['docker', 'compose', 'down'], cwd=folder_path, check=True, capture_output=True)
+        run_command(['docker', 'compose', 'down'], cwd=folder_path, check=True, operation='docker_deploy')
         logging.info(f"Comando 'docker compose down' ejecutado.")
-        result = subprocess.run(['docker', 'compose', 'up', '-d', '--build'], cwd=folder_path, check=True, capture_output=True, text=True)
+        with metrics.timer('pipeline_docker_command_seconds', project=os.path.basename(os.path.abspath(folder_path)), action='up'):
+            result = run_command(['docker', 'compose', 'up', '-d', '--build'], cwd=folder_path, check=True, operation='docker_build')
         logging.info(f"Comando 'docker compose up -d --build' ejecutado.")
         logging.info(f"Docker Compose output:\n{result.stdout}")
+        return True
     except subprocess.CalledProcessError as e:
         logging.error(f"Error al ejecutar Docker Compose en {folder_path}: {e}")
         logging.error(f"Salida estándar:\n{e.stdout}")
         logging.error(f"Salida de error:\n{e.stderr}")
+        return False
     except FileNotFoundError:
         logging.error("Error: 'docker compose' no se encontró en el sistema.")
+        return False
         
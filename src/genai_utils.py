@@ -1,32 +1,220 @@
 import google.generativeai as genai
+import hashlib
 import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import llm_queue
+import metrics
 
 MODEL_NAME = 'gemini-1.5-flash'  # O 'gemini-1.5-pro'
 
+DIFF_TOKEN_BUDGET = 6000       # tokens aproximados del diff enviado al modelo
+CHARS_PER_TOKEN = 4
+MAX_FILES_PER_DIFF = 20        # secciones de archivo (los más grandes primero) incluidas en el prompt
+REQUEST_TIMEOUT = 30           # segundos
+CACHE_SIZE = 256
+
+# Archivos cuyo contenido no aporta al mensaje de commit: se listan en el resumen pero no se envían
+LOCKFILE_NAMES = {
+    'package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 'poetry.lock', 'Pipfile.lock',
+    'Cargo.lock', 'composer.lock', 'Gemfile.lock', 'go.sum', 'packages.lock.json',
+}
+VENDORED_DIRS = ('vendor/', 'node_modules/', 'third_party/', 'dist/', 'build/')
+GENERATED_SUFFIXES = ('.min.js', '.min.css', '.map', '.pb.go', '_pb2.py')
+
+_model = None
+_model_name = MODEL_NAME
+_model_lock = threading.Lock()
+_message_cache = OrderedDict()  # hash del diff -> mensaje
+_cache_lock = threading.Lock()
+_queue = llm_queue.LlmQueue()
+_queue_settings = None
+
 def configure(google_api_key, model_name='gemini-1.5-flash'):
+    global _model, _model_name
     if not google_api_key:
         raise EnvironmentError("La variable GOOGLE_API_KEY no está configurada.  Debes obtener una clave de API de Google AI Studio y configurarla.")
 
     genai.configure(api_key=google_api_key)
-    MODEL_NAME = model_name
+    with _model_lock:
+        _model_name = model_name
+        _model = None  # Se recrea con la nueva configuración en el próximo uso
+
+def configure_queue(concurrency=None, requests_per_minute=None, deadline=None, failure_threshold=None, cooldown=None):
+    """Configura la cola compartida de llamadas al modelo (concurrencia, cupo por minuto, deadline y circuit breaker)."""
+    global _queue, _queue_settings
+    settings = {
+        'concurrency': concurrency or llm_queue.DEFAULT_CONCURRENCY,
+        'requests_per_minute': requests_per_minute or llm_queue.DEFAULT_REQUESTS_PER_MINUTE,
+        'deadline': deadline or llm_queue.DEFAULT_DEADLINE,
+        'failure_threshold': failure_threshold or llm_queue.DEFAULT_FAILURE_THRESHOLD,
+        'cooldown': cooldown if cooldown is not None else llm_queue.DEFAULT_COOLDOWN,
+    }
+    # Sin cambios se conserva la cola: el circuit breaker y el cupo por minuto siguen vigentes
+    if settings == _queue_settings:
+        return
+    old_queue = _queue
+    _queue = llm_queue.LlmQueue(**settings)
+    _queue_settings = settings
+    # Las llamadas en curso terminan en la cola anterior; las nuevas van a la actual
+    old_queue.shutdown(cancel_pending=False)
+
+def set_model(model):
+    """Reemplaza el cliente del modelo (por ejemplo, por un stub con generate_content)."""
+    global _model
+    with _model_lock:
+        _model = model
+
+def _get_model(model_name=None):
+    """Devuelve el cliente del modelo, reutilizado entre llamadas."""
+    global _model
+    model_name = model_name or _model_name
+    with _model_lock:
+        if _model is None or getattr(_model, 'model_name', model_name) not in (model_name, f"models/{model_name}"):
+            _model = genai.GenerativeModel(model_name)
+        return _model
+
+def split_diff(diff):
+    """Separa un diff unificado en secciones por archivo: [(ruta, texto, líneas +, líneas -, binario)]."""
+    sections = []
+    for chunk in re.split(r'(?m)^(?=diff --git )', diff):
+        if not chunk.startswith('diff --git '):
+            continue
+        header = chunk.split('\n', 1)[0]
+        match = re.match(r'diff --git a/(.*) b/(.*)', header)
+        path = match.group(2) if match else header[len('diff --git '):]
+        added = removed = 0
+        for line in chunk.splitlines():
+            if line.startswith('+') and not line.startswith('+++'):
+                added += 1
+            elif line.startswith('-') and not line.startswith('---'):
+                removed += 1
+        binary = bool(re.search(r'(?m)^(Binary files .* differ|GIT binary patch)$', chunk))
+        sections.append((path, chunk, added, removed, binary))
+    return sections
+
+def is_noise_file(path):
+    """Indica si el archivo es un lockfile, código vendorizado o generado."""
+    name = os.path.basename(path)
+    normalized = path.replace('\\', '/')
+    return (name in LOCKFILE_NAMES
+            or any(normalized.startswith(d) or f'/{d}' in normalized for d in VENDORED_DIRS)
+            or name.endswith(GENERATED_SUFFIXES))
+
+def summarize_diff(diff, token_budget=DIFF_TOKEN_BUDGET, max_files=MAX_FILES_PER_DIFF):
+    """
+    Reduce el diff para el prompt: un resumen tipo '--stat' de todos los archivos y el
+    contenido de los archivos con más cambios, descartando binarios, lockfiles y código
+    vendorizado, hasta agotar el presupuesto de tokens.
+    """
+    sections = split_diff(diff)
+    if not sections:
+        return diff[:token_budget * CHARS_PER_TOKEN]
+
+    stat_lines = []
+    candidates = []
+    for path, text, added, removed, binary in sections:
+        if binary:
+            stat_lines.append(f" {path} | binario")
+            continue
+        stat_lines.append(f" {path} | +{added} -{removed}")
+        if not is_noise_file(path):
+            candidates.append((added + removed, path, text))
+    stat = '\n'.join(stat_lines) + f"\n {len(sections)} archivos modificados"
+
+    budget = token_budget * CHARS_PER_TOKEN - len(stat)
+    included = []
+    for _, path, text in sorted(candidates, key=lambda c: c[0], reverse=True)[:max_files]:
+        if budget <= 0:
+            break
+        if len(text) > budget:
+            text = text[:budget] + '\n... (truncado)'
+        included.append(text)
+        budget -= len(text)
+
+    omitted = len(sections) - len(included)
+    summary = f"Resumen:\n{stat}\n\n" + ''.join(included)
+    if omitted:
+        summary += f"\n... ({omitted} archivos omitidos del detalle)"
+    return summary
+
+def generate_local_commit_message(diff):
+    """Genera un mensaje de commit determinista a partir de los archivos del diff, sin usar IA."""
+    paths = [section[0] for section in split_diff(diff)]
+    if not paths:
+        return "chore: actualizar archivos"
+
+    def all_match(predicate):
+        return all(predicate(p) for p in paths)
+
+    if all_match(lambda p: p.lower().endswith(('.md', '.rst', '.txt')) or p.lower().startswith('docs/')):
+        commit_type = 'docs'
+    elif all_match(lambda p: 'test' in p.lower()):
+        commit_type = 'test'
+    elif all_match(lambda p: is_noise_file(p) or os.path.basename(p) in ('requirements.txt', 'package.json', 'pyproject.toml')):
+        commit_type = 'build'
+    else:
+        commit_type = 'chore'
+
+    if len(paths) == 1:
+        description = f"actualizar {os.path.basename(paths[0])}"
+    else:
+        description = f"actualizar {len(paths)} archivos"
+    return f"{commit_type}: {description}"[:50]
+
+def _cache_get(key):
+    with _cache_lock:
+        message = _message_cache.get(key)
+        if message is not None:
+            _message_cache.move_to_end(key)
+        return message
+
+def _cache_put(key, message):
+    with _cache_lock:
+        _message_cache[key] = message
+        _message_cache.move_to_end(key)
+        while len(_message_cache) > CACHE_SIZE:
+            _message_cache.popitem(last=False)
     
-def generate_commit_message(diff, model_name=MODEL_NAME):
+def _request_commit_message(prompt, model_name, timeout):
+    response = _get_model(model_name).generate_content(prompt, request_options={'timeout': timeout})
+    return response.text.strip()
+
+def generate_commit_message(diff, model_name=None, timeout=REQUEST_TIMEOUT):
     """
     Genera un mensaje de commit usando Google AI Studio, dado el diff.
 
     Args:
         diff (str): La salida de 'git diff --staged'.
         model_name (str): El nombre del modelo de Gemini a utilizar (ej. 'gemini-1.5-flash', 'gemini-1.5-pro').
+            Por defecto, el configurado con configure().
+        timeout (float): Segundos máximos de espera de la respuesta del modelo.
 
     Returns:
-        str: El mensaje de commit generado.  Retorna None si hay un error.
+        str: El mensaje de commit generado. Si el modelo falla o no responde a tiempo se usa
+        un mensaje generado localmente. Retorna None si no hay diff.
+
+    La llamada pasa por la cola compartida: si el backend está caído (circuito abierto),
+    sin cupo o no responde antes del deadline, se devuelve el mensaje local sin esperar más.
     """
 
     if not diff:
         logging.info("No hay cambios preparados (staged). No se puede generar un mensaje de commit.")
         return None
 
-    model = genai.GenerativeModel(model_name)
+    cache_key = hashlib.sha256(diff.encode('utf-8', errors='ignore')).hexdigest()
+    cached = _cache_get(cache_key)
+    if cached:
+        logging.info("Mensaje de commit obtenido de la caché.")
+        metrics.inc('pipeline_commit_messages_total', source='cache')
+        return cached
+
+    prompt_diff = summarize_diff(diff)
+    if len(prompt_diff) < len(diff):
+        logging.info(f"Diff reducido para el prompt: {len(diff)} -> {len(prompt_diff)} caracteres.")
 
     prompt = f"""
     Eres un asistente experto en generar mensajes de commit concisos y descriptivos
@@ -38,15 +226,17 @@ def generate_commit_message(diff, model_name=MODEL_NAME):
 
     Diff:
     ```
-    {diff}
+    {prompt_diff}
     ```
 
     Mensaje de commit:
     """
 
+    start = time.monotonic()
+    outcome = 'error'
     try:
-        response = model.generate_content(prompt)
-        commit_message = response.text.strip()
+        commit_message = _queue.call(_request_commit_message, prompt, model_name, timeout)
+        outcome = 'ok'
 
         # Clean up commit message (remove quotes, etc.)
         commit_message = commit_message.replace('"', '')
@@ -55,8 +245,17 @@ def generate_commit_message(diff, model_name=MODEL_NAME):
         # Limit to 50 characters after cleanup.
         commit_message = commit_message[:50]
 
-        return commit_message
+        if commit_message:
+            _cache_put(cache_key, commit_message)
+            metrics.inc('pipeline_commit_messages_total', source='llm')
+            return commit_message
+        logging.warning("El modelo devolvió un mensaje de commit vacío. Usando mensaje local.")
+    except llm_queue.LlmUnavailableError as e:
+        outcome = 'unavailable'
+        logging.warning(f"Backend de IA no disponible ({e}). Usando mensaje local.")
     except Exception as e:
-        logging.error(f"Error al generar el mensaje de commit: {e}")
-        return None
-
+        logging.error(f"Error al generar el mensaje de commit: {e}. Usando mensaje local.")
+    finally:
+        metrics.observe('pipeline_llm_request_seconds', time.monotonic() - start, outcome=outcome)
+    metrics.inc('pipeline_commit_messages_total', source='local')
+    return generate_local_commit_message(diff)
@@ -0,0 +1,583 @@
+import logging
+import os
+import re
+import stat
+import struct
+import threading
+import time
+import metrics
+
+BACKENDS = ('native', 'subprocess')
+DEFAULT_BACKEND = 'native'
+
+# Margen (segundos) para timestamps de carpetas que podrían no reflejar un cambio posterior (granularidad del filesystem)
+RACY_WINDOW = 2
+
+# Por encima de estos tamaños, comparar el índice y las carpetas en Python cuesta más que un
+# 'git status' con core.untrackedCache: no se registra el estado limpio
+MAX_CLEAN_SNAPSHOT_ENTRIES = 20000
+MAX_CLEAN_SNAPSHOT_DIRECTORIES = 5000
+IGNORED_DIRS_TTL = 600  # segundos que se reutiliza la lista de carpetas ignoradas si no cambió ningún archivo de exclusión
+
+# Variables de entorno que cambian dónde busca git el repositorio o el índice: con ellas se delega todo en git
+_GIT_ENV_OVERRIDES = ('GIT_DIR', 'GIT_WORK_TREE', 'GIT_INDEX_FILE', 'GIT_COMMON_DIR', 'GIT_OBJECT_DIRECTORY')
+
+_HEX_RE = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+_SECTION_RE = re.compile(r'^\[\s*([A-Za-z0-9.-]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\](.*)$')
+_KEY_RE = re.compile(r'^([A-Za-z][A-Za-z0-9-]*)\s*(?:=(.*))?$')
+_ESCAPES = {'n': '\n', 't': '\t', 'b': '\b', '\\': '\\', '"': '"'}
+
+# Bits de las entradas del índice
+_STAGE_MASK = 0x3000
+_EXTENDED_FLAG = 0x4000
+_ASSUME_VALID_FLAG = 0x8000
+_SKIP_WORKTREE_FLAG = 0x4000
+_INTENT_TO_ADD_FLAG = 0x2000
+_GITLINK_MODE = 0o160000
+
+_backend = DEFAULT_BACKEND
+_lock = threading.Lock()
+_clean_snapshots = {}  # carpeta -> estado del working tree la última vez que 'git status' no reportó cambios
+_ignored_dirs_cache = {}  # carpeta -> (stat de los archivos de exclusión, vencimiento, carpetas ignoradas)
+
+
+def configure(backend=None):
+    """
+    Elige cómo se resuelven las consultas locales de solo lectura: 'native' lee .git
+    directamente (con git como respaldo) y 'subprocess' ejecuta siempre git.
+    """
+    global _backend
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        logging.warning(f"Backend de git desconocido '{backend}'. Se usa '{DEFAULT_BACKEND}'.")
+        backend = DEFAULT_BACKEND
+    if backend != _backend:
+        logging.info(f"Backend de git para consultas locales: {backend}")
+    _backend = backend
+    if backend != 'native':
+        forget_clean()
+
+
+def is_native():
+    return _backend == 'native'
+
+
+def _count(query, hit):
+    metrics.inc('pipeline_git_native_reads_total', query=query, result='hit' if hit else 'fallback')
+
+
+def _read_text(path):
+    try:
+        with open(path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _git_dirs(cwd):
+    """
+    Devuelve (git_dir, common_dir) del repositorio cuya raíz es `cwd`, siguiendo el archivo
+    '.git' de los worktrees. Retorna None si no se puede resolver sin ejecutar git.
+    """
+    if any(name in os.environ for name in _GIT_ENV_OVERRIDES):
+        return None
+    dot_git = os.path.join(cwd, '.git')
+    if os.path.isdir(dot_git):
+        git_dir = dot_git
+    elif os.path.isfile(dot_git):
+        content = _read_text(dot_git) or ''
+        if not content.startswith('gitdir:'):
+            return None
+        git_dir = os.path.join(cwd, content[len('gitdir:'):].strip())
+    else:
+        return None
+    common_dir = git_dir
+    commondir = _read_text(os.path.join(git_dir, 'commondir'))
+    if commondir:
+        common_dir = os.path.join(git_dir, commondir.strip())
+    return os.path.normpath(git_dir), os.path.normpath(common_dir)
+
+
+def parse_config(text):
+    """
+    Interpreta un archivo de configuración de git y devuelve {'seccion.subseccion.clave': valor}
+    con la misma normalización que 'git config --get-regexp' (sección y clave en minúsculas;
+    ante claves repetidas gana la última). Retorna None si el archivo usa include/includeIf
+    o tiene una sintaxis que no se reconoce.
+    """
+    values = {}
+    section = None
+    lines = text.splitlines()
+    index = 0
+    while index < len(lines):
+        line = lines[index].strip()
+        index += 1
+        if not line or line[0] in '#;':
+            continue
+        if line.startswith('['):
+            match = _SECTION_RE.match(line)
+            if not match:
+                return None
+            name, subsection, line = match.groups()
+            name = name.lower()
+            if name in ('include', 'includeif'):
+                return None
+            if subsection is not None:
+                subsection = re.sub(r'\\(.)', r'\1', subsection)
+                section = f"{name}.{subsection}"
+            else:
+                section = name
+            line = line.strip()
+            if not line or line[0] in '#;':
+                continue
+        if section is None:
+            return None
+        match = _KEY_RE.match(line)
+        if not match:
+            return None
+        key, raw = match.groups()
+        if raw is None:
+            value = 'true'
+        else:
+            value, index = _parse_value(raw, lines, index)
+            if value is None:
+                return None
+        values[f"{section}.{key.lower()}"] = value
+    return values
+
+
+def _parse_value(raw, lines, index):
+    """Interpreta un valor con comillas, escapes, comentarios y continuaciones de línea."""
+    result = []
+    pending_space = ''
+    quoted = False
+    while True:
+        position = 0
+        continued = False
+        while position < len(raw):
+            char = raw[position]
+            position += 1
+            if char == '\\':
+                if position == len(raw):
+                    continued = True
+                    break
+                escaped = _ESCAPES.get(raw[position])
+                if escaped is None:
+                    return None, index
+                position += 1
+                result.append(pending_space + escaped)
+                pending_space = ''
+            elif char == '"':
+                quoted = not quoted
+            elif quoted:
+                result.append(pending_space + char)
+                pending_space = ''
+            elif char in '#;':
+                break
+            elif char.isspace():
+                if result:
+                    pending_space += char
+            else:
+                result.append(pending_space + char)
+                pending_space = ''
+        if not continued:
+            break
+        if index >= len(lines):
+            break
+        raw = lines[index]
+        index += 1
+    if quoted:
+        return None, index
+    return ''.join(result), index
+
+
+def _read_repo_config(common_dir):
+    text = _read_text(os.path.join(common_dir, 'config'))
+    if text is None:
+        return None
+    return parse_config(text)
+
+
+def read_config(cwd):
+    """
+    Lee la configuración local del repositorio (.git/config) sin ejecutar git.
+    Retorna None si el backend es 'subprocess' o si el archivo no se pudo interpretar.
+    """
+    if not is_native():
+        return None
+    dirs = _git_dirs(cwd)
+    values = _read_repo_config(dirs[1]) if dirs else None
+    _count('config', values is not None)
+    return values
+
+
+def _supported(config):
+    """Indica si el formato del repositorio es uno que se sabe leer (refs en archivos, SHA-1/SHA-256)."""
+    if config is None or config.get('core.bare') == 'true' or 'core.worktree' in config:
+        return False
+    return config.get('extensions.refstorage', 'files') == 'files'
+
+
+def _hash_size(config):
+    return 32 if config.get('extensions.objectformat', 'sha1') == 'sha256' else 20
+
+
+def _packed_refs(common_dir):
+    refs = {}
+    text = _read_text(os.path.join(common_dir, 'packed-refs'))
+    for line in (text or '').splitlines():
+        if not line or line[0] in '#^':
+            continue
+        sha, _, name = line.partition(' ')
+        refs[name.strip()] = sha
+    return refs
+
+
+def _resolve_ref(git_dir, common_dir, ref, depth=0):
+    """Resuelve una referencia (simbólica o no) a su hash, buscando refs sueltas y luego packed-refs."""
+    if depth > 5:
+        return None
+    if _HEX_RE.match(ref):
+        return ref
+    if not ref.startswith('ref:'):
+        return None
+    name = ref[len('ref:'):].strip()
+    for base in (git_dir, common_dir):
+        content = _read_text(os.path.join(base, *name.split('/')))
+        if content is not None:
+            return _resolve_ref(git_dir, common_dir, content.strip(), depth + 1)
+    return _packed_refs(common_dir).get(name)
+
+
+def read_head(cwd):
+    """
+    Devuelve el hash del commit HEAD leyendo .git directamente, o None si el backend es
+    'subprocess' o el repositorio no se puede leer sin git (rama sin commits, reftable, etc.).
+    """
+    if not is_native():
+        return None
+    dirs = _git_dirs(cwd)
+    sha = None
+    if dirs and _supported(_read_repo_config(dirs[1])):
+        head = _read_text(os.path.join(dirs[0], 'HEAD'))
+        if head:
+            sha = _resolve_ref(dirs[0], dirs[1], head.strip())
+    _count('head', sha is not None)
+    return sha
+
+
+def read_ref(git_dir, name):
+    """Hash de una referencia ('refs/heads/main') de cualquier repositorio, incluidos los bare, o None."""
+    if not is_native():
+        return None
+    return _resolve_ref(git_dir, git_dir, f"ref: {name}")
+
+
+def _varint(data, position):
+    """Entero de longitud variable del índice versión 4 (mismo formato que los offsets de los packs)."""
+    byte = data[position]
+    position += 1
+    value = byte & 0x7f
+    while byte & 0x80:
+        byte = data[position]
+        position += 1
+        value = ((value + 1) << 7) | (byte & 0x7f)
+    return value, position
+
+
+def index_entry_count(git_dir):
+    """Cantidad de entradas de .git/index, leyendo solo el encabezado. Retorna None si no se pudo leer."""
+    try:
+        with open(os.path.join(git_dir, 'index'), 'rb') as f:
+            header = f.read(12)
+    except OSError:
+        return None
+    if len(header) < 12 or header[:4] != b'DIRC':
+        return None
+    return struct.unpack_from('>I', header, 8)[0]
+
+
+def read_index(git_dir, hash_size=20):
+    """
+    Lee las entradas de .git/index (versiones 2 a 4) que deben compararse contra el working tree:
+    [(ruta, ctime_s, ctime_ns, mtime_s, mtime_ns, inodo, modo, tamaño)]. Retorna None si el índice
+    tiene conflictos, submódulos, archivos 'intent-to-add' o un formato que no se sabe leer.
+    """
+    try:
+        with open(os.path.join(git_dir, 'index'), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if data[:4] != b'DIRC':
+        return None
+    version, count = struct.unpack_from('>II', data, 4)
+    if version not in (2, 3, 4):
+        return None
+
+    entries = []
+    position = 12
+    previous = b''
+    try:
+        for _ in range(count):
+            start = position
+            ctime_s, ctime_ns, mtime_s, mtime_ns, _dev, ino, mode, _uid, _gid, size = struct.unpack_from('>10I', data, position)
+            position += 40 + hash_size
+            flags, = struct.unpack_from('>H', data, position)
+            position += 2
+            extended = 0
+            if flags & _EXTENDED_FLAG:
+                if version < 3:
+                    return None
+                extended, = struct.unpack_from('>H', data, position)
+                position += 2
+            if version == 4:
+                strip, position = _varint(data, position)
+                end = data.index(b'\0', position)
+                name = previous[:len(previous) - strip] + data[position:end]
+                position = end + 1
+            else:
+                end = data.index(b'\0', position)
+                name = data[position:end]
+                position = start + ((end - start + 8) & ~7)
+            previous = name
+
+            if flags & _STAGE_MASK or extended & _INTENT_TO_ADD_FLAG or mode == _GITLINK_MODE:
+                return None
+            if flags & _ASSUME_VALID_FLAG or extended & _SKIP_WORKTREE_FLAG:
+                continue
+            entries.append((os.fsdecode(name), ctime_s, ctime_ns, mtime_s, mtime_ns, ino, mode, size))
+
+        # Un índice dividido (extensión 'link') guarda parte de las entradas en otro archivo
+        while position + 8 <= len(data) - hash_size:
+            signature, length = struct.unpack_from('>4sI', data, position)
+            if signature == b'link':
+                return None
+            position += 8 + length
+    except (struct.error, ValueError, IndexError):
+        return None
+    return entries
+
+
+def _same_time(seconds, nanoseconds, stat_ns):
+    if seconds != stat_ns // 1_000_000_000:
+        return False
+    return not nanoseconds or nanoseconds == stat_ns % 1_000_000_000
+
+
+def _entry_matches(root, entry, index_mtime_ns):
+    """Compara una entrada del índice con el archivo actual, como el chequeo de stat de 'git status'."""
+    path, ctime_s, ctime_ns, mtime_s, mtime_ns, ino, mode, size = entry
+    try:
+        st = os.lstat(os.path.join(root, path))
+    except OSError:
+        return False
+    if stat.S_IFMT(st.st_mode) != stat.S_IFMT(mode):
+        return False
+    if size != st.st_size & 0xffffffff or (ino and ino != st.st_ino & 0xffffffff):
+        return False
+    if not _same_time(mtime_s, mtime_ns, st.st_mtime_ns) or not _same_time(ctime_s, ctime_ns, st.st_ctime_ns):
+        return False
+    # Entrada "racy": modificada en el mismo instante en que se escribió el índice, git compararía el contenido
+    return st.st_mtime_ns < index_mtime_ns
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _directory_mtimes(root, ignored_dirs, limit=None):
+    """
+    mtime de cada carpeta del working tree, salvo .git y las carpetas ignoradas por completo.
+    Retorna None si no se pudo recorrer o si hay más de `limit` carpetas.
+    """
+    mtimes = {}
+    pending = ['']
+    while pending:
+        if limit is not None and len(mtimes) >= limit:
+            return None
+        relative = pending.pop()
+        path = os.path.join(root, relative) if relative else root
+        try:
+            mtimes[relative] = os.stat(path).st_mtime_ns
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name == '.git' or not entry.is_dir(follow_symlinks=False):
+                        continue
+                    child = f"{relative}/{entry.name}" if relative else entry.name
+                    if child not in ignored_dirs:
+                        pending.append(child)
+        except OSError:
+            return None
+    return mtimes
+
+
+def _config_home():
+    return os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+
+
+def _global_config_files():
+    """Archivos de configuración de sistema y globales, en el orden en que git los aplica."""
+    files = []
+    if 'GIT_CONFIG_NOSYSTEM' not in os.environ:
+        files.append(os.environ.get('GIT_CONFIG_SYSTEM') or '/etc/gitconfig')
+    if 'GIT_CONFIG_GLOBAL' in os.environ:
+        files.append(os.environ['GIT_CONFIG_GLOBAL'])
+    else:
+        files += [os.path.join(_config_home(), 'git', 'config'), os.path.join(os.path.expanduser('~'), '.gitconfig')]
+    return [path for path in files if path and path != '/dev/null']
+
+
+def _excludes_file(root, config):
+    """
+    Ruta de core.excludesFile (la configuración del repositorio tiene prioridad sobre la global),
+    o la predeterminada de git. Retorna None si alguna configuración no se pudo interpretar.
+    """
+    excludes_file = None
+    for path in _global_config_files():
+        text = _read_text(path)
+        if text is None:
+            continue
+        values = parse_config(text)
+        if values is None:
+            return None
+        excludes_file = values.get('core.excludesfile', excludes_file)
+    excludes_file = config.get('core.excludesfile', excludes_file)
+    if not excludes_file:
+        return os.path.join(_config_home(), 'git', 'ignore')
+    return os.path.join(root, os.path.expanduser(excludes_file))
+
+
+def _watched_files(root, git_dir, common_dir, config):
+    """
+    Archivos que, si cambian, pueden cambiar el resultado de 'git status' sin tocar el working tree.
+    Retorna None si no se pueden determinar todos.
+    """
+    excludes_file = _excludes_file(root, config)
+    if excludes_file is None:
+        return None
+    return (os.path.join(git_dir, 'index'), os.path.join(git_dir, 'HEAD'), os.path.join(common_dir, 'config'),
+            os.path.join(common_dir, 'info', 'exclude'), excludes_file, *_global_config_files())
+
+
+def _ignored_dirs(root, entries, files, list_ignored_dirs):
+    """
+    Carpetas ignoradas por completo. La lista que devuelve `list_ignored_dirs` (que ejecuta git)
+    se reutiliza mientras no cambien los .gitignore rastreados ni los archivos de exclusión.
+    """
+    gitignores = tuple((path, _stat_key(os.path.join(root, path))) for path, *_ in entries
+                       if path == '.gitignore' or path.endswith('/.gitignore'))
+    key = (gitignores, tuple(sorted(files.items())))
+    now = time.monotonic()
+    with _lock:
+        cached = _ignored_dirs_cache.get(root)
+    if cached and cached[0] == key and cached[1] > now:
+        return cached[2]
+    ignored_dirs = list_ignored_dirs()
+    if ignored_dirs is not None:
+        with _lock:
+            _ignored_dirs_cache[root] = (key, now + IGNORED_DIRS_TTL, ignored_dirs)
+    return ignored_dirs
+
+
+def record_clean(cwd, started, list_ignored_dirs=lambda: ()):
+    """
+    Registra el estado del working tree después de un 'git status' sin cambios que comenzó en
+    `started` (time.time()). `list_ignored_dirs` devuelve las carpetas ignoradas por completo, que
+    no se vigilan (o None si no se pudieron listar). Si algo cambió mientras corría git, o el
+    repositorio supera MAX_CLEAN_SNAPSHOT_ENTRIES / MAX_CLEAN_SNAPSHOT_DIRECTORIES, no se registra
+    y la próxima consulta usa git.
+    """
+    if not is_native():
+        return False
+    root = os.path.abspath(cwd)
+    forget_clean(root)
+    dirs = _git_dirs(root)
+    if not dirs:
+        return False
+    git_dir, common_dir = dirs
+    config = _read_repo_config(common_dir)
+    if not _supported(config):
+        return False
+
+    count = index_entry_count(git_dir)
+    if count is None or count > MAX_CLEAN_SNAPSHOT_ENTRIES:
+        return False
+    watched = _watched_files(root, git_dir, common_dir, config)
+    if watched is None:
+        return False
+
+    files = {path: _stat_key(path) for path in watched}
+    index_key = files[os.path.join(git_dir, 'index')]
+    head = _resolve_ref(git_dir, common_dir, (_read_text(os.path.join(git_dir, 'HEAD')) or '').strip())
+    entries = read_index(git_dir, _hash_size(config))
+    if index_key is None or head is None or entries is None:
+        return False
+    if not all(_entry_matches(root, entry, index_key[0]) for entry in entries):
+        return False
+
+    ignored_dirs = _ignored_dirs(root, entries, files, list_ignored_dirs)
+    if ignored_dirs is None:
+        return False
+    directories = _directory_mtimes(root, {path.rstrip('/') for path in ignored_dirs}, MAX_CLEAN_SNAPSHOT_DIRECTORIES)
+    threshold = int((started - RACY_WINDOW) * 1_000_000_000)
+    if directories is None or any(mtime >= threshold for mtime in directories.values()):
+        return False
+
+    with _lock:
+        _clean_snapshots[root] = {
+            'head': head,
+            'files': files,
+            'entries': entries,
+            'directories': directories,
+        }
+    return True
+
+
+def is_clean(cwd):
+    """
+    Indica sin ejecutar git que el working tree sigue sin cambios desde el último 'git status' limpio:
+    mismos HEAD e índice, archivos rastreados con el mismo stat y carpetas sin entradas nuevas.
+    Retorna True o None (no se puede asegurar: hay que consultar a git).
+    """
+    if not is_native():
+        return None
+    root = os.path.abspath(cwd)
+    with _lock:
+        snapshot = _clean_snapshots.get(root)
+    if snapshot is None:
+        return None
+
+    clean = all(_stat_key(path) == key for path, key in snapshot['files'].items())
+    if clean:
+        dirs = _git_dirs(root)
+        head = _read_text(os.path.join(dirs[0], 'HEAD')) if dirs else None
+        clean = head is not None and _resolve_ref(dirs[0], dirs[1], head.strip()) == snapshot['head']
+    if clean:
+        index_mtime_ns = snapshot['files'][os.path.join(dirs[0], 'index')][0]
+        clean = all(_entry_matches(root, entry, index_mtime_ns) for entry in snapshot['entries'])
+    if clean:
+        for relative, mtime in snapshot['directories'].items():
+            key = _stat_key(os.path.join(root, relative) if relative else root)
+            if key is None or key[0] != mtime:
+                clean = False
+                break
+
+    _count('status', clean)
+    if not clean:
+        forget_clean(root)
+        return None
+    return True
+
+
+def forget_clean(cwd=None):
+    """Descarta el estado limpio registrado de una carpeta (o de todas)."""
+    with _lock:
+        if cwd is None:
+            _clean_snapshots.clear()
+            _ignored_dirs_cache.clear()
+        else:
+            _clean_snapshots.pop(os.path.abspath(cwd), None)
@@ -1,11 +1,29 @@
+import os
 import subprocess
 import logging
-from command_manager import execute_command
+import threading
+import time
+from command_manager import execute_command, run_command
+import git_backend
+import provider_api
 
 _git_config_user = None
 _git_config_email = None
 _git_config_token = None
 
+# Caché del estado remoto/identidad por carpeta: evita reescribir la configuración en cada operación
+_LOCAL_CONFIG_KEYS = ('remote.origin.url', 'user.name', 'user.email', 'remote.origin.promisor', 'remote.origin.partialclonefilter')
+_remote_state = {}  # cwd -> {clave de git config: valor}
+_remote_state_lock = threading.Lock()
+
+# Caché de repositorios existentes por cuenta, obtenida con la API del proveedor
+REPO_LIST_TTL = 300  # segundos
+_repo_list_cache = {}  # (api_base, token) -> (expira_en, {"owner/repo", ...})
+_repo_list_lock = threading.Lock()
+
+# Tareas de 'git maintenance' que se ejecutan por defecto (estrategia incremental de git, sin 'gc' completo)
+MAINTENANCE_TASKS = ('commit-graph', 'loose-objects', 'incremental-repack', 'pack-refs')
+
 def configure(user, email, token=None):
     global _git_config_user, _git_config_email, _git_config_token
     if not user or not email:
@@ -17,18 +35,25 @@ def configure(user, email, token=None):
     _git_config_email = email
     _git_config_token = token # Assign global token
 
-    execute_command(["git", "config", "user.email", _git_config_email], cwd=None)
-    execute_command(["git", "config", "user.name", _git_config_user], cwd=None)
+    # Sin terminal no hay quien responda un pedido de credenciales: git debe fallar en lugar de quedarse esperando
+    os.environ.setdefault('GIT_TERMINAL_PROMPT', '0')
+
+    execute_command(["git", "config", "user.email", _git_config_email], cwd=None, operation='git')
+    execute_command(["git", "config", "user.name", _git_config_user], cwd=None, operation='git')
 
     logging.info("Usuario y email de Git configurados globalmente para commits.")
     if _git_config_token:
         logging.info("Token de Git configurado globalmente para autenticación.")
     return True
 
+def get_default_user():
+    """Devuelve el usuario global configurado con configure()."""
+    return _git_config_user
+
 def get_git_diff(cwd=None):
     """Obtiene la salida de 'git diff --staged'."""
     try:
-        result = subprocess.run(['git', 'diff', '--staged'], capture_output=True, text=True, check=True, cwd=cwd, encoding='utf-8', errors='ignore')
+        result = run_command(['git', 'diff', '--staged'], check=True, cwd=cwd, encoding='utf-8', errors='ignore', operation='git')
         
         if result.stdout:
             logging.debug(f"Salida del comando:\n{result.stdout}")
@@ -43,22 +68,38 @@ def get_git_diff(cwd=None):
         print("Error: 'git' no se encuentra en la ruta del sistema. Asegúrate de que Git esté instalado.")
         return None
 
-def git_pull(cwd, repo_name, github_token_api=None, project_email=None, project_user=None, branch_name='main', gitea_url=None):
-    """Realiza git pull."""
+def git_pull(cwd, repo_name, github_token_api=None, project_email=None, project_user=None, branch_name='main', gitea_url=None, depth=None, source=None):
+    """
+    Realiza git pull. Con `source` (ruta de un mirror local) la rama se baja desde ahí en lugar
+    de origin, actualizando igualmente origin/<rama>.
+
+    Con `depth` solo se descargan los últimos `depth` commits de la rama. Como un historial
+    recortado no tiene base común para un merge o rebase, en ese caso se hace 'git fetch' y el
+    working tree se lleva a origin/<rama> con 'git reset --hard' (solo para proyectos 'pull').
+    """
     try:
         current_user = project_user if project_user else _git_config_user
         current_email = project_email if project_email else _git_config_email
         
-        # Temporarily configure user.email and user.name for this specific operation
-        if current_user and current_email:
-            execute_command(["git", "config", "user.email", current_email], cwd=cwd)
-            execute_command(["git", "config", "user.name", current_user], cwd=cwd)
-
         remote_url = get_remote_url(repo_name, github_token_api, current_user, gitea_url)
         if remote_url:
-            # Temporarily change remote origin for this pull operation
-            execute_command(['git', 'remote', 'set-url', 'origin', remote_url], cwd=cwd)
-            result = execute_command(['git', 'pull', 'origin', branch_name], cwd=cwd)
+            # Solo se reescriben la identidad y el remoto si cambiaron respecto de lo ya configurado
+            if not ensure_local_config(cwd, remote_url, current_user, current_email):
+                return False
+            tracking_ref = f'refs/remotes/origin/{branch_name}'
+            if depth:
+                result = execute_command(['git', 'fetch', f'--depth={depth}', source or 'origin', f'+refs/heads/{branch_name}:{tracking_ref}'],
+                                         cwd=cwd, operation='git_remote') \
+                    and execute_command(['git', 'reset', '--hard', '--quiet', tracking_ref], cwd=cwd, operation='git')
+            else:
+                command = ['git', 'pull']
+                if source:
+                    command += [source, f'+refs/heads/{branch_name}:{tracking_ref}']
+                else:
+                    command += ['origin', branch_name]
+                result = execute_command(command, cwd=cwd, operation='git_remote')
+            if not result:
+                invalidate_remote_state(cwd)
             return result
         else:
             logging.error("No se pudo obtener la URL remota para git pull.")
@@ -78,16 +119,12 @@ def git_push(cwd, repo_name, github_token_api=None, project_email=None, project_
         current_user = project_user if project_user else _git_config_user
         current_email = project_email if project_email else _git_config_email
 
-        # Temporarily configure user.email and user.name for this specific operation
-        if current_user and current_email:
-            execute_command(["git", "config", "user.email", current_email], cwd=cwd)
-            execute_command(["git", "config", "user.name", current_user], cwd=cwd)
-
         remote_url = get_remote_url(repo_name, github_token_api, current_user, gitea_url)
         if remote_url:
-            # Temporarily change remote origin for this push operation
-            execute_command(['git', 'remote', 'set-url', 'origin', remote_url], cwd=cwd)
-            result = subprocess.run(['git', 'push', 'origin', branch_name], capture_output=True, text=True, check=True, cwd=cwd)
+            # Solo se reescriben la identidad y el remoto si cambiaron respecto de lo ya configurado
+            if not ensure_local_config(cwd, remote_url, current_user, current_email):
+                return False
+            result = run_command(['git', 'push', 'origin', branch_name], check=True, cwd=cwd, operation='git_remote')
             logging.info(f"Comando ejecutado: git push origin {branch_name}")
             if result.stdout:
                 logging.info(f"Salida del comando:\n{result.stdout}")
@@ -100,23 +137,141 @@ def git_push(cwd, repo_name, github_token_api=None, project_email=None, project_
     except subprocess.CalledProcessError as e:
         logging.error(f"Error al ejecutar git push: {e}")
         logging.error(f"Salida del error: {e.stderr}")
+        invalidate_remote_state(cwd)
         return False
     except FileNotFoundError as e:
         logging.error(f"Error: Git no encontrado. Asegúrate de que Git esté instalado y en el PATH.")
         return False
 
-def git_add(cwd):
-    """Realiza git add ."""
+def get_changed_paths(cwd):
+    """
+    Devuelve las rutas con cambios (modificadas, nuevas, borradas o renombradas) del working tree.
+
+    Usa 'git status --porcelain=v2 -z', que compara contra la información de stat
+    (tamaño, mtime, inodo) guardada en el índice de git y, con core.untrackedCache,
+    evita recorrer directorios sin cambios. Retorna una lista vacía si no hay cambios
+    y None si no se pudo consultar el estado.
+
+    Con el backend nativo, si nada cambió desde el último status limpio (mismo índice y HEAD,
+    mismo stat en los archivos rastreados y en las carpetas) se responde sin ejecutar git.
+    """
+    if git_backend.is_clean(cwd):
+        return []
+    started = time.time()
     try:
-        result = subprocess.run(['git', 'add', '.'], capture_output=True, text=True, check=True, cwd=cwd)
-        logging.info(f"Comando ejecutado: git add .")
+        result = run_command(['git', 'status', '--porcelain=v2', '-z', '--untracked-files=all'],
+                             check=True, cwd=cwd, encoding='utf-8', errors='surrogateescape', operation='git')
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error al ejecutar 'git status --porcelain=v2': {e}")
+        logging.error(f"Salida del error: {e.stderr}")
+        return None
+    except FileNotFoundError:
+        logging.error("Error: Git no encontrado. Asegúrate de que Git esté instalado y en el PATH.")
+        return None
+
+    paths = []
+    entries = iter(result.stdout.split('\0'))
+    for entry in entries:
+        if not entry:
+            continue
+        kind = entry[0]
+        if kind == '1':
+            paths.append(entry.split(' ', 8)[8])
+        elif kind == '2':
+            paths.append(entry.split(' ', 9)[9])
+            next(entries, None)  # Ruta original del renombrado, ya registrada en el índice
+        elif kind == 'u':
+            paths.append(entry.split(' ', 10)[10])
+        elif kind == '?':
+            paths.append(entry[2:])
+    paths = [path for path in paths if path]
+    if not paths and git_backend.is_native():
+        _record_clean_status(cwd, started)
+    return paths
+
+def _list_ignored_dirs(cwd):
+    """Carpetas ignoradas por completo (node_modules, .venv, build, ...), o None si falla."""
+    try:
+        result = run_command(['git', 'ls-files', '-z', '--others', '--ignored', '--exclude-standard', '--directory'],
+                             check=True, cwd=cwd, encoding='utf-8', errors='surrogateescape', operation='git')
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        logging.debug(f"No se pudieron listar las carpetas ignoradas de {cwd}: {e}")
+        return None
+    return [path for path in result.stdout.split('\0') if path.endswith('/')]
+
+def _record_clean_status(cwd, started):
+    """
+    Registra el working tree limpio para que las próximas consultas no necesiten ejecutar git.
+    Las carpetas ignoradas por completo no se vigilan; su lista solo se vuelve a pedir a git si
+    cambió algún .gitignore o archivo de exclusión.
+    """
+    git_backend.record_clean(cwd, started, lambda: _list_ignored_dirs(cwd))
+
+def enable_status_cache(cwd):
+    """Activa la caché de archivos no rastreados de git para acelerar 'git status'."""
+    try:
+        run_command(['git', 'config', 'core.untrackedCache', 'true'], check=True, cwd=cwd, operation='git')
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.warning(f"No se pudo activar core.untrackedCache en {cwd}: {e.stderr}")
+        return False
+    except FileNotFoundError:
+        logging.error("Error: Git no encontrado. Asegúrate de que Git esté instalado y en el PATH.")
+        return False
+
+def set_sparse_checkout(cwd, paths=None):
+    """
+    Limita el working tree a las carpetas indicadas (sparse-checkout en modo cono; los archivos
+    de la raíz, como el docker-compose.yml, siempre quedan). Sin rutas, desactiva el
+    sparse-checkout si estaba activo.
+    """
+    try:
+        if paths:
+            run_command(['git', 'sparse-checkout', 'set', '--cone', '--'] + list(paths), check=True, cwd=cwd, operation='git')
+            logging.info(f"Sparse-checkout en {cwd}: {', '.join(paths)}")
+            return True
+        config = git_backend.read_config(cwd)
+        if config is None:
+            result = run_command(['git', 'config', '--get', 'core.sparseCheckout'], cwd=cwd, operation='git')
+            enabled = result.stdout.strip() == 'true'
+        else:
+            enabled = config.get('core.sparsecheckout') == 'true'
+        if enabled:
+            run_command(['git', 'sparse-checkout', 'disable'], check=True, cwd=cwd, operation='git')
+            logging.info(f"Sparse-checkout desactivado en {cwd}")
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error al configurar el sparse-checkout en {cwd}: {e}")
+        logging.error(f"Salida del error: {e.stderr}")
+        return False
+    except FileNotFoundError:
+        logging.error("Error: Git no encontrado. Asegúrate de que Git esté instalado y en el PATH.")
+        return False
+
+def run_maintenance(cwd, tasks=None):
+    """Ejecuta 'git maintenance run' con las tareas indicadas (por defecto, MAINTENANCE_TASKS)."""
+    command = ['git', 'maintenance', 'run', '--quiet'] + [f'--task={task}' for task in (tasks or MAINTENANCE_TASKS)]
+    return execute_command(command, cwd=cwd, operation='git_maintenance')
+
+def git_add(cwd, paths=None):
+    """Realiza git add . o, si se indican rutas, agrega solo esas rutas (incluidas las borradas)."""
+    try:
+        if paths:
+            # --literal-pathspecs: las rutas de git status se toman tal cual ('*', '?', '[' o ':' no son patrones)
+            result = run_command(['git', '--literal-pathspecs', 'add', '-A', '--pathspec-from-file=-', '--pathspec-file-nul'],
+                                 input='\0'.join(paths), check=True, cwd=cwd,
+                                 encoding='utf-8', errors='surrogateescape', operation='git')
+            logging.info(f"Comando ejecutado: git add -A ({len(paths)} rutas)")
+        else:
+            result = run_command(['git', 'add', '.'], check=True, cwd=cwd, operation='git')
+            logging.info(f"Comando ejecutado: git add .")
         if result.stdout:
             logging.info(f"Salida del comando:\n{result.stdout}")
         if result.stderr:
             logging.error(f"Error del comando:\n{result.stderr}")
         return result.returncode == 0
     except subprocess.CalledProcessError as e:
-        logging.error(f"Error al ejecutar git add .: {e}")
+        logging.error(f"Error al ejecutar git add: {e}")
         logging.error(f"Salida del error: {e.stderr}")
         return False
     except FileNotFoundError as e:
@@ -126,7 +281,7 @@ def git_add(cwd):
 def git_commit(cwd, commit_message):
     """Realiza git commit -m."""
     try:
-        result = subprocess.run(['git', 'commit', '-m', commit_message], capture_output=True, text=True, check=True, cwd=cwd)
+        result = run_command(['git', 'commit', '-m', commit_message], check=True, cwd=cwd, operation='git')
         logging.info(f"Comando ejecutado: git commit -m {commit_message}")
         if result.stdout:
             logging.info(f"Salida del comando:\n{result.stdout}")
@@ -143,8 +298,10 @@ def git_commit(cwd, commit_message):
 
 def git_status(cwd):
     """Realiza git status --porcelain."""
+    if git_backend.is_clean(cwd):
+        return ''
     try:
-        result = subprocess.run(['git', 'status', '--porcelain'], capture_output=True, text=True, cwd=cwd)
+        result = run_command(['git', 'status', '--porcelain'], cwd=cwd, operation='git')
         return result.stdout
     except subprocess.CalledProcessError as e:
         print(f"Error al ejecutar 'git status --porcelain': {e}")
@@ -154,37 +311,33 @@ def git_status(cwd):
         return None
     
 
-def create_github_repo(repo_name, private=False, github_token_api=None):
-    """Crea un repositorio en GitHub usando la API."""
+def create_repo(repo_name, private=False, github_token_api=None, gitea_url=None):
+    """Crea un repositorio en GitHub o Gitea usando la API del proveedor."""
     global _git_config_user, _git_config_token
 
-    # Use project-specific token if provided, otherwise fallback to global token
-    token_to_use = github_token_api if github_token_api else _git_config_token
+    # Use project-specific token if provided, otherwise fallback to global token (solo GitHub)
+    token_to_use = github_token_api if github_token_api else (None if gitea_url else _git_config_token)
+    provider = "Gitea" if gitea_url else "GitHub"
 
     if not _git_config_user or not token_to_use:
-        logging.error("Usuario de GitHub o token de API no configurados. Llama a configure() o proporciona github_token_api.")
+        logging.error(f"Usuario o token de API de {provider} no configurados. Llama a configure() o proporciona github_token_api.")
         return False
     
     try:
-        url = f"https://api.github.com/user/repos"
-        headers = {
-            "Authorization": f"token {token_to_use}",
-            "Accept": "application/vnd.github.v3+json"
-        }
-        data = {"name": repo_name, "private": private, "auto_init": True}
-
-        import requests
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()  # Lanza una excepción para códigos de error HTTP
-        logging.info(f"Repositorio '{repo_name}' creado en GitHub.")
+        provider_api.get_client(token_to_use, gitea_url).create_repository(repo_name, private)
+        invalidate_repo_list()
         return True
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error al crear el repositorio en GitHub: {e}")
+    except provider_api.ProviderApiError as e:
+        logging.error(f"Error al crear el repositorio en {provider}: {e}")
         return False
     except Exception as e:
-        logging.error(f"Error inesperado al crear el repositorio en GitHub: {e}")
+        logging.error(f"Error inesperado al crear el repositorio en {provider}: {e}")
         return False
 
+def create_github_repo(repo_name, private=False, github_token_api=None):
+    """Crea un repositorio en GitHub usando la API."""
+    return create_repo(repo_name, private, github_token_api)
+
 def get_remote_url(repo_name, github_token_api=None, owner=None, gitea_url=None):
     """Devuelve la URL remota para un repositorio dado, con credenciales y soporte para Gitea."""
     global _git_config_user, _git_config_token
@@ -224,10 +377,171 @@ def get_remote_url(repo_name, github_token_api=None, owner=None, gitea_url=None)
             logging.error("No se pudo construir la URL remota para GitHub. Faltan credenciales o usuario propietario.")
             return None
 
+def _read_local_config(cwd):
+    """Lee en una sola llamada la identidad y la URL de origin configuradas en el repositorio."""
+    config = git_backend.read_config(cwd)
+    if config is not None:
+        return {key: config[key] for key in _LOCAL_CONFIG_KEYS if key in config}
+    pattern = '^(' + '|'.join(key.replace('.', '\\.') for key in _LOCAL_CONFIG_KEYS) + ')$'
+    result = run_command(['git', 'config', '--local', '--get-regexp', pattern], cwd=cwd, operation='git')
+    # Código 1: ninguna clave configurada
+    if result.returncode not in (0, 1):
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+    values = {}
+    for line in result.stdout.splitlines():
+        key, _, value = line.partition(' ')
+        values[key.lower()] = value
+    return values
+
+def ensure_local_config(cwd, remote_url=None, user=None, email=None, partial_clone_filter=None):
+    """
+    Deja configurados origin, user.name y user.email en el repositorio, ejecutando
+    'git config' / 'git remote' solo para los valores que realmente cambiaron.
+    Con `partial_clone_filter` (ej. 'blob:none') origin pasa a ser un remoto "promisor":
+    los fetch descargan solo lo que indica el filtro y el resto se baja cuando se necesita.
+    """
+    desired = {}
+    if remote_url:
+        desired['remote.origin.url'] = remote_url
+    if user and email:
+        desired['user.name'] = user
+        desired['user.email'] = email
+    if partial_clone_filter:
+        desired['remote.origin.promisor'] = 'true'
+        desired['remote.origin.partialclonefilter'] = partial_clone_filter
+
+    try:
+        with _remote_state_lock:
+            state = _remote_state.get(cwd)
+        if state is None:
+            state = _read_local_config(cwd)
+
+        for key, value in desired.items():
+            if state.get(key) == value:
+                continue
+            if key == 'remote.origin.url':
+                action = 'set-url' if key in state else 'add'
+                logging.info(f"Configurando remoto 'origin' en {cwd}")
+                run_command(['git', 'remote', action, 'origin', value], cwd=cwd, check=True, operation='git')
+            else:
+                run_command(['git', 'config', key, value], cwd=cwd, check=True, operation='git')
+            state[key] = value
+
+        with _remote_state_lock:
+            _remote_state[cwd] = state
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error al configurar el repositorio en {cwd}: {e}")
+        logging.error(f"Salida del error: {e.stderr}")
+        invalidate_remote_state(cwd)
+        return False
+    except FileNotFoundError:
+        logging.error("Error: Git no encontrado. Asegúrate de que Git esté instalado y en el PATH.")
+        return False
+
+def invalidate_remote_state(cwd=None):
+    """Descarta la configuración cacheada de una carpeta (o de todas) para releerla en la próxima operación."""
+    with _remote_state_lock:
+        if cwd is None:
+            _remote_state.clear()
+        else:
+            _remote_state.pop(cwd, None)
+
+def repo_exists(repo_name, github_token_api=None, owner=None, gitea_url=None):
+    """
+    Verifica si el repositorio existe usando el listado de repositorios de la cuenta,
+    cacheado durante REPO_LIST_TTL segundos y compartido por todos los proyectos del mismo host.
+    El listado solo incluye los repositorios propios del token (no los de organizaciones ni los
+    públicos de terceros), así que si no aparece se consulta el repositorio puntual y solo un 404
+    cuenta como inexistente. Retorna True/False, o None si no se pudo determinar (sin token o
+    error de la API).
+    """
+    actual_owner = owner if owner else _git_config_user
+    token_to_use = github_token_api if github_token_api else (None if gitea_url else _git_config_token)
+    if not actual_owner or not token_to_use:
+        return None
+
+    client = provider_api.get_client(token_to_use, gitea_url)
+    api_base = client.api_base
+
+    cache_key = (api_base, token_to_use)
+    with _repo_list_lock:
+        cached = _repo_list_cache.get(cache_key)
+        if cached is None or cached[0] < time.monotonic():
+            try:
+                names = client.list_repositories()
+            except Exception as e:
+                logging.warning(f"No se pudo obtener el listado de repositorios de {api_base}: {e}")
+                return None
+            cached = (time.monotonic() + REPO_LIST_TTL, names)
+            _repo_list_cache[cache_key] = cached
+            logging.info(f"Listado de repositorios de {api_base} actualizado: {len(names)} repositorios.")
+    if f"{actual_owner}/{repo_name}".lower() in cached[1]:
+        return True
+    try:
+        return client.repository_exists(actual_owner, repo_name)
+    except Exception as e:
+        logging.warning(f"No se pudo consultar el repositorio {actual_owner}/{repo_name} en {api_base}: {e}")
+        return None
+
+def invalidate_repo_list():
+    """Descarta los listados de repositorios cacheados (por ejemplo, después de crear uno)."""
+    with _repo_list_lock:
+        _repo_list_cache.clear()
+
+def get_remote_head_hash(cwd, repo_name, github_token_api=None, owner=None, branch_name='main', gitea_url=None):
+    """
+    Consulta el hash de la punta de la rama en el remoto con un único 'git ls-remote'.
+    No descarga objetos ni modifica el repositorio local. Retorna None si no se pudo consultar.
+    """
+    remote_url = get_remote_url(repo_name, github_token_api, owner, gitea_url)
+    if not remote_url:
+        logging.error("No se pudo obtener la URL remota para consultar la rama remota.")
+        return None
+    try:
+        result = run_command(['git', 'ls-remote', remote_url, f"refs/heads/{branch_name}"], cwd=cwd, check=True, operation='git_remote')
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error al consultar la rama remota {branch_name} de {repo_name}: {e}")
+        logging.error(f"Salida del error: {e.stderr}")
+        return None
+    except FileNotFoundError:
+        logging.error("Error: Git no encontrado. Asegúrate de que Git esté instalado y en el PATH.")
+        return None
+    output = result.stdout.strip()
+    if not output:
+        return None
+    return output.split()[0]
+
+def get_changed_files(cwd, from_hash, to_hash):
+    """Devuelve las rutas modificadas entre dos commits ('git diff --name-only'), o None si falla."""
+    try:
+        result = run_command(['git', 'diff', '--name-only', '-z', from_hash, to_hash], cwd=cwd, check=True, operation='git')
+        return [path for path in result.stdout.split('\0') if path]
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error al obtener los archivos modificados entre {from_hash} y {to_hash}: {e}")
+        logging.error(f"Salida del error: {e.stderr}")
+        return None
+    except FileNotFoundError:
+        logging.error("Error: Git no encontrado. Asegúrate de que Git esté instalado y en el PATH.")
+        return None
+
+def has_commit(cwd, commit_hash):
+    """Indica si el commit está en el repositorio local (HEAD, o cualquier objeto con 'git cat-file -e')."""
+    if git_backend.read_head(cwd) == commit_hash:
+        return True
+    try:
+        return run_command(['git', 'cat-file', '-e', f'{commit_hash}^{{commit}}'], cwd=cwd, operation='git').returncode == 0
+    except FileNotFoundError:
+        logging.error("Error: Git no encontrado. Asegúrate de que Git esté instalado y en el PATH.")
+        return False
+
 def get_head_hash(cwd):
-    """Obtiene el hash del commit HEAD."""
+    """Obtiene el hash del commit HEAD (leyendo .git con el backend nativo, o con 'git rev-parse')."""
+    head_hash = git_backend.read_head(cwd)
+    if head_hash:
+        return head_hash
     try:
-        result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=cwd, capture_output=True, text=True, check=True)
+        result = run_command(['git', 'rev-parse', 'HEAD'], cwd=cwd, check=True, operation='git')
         return result.stdout.strip()
     except subprocess.CalledProcessError as e:
         logging.error(f"Error al obtener el hash del HEAD: {e}")
@@ -0,0 +1,60 @@
+import logging
+import threading
+from http.server import ThreadingHTTPServer
+
+
+class HttpService:
+    """
+    Un servidor HTTP en un hilo propio que se inicia, reinicia o detiene según la configuración
+    ({'host', 'port', ...}). Lo usan el endpoint de métricas y el servidor de webhooks.
+    """
+
+    def __init__(self, name, description):
+        self.name = name                # nombre del hilo
+        self.description = description  # para el log, ej. "el servidor de webhooks"
+        self.settings = None
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def configure(self, settings, factory, path=''):
+        """
+        Aplica la configuración: `factory(settings)` crea el servidor y `path` solo se usa para
+        mostrar la URL en el log. Sin configuración el servidor queda detenido.
+        """
+        with self._lock:
+            if settings == self.settings and (self._server is not None or settings is None):
+                return
+        self.stop()
+        if settings:
+            self.start(settings, factory, path)
+        self.settings = settings
+
+    def start(self, settings, factory, path=''):
+        with self._lock:
+            try:
+                self._server = factory(settings)
+            except OSError as e:
+                logging.error(f"No se pudo iniciar {self.description} en {settings['host']}:{settings['port']}: {e}")
+                return False
+            self._thread = threading.Thread(target=self._server.serve_forever, name=self.name, daemon=True)
+            self._thread.start()
+            port = self._server.server_port
+        logging.info(f"{self.description[0].upper()}{self.description[1:]} escuchando en http://{settings['host']}:{port}{path}")
+        return True
+
+    def stop(self):
+        with self._lock:
+            server, thread = self._server, self._thread
+            self._server = self._thread = None
+            self.settings = None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            logging.info(f"{self.description[0].upper()}{self.description[1:]} detenido.")
+
+
+class DaemonHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer cuyos hilos de atención no retienen la salida del proceso."""
+    daemon_threads = True
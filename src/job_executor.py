@@ -0,0 +1,167 @@
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import command_manager
+import log_pipeline
+import metrics
+
+DEFAULT_MAX_WORKERS = 4
+
+_executor = None
+_max_workers = DEFAULT_MAX_WORKERS
+_lock = threading.Lock()
+_pending = {}       # project_key -> deque de (tarea, momento en que se encoló)
+_scheduled = set()  # project_key con un worker asignado (en la cola del pool o ejecutando)
+_running = set()    # project_key con una tarea en ejecución
+_tokens = {}        # project_key -> CancelToken de la tarea en ejecución
+_queued_count = 0   # tareas aceptadas pero aún no iniciadas
+_job_ids = itertools.count(1)  # identifica cada ejecución en el log
+
+
+def configure(max_workers=None):
+    """Configura el tamaño del pool de workers. Recrea el pool si el tamaño cambia."""
+    global _executor, _max_workers
+    max_workers = max_workers or DEFAULT_MAX_WORKERS
+    with _lock:
+        if _executor is not None and max_workers == _max_workers:
+            return
+        old_executor = _executor
+        _max_workers = max_workers
+        _executor = ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix="pipeline-worker")
+    if old_executor is not None:
+        # Las tareas ya enviadas terminan en el pool anterior; las nuevas van al actual.
+        old_executor.shutdown(wait=False)
+    logging.info(f"Pool de ejecución configurado con {_max_workers} workers.")
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        configure(_max_workers)
+    return _executor
+
+
+def submit(project_key, func):
+    """
+    Encola una tarea para un proyecto.
+
+    Las tareas de un mismo proyecto se ejecutan en serie; las de proyectos distintos
+    en paralelo, hasta el límite de workers. Si la misma función ya está esperando
+    para ese proyecto no se vuelve a encolar.
+
+    Returns:
+        bool: True si la tarea se encoló, False si ya estaba pendiente.
+    """
+    global _queued_count
+    executor = _get_executor()
+    with _lock:
+        queue = _pending.setdefault(project_key, deque())
+        if any(pending is func for pending, _ in queue):
+            logging.debug(f"Tarea {getattr(func, '__name__', func)} ya pendiente para {project_key}. Se omite.")
+            return False
+        queue.append((func, time.monotonic()))
+        _queued_count += 1
+        if project_key in _scheduled:
+            return True
+        _scheduled.add(project_key)
+    executor.submit(_run, project_key)
+    return True
+
+
+def _next_entry(project_key):
+    """
+    Toma la próxima tarea pendiente del proyecto y lo marca en ejecución. Si no queda ninguna
+    (por ejemplo, se cancelaron mientras el worker esperaba en la cola del pool), libera el proyecto.
+    """
+    global _queued_count
+    with _lock:
+        queue = _pending.get(project_key)
+        if queue:
+            _queued_count -= 1
+            _running.add(project_key)
+            return queue.popleft()
+        _scheduled.discard(project_key)
+        _running.discard(project_key)
+        _pending.pop(project_key, None)
+        return None
+
+
+def _run(project_key):
+    """Ejecuta las tareas pendientes de un proyecto, una tras otra, hasta vaciar su cola."""
+    entry = _next_entry(project_key)
+    while entry is not None:
+        func, enqueued_at = entry
+        # Las tareas de sync_deploy_manager indican su proyecto, igual que el resto de las métricas
+        metrics.observe('pipeline_job_queue_wait_seconds', time.monotonic() - enqueued_at, project=getattr(func, 'project', project_key))
+        token = command_manager.CancelToken()
+        with _lock:
+            _tokens[project_key] = token
+        try:
+            with command_manager.cancellation(token), log_pipeline.context(project=project_key, job_id=str(next(_job_ids))):
+                func()
+        except Exception as e:
+            logging.exception(f"Error no controlado en la tarea de {project_key}: {e}")
+        with _lock:
+            _tokens.pop(project_key, None)
+        entry = _next_entry(project_key)
+
+
+def cancel_pending(project_key=None):
+    """Descarta las tareas en espera (de un proyecto o de todos). Las que están en ejecución terminan."""
+    global _queued_count
+    with _lock:
+        keys = [project_key] if project_key is not None else list(_pending.keys())
+        for key in keys:
+            queue = _pending.get(key)
+            if queue:
+                _queued_count -= len(queue)
+                queue.clear()
+
+
+def cancel_running(project_key=None):
+    """
+    Cancela la tarea en ejecución (de un proyecto o de todos): se termina el comando en curso
+    y los siguientes de esa tarea no se inician. Retorna la cantidad de tareas canceladas.
+    """
+    with _lock:
+        keys = [project_key] if project_key is not None else list(_tokens.keys())
+        tokens = [_tokens[key] for key in keys if key in _tokens]
+    for token in tokens:
+        token.cancel()
+    return len(tokens)
+
+
+def is_busy(project_key):
+    """Indica si el proyecto tiene una tarea en ejecución o esperando."""
+    with _lock:
+        return project_key in _scheduled or bool(_pending.get(project_key))
+
+
+def get_queue_depth():
+    """Devuelve la cantidad de tareas aceptadas que aún no comenzaron (incluye las que esperan un worker libre)."""
+    with _lock:
+        return _queued_count
+
+
+def get_in_flight_count():
+    """Devuelve la cantidad de proyectos con una tarea en ejecución."""
+    with _lock:
+        return len(_running)
+
+
+def shutdown(wait=True):
+    """Detiene el pool de workers."""
+    global _executor
+    cancel_pending()
+    with _lock:
+        executor = _executor
+        _executor = None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+metrics.register_gauge('pipeline_jobs_in_flight', get_in_flight_count)
+metrics.register_gauge('pipeline_jobs_queued', get_queue_depth)
@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+DEFAULT_CONCURRENCY = 2
+DEFAULT_REQUESTS_PER_MINUTE = 15
+DEFAULT_DEADLINE = 30        # segundos máximos que espera quien pide un mensaje
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 300       # segundos con el circuito abierto antes de volver a probar
+
+
+class LlmUnavailableError(Exception):
+    """El backend de IA no está disponible: circuito abierto, sin cupo o sin respuesta a tiempo."""
+
+
+class RateLimiter:
+    """Token bucket: permite hasta `requests_per_minute` llamadas por minuto."""
+
+    def __init__(self, requests_per_minute):
+        self.capacity = max(1, requests_per_minute)
+        self.tokens = float(self.capacity)
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        """Espera un turno como máximo `timeout` segundos. Retorna False si no lo obtuvo."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Abre el circuito tras `failure_threshold` fallos seguidos. Mientras está abierto las
+    llamadas se rechazan al instante; pasado `cooldown` se deja pasar una de prueba.
+    """
+
+    def __init__(self, failure_threshold, cooldown):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._trial_in_progress:
+                return False
+            self._trial_in_progress = True
+            return True
+
+    def release(self):
+        """Libera la llamada de prueba sin registrar resultado (por ejemplo, si no llegó a ejecutarse)."""
+        with self._lock:
+            self._trial_in_progress = False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logging.info("Backend de IA recuperado. Circuito cerrado.")
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_progress = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.warning(f"Backend de IA con {self.failures} fallos seguidos. Circuito abierto por {self.cooldown}s.")
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self.opened_at is not None
+
+
+class LlmQueue:
+    """
+    Cola compartida para las llamadas al modelo: limita la concurrencia y las llamadas
+    por minuto, corta cada llamada al llegar al deadline y aplica un circuit breaker.
+    Quien llama nunca espera más que el deadline.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 deadline=DEFAULT_DEADLINE, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.concurrency = max(1, concurrency)
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="llm-worker")
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.breaker = CircuitBreaker(failure_threshold, cooldown)
+
+    def call(self, func, *args, **kwargs):
+        """Ejecuta func en la cola. Lanza LlmUnavailableError si no se pudo obtener respuesta a tiempo."""
+        if not self.breaker.allow():
+            raise LlmUnavailableError("circuito abierto")
+
+        start = time.monotonic()
+        if not self.rate_limiter.acquire(self.deadline):
+            # Quedarse sin cupo no es un fallo del backend: no cuenta para el circuito
+            self.breaker.release()
+            raise LlmUnavailableError("límite de llamadas por minuto alcanzado")
+        remaining = self.deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            self.breaker.release()
+            raise LlmUnavailableError(f"sin tiempo para llamar al modelo dentro de {self.deadline}s")
+
+        started = threading.Event()
+
+        def run():
+            started.set()
+            return func(*args, **kwargs)
+
+        future = self.executor.submit(run)
+        try:
+            result = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            # Solo cuenta como fallo del backend una llamada que llegó a empezar; si seguía esperando
+            # un worker libre, la demora es local y la llamada se descarta antes de ejecutarse
+            if future.cancel() or not started.is_set():
+                self.breaker.release()
+                raise LlmUnavailableError(f"sin worker libre para llamar al modelo en {self.deadline}s")
+            self.breaker.record_failure()
+            raise LlmUnavailableError(f"sin respuesta en {self.deadline}s")
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def shutdown(self, cancel_pending=True):
+        """Detiene el pool. Sin `cancel_pending`, las llamadas ya enviadas terminan normalmente."""
+        self.executor.shutdown(wait=False, cancel_futures=cancel_pending)
@@ -0,0 +1,306 @@
+import collections
+import contextlib
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+import metrics
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(project_tag)s%(message)s"
+FORMATS = ('text', 'json')
+DROP_POLICIES = ('newest', 'oldest')
+
+DEFAULTS = {
+    'format': 'text',
+    'queue_size': 10000,          # registros en espera de ser escritos
+    'drop_policy': 'newest',      # con la cola llena: descartar el registro nuevo o el más viejo en espera
+    'project_files': True,        # un archivo rotativo por proyecto en <logdir>/projects/
+    'project_max_bytes': 10 * 1024 * 1024,
+    'project_backup_count': 5,
+    'max_open_project_files': 64,
+}
+
+DROP_REPORT_INTERVAL = 10  # segundos entre avisos de registros descartados
+
+_context = contextvars.ContextVar('log_context', default={})
+_lock = threading.Lock()
+_logdir = None
+_settings = None
+_queue_handler = None
+_listener = None
+_handlers = []
+_reporter = None
+
+
+@contextlib.contextmanager
+def context(**fields):
+    """Agrega campos (project, stage, job_id) a los registros de log emitidos dentro del bloque."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copia el contexto del hilo que loguea al registro, antes de que pase a la cola."""
+
+    def filter(self, record):
+        fields = _context.get()
+        record.project = fields.get('project')
+        record.stage = fields.get('stage')
+        record.job_id = fields.get('job_id')
+        record.project_tag = f"[{record.project}] " if record.project else ''
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos de contexto si están presentes."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for field in ('project', 'stage', 'job_id'):
+            value = getattr(record, field, None)
+            if value:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Encola los registros sin bloquear nunca al hilo que loguea. Con la cola llena se descarta
+    el registro nuevo ('newest') o el más viejo en espera ('oldest'); los ERROR y CRITICAL
+    siempre desplazan al más viejo para no perderse.
+    """
+
+    def __init__(self, log_queue, drop_policy):
+        super().__init__(log_queue)
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self.addFilter(ContextFilter())
+
+    def prepare(self, record):
+        # Se resuelven el mensaje y la traza en este hilo; el formatter de cada destino arma la línea final
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if self.drop_policy == 'newest' and record.levelno < logging.ERROR:
+            self._dropped()
+            return
+        try:
+            self.queue.get_nowait()
+            self._dropped()
+        except queue.Empty:
+            pass
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._dropped()
+
+    def _dropped(self):
+        with _lock:
+            self.dropped += 1
+        metrics.inc('pipeline_log_records_dropped_total')
+
+    def take_dropped(self):
+        with _lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class ProjectFileHandler(logging.Handler):
+    """
+    Reparte los registros con proyecto en un archivo rotativo por proyecto. Mantiene abiertos
+    como máximo `max_open` archivos (los menos usados se cierran y se reabren cuando hace falta).
+    """
+
+    def __init__(self, directory, max_bytes, backup_count, max_open):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_open = max_open
+        self._files = collections.OrderedDict()
+
+    def _handler_for(self, project):
+        handler = self._files.get(project)
+        if handler is not None:
+            self._files.move_to_end(project)
+            return handler
+        os.makedirs(self.directory, exist_ok=True)
+        filename = re.sub(r'[^A-Za-z0-9._-]+', '_', project).strip('_') or 'project'
+        handler = RotatingFileHandler(os.path.join(self.directory, f"{filename}.log"), maxBytes=self.max_bytes,
+                                      backupCount=self.backup_count, encoding='utf-8')
+        handler.setFormatter(self.formatter)
+        self._files[project] = handler
+        while len(self._files) > self.max_open:
+            _, oldest = self._files.popitem(last=False)
+            oldest.close()
+        return handler
+
+    def emit(self, record):
+        project = getattr(record, 'project', None)
+        if not project:
+            return
+        try:
+            self._handler_for(project).emit(record)
+        except Exception:
+            self.handleError(record)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        for handler in self._files.values():
+            handler.setFormatter(fmt)
+
+    def close(self):
+        for handler in self._files.values():
+            handler.close()
+        self._files.clear()
+        super().close()
+
+
+class _Listener(QueueListener):
+    """QueueListener que, al detenerse, espera lugar en la cola para la marca de fin en vez de fallar."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class _DropReporter(logging.Handler):
+    """Informa cada tanto, desde el hilo del listener, cuántos registros se descartaron."""
+
+    def __init__(self, queue_handler, handlers):
+        super().__init__()
+        self.queue_handler = queue_handler
+        self.handlers = handlers
+        self.reported_at = time.monotonic()
+
+    def emit(self, record):
+        now = time.monotonic()
+        if now - self.reported_at < DROP_REPORT_INTERVAL:
+            return
+        self.reported_at = now
+        self.report()
+
+    def report(self):
+        dropped = self.queue_handler.take_dropped()
+        if dropped:
+            notice = logging.LogRecord('pipeline', logging.WARNING, __file__, 0,
+                                       f"{dropped} registros de log descartados: la cola de log estaba llena.", None, None)
+            ContextFilter().filter(notice)
+            for handler in self.handlers:
+                if notice.levelno >= handler.level:
+                    handler.handle(notice)
+
+
+def _build_handlers(settings):
+    formatter = JsonFormatter() if settings['format'] == 'json' else logging.Formatter(TEXT_FORMAT)
+
+    file_handler = TimedRotatingFileHandler(
+        filename=os.path.join(_logdir, "pipeline.log"),
+        when="midnight",         # Rota cada medianoche
+        interval=1,              # Cada día
+        backupCount=7,           # Mantiene 7 días
+        encoding="utf-8",        # Evita problemas con caracteres
+        utc=False                # Usa hora local
+    )
+    file_handler.setLevel(logging.INFO)
+    console_handler = logging.StreamHandler()
+    handlers = [file_handler, console_handler]
+    if settings['project_files']:
+        handlers.append(ProjectFileHandler(os.path.join(_logdir, 'projects'), settings['project_max_bytes'],
+                                           settings['project_backup_count'], settings['max_open_project_files']))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def _normalize(settings):
+    settings = {**DEFAULTS, **{key: value for key, value in (settings or {}).items() if key in DEFAULTS}}
+    if settings['format'] not in FORMATS:
+        logging.warning(f"Formato de log no válido: {settings['format']}. Se usa 'text'.")
+        settings['format'] = 'text'
+    if settings['drop_policy'] not in DROP_POLICIES:
+        logging.warning(f"Política de descarte de log no válida: {settings['drop_policy']}. Se usa 'newest'.")
+        settings['drop_policy'] = 'newest'
+    settings['queue_size'] = max(1, settings['queue_size'])
+    return settings
+
+
+def setup(logdir, settings=None):
+    """
+    Configura el logger raíz: los hilos solo encolan los registros (nunca esperan al disco) y un
+    hilo aparte los escribe en consola, en <logdir>/pipeline.log y en un archivo por proyecto.
+    """
+    global _logdir
+    _logdir = logdir
+    os.makedirs(logdir, exist_ok=True)
+    logging.getLogger().setLevel(logging.INFO)
+    configure(settings)
+
+
+def configure(settings=None):
+    """Aplica la configuración de log ({'format', 'queue_size', 'drop_policy', 'project_files', ...})."""
+    global _settings, _queue_handler, _listener, _handlers, _reporter
+    settings = _normalize(settings)
+    if settings == _settings or _logdir is None:
+        return
+    root = logging.getLogger()
+    queue_handler = BoundedQueueHandler(queue.Queue(settings['queue_size']), settings['drop_policy'])
+    # Se reemplaza la lista completa de una vez: cada registro va a la cola anterior o a la nueva, nunca a ambas
+    root.handlers = [handler for handler in root.handlers if handler is not _queue_handler] + [queue_handler]
+    if _listener is not None:
+        # La cola anterior se vacía y sus archivos se cierran antes de abrir los nuevos
+        _close(_listener, _handlers, _reporter)
+    # Mientras tanto los registros nuevos esperan en la cola nueva
+    handlers = _build_handlers(settings)
+    reporter = _DropReporter(queue_handler, handlers)
+    listener = _Listener(queue_handler.queue, *handlers, reporter, respect_handler_level=True)
+    listener.start()
+    _queue_handler, _listener, _handlers, _reporter, _settings = queue_handler, listener, handlers, reporter, settings
+    logging.info(f"Log configurado: formato {settings['format']}, cola de {settings['queue_size']} registros"
+                 f"{', archivos por proyecto' if settings['project_files'] else ''}.")
+
+
+def _close(listener, handlers, reporter):
+    listener.stop()
+    reporter.report()
+    for handler in handlers:
+        handler.close()
+
+
+def stop():
+    """Vacía la cola de log y cierra los archivos."""
+    global _queue_handler, _listener, _handlers, _reporter, _settings
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(_queue_handler)
+    _close(_listener, _handlers, _reporter)
+    _queue_handler = _listener = _reporter = _settings = None
+    _handlers = []
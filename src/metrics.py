@@ -0,0 +1,183 @@
+import contextlib
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http_service import DaemonHTTPServer, HttpService
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9108
+METRICS_PATH = '/metrics'
+
+# Límites (segundos) de los buckets de los histogramas: de operaciones locales de git a builds largos
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# Catálogo de métricas: nombre -> (tipo, descripción)
+DEFINITIONS = {
+    'pipeline_stage_duration_seconds': ('histogram', 'Duración de cada etapa de sincronización y despliegue por proyecto.'),
+    'pipeline_task_duration_seconds': ('histogram', 'Duración total de cada tarea por proyecto.'),
+    'pipeline_task_outcomes_total': ('counter', 'Tareas finalizadas por proyecto, resultado y etapa (noop, error, timeout, ...).'),
+    'pipeline_llm_request_seconds': ('histogram', 'Latencia de las llamadas al modelo para generar mensajes de commit.'),
+    'pipeline_commit_messages_total': ('counter', 'Mensajes de commit generados según su origen (llm, cache, local).'),
+    'pipeline_docker_command_seconds': ('histogram', 'Duración de los comandos docker compose build/up por proyecto Compose.'),
+    'pipeline_scheduler_lag_seconds': ('histogram', 'Atraso entre el horario planificado de una tarea y su disparo real.'),
+    'pipeline_job_queue_wait_seconds': ('histogram', 'Espera de una tarea en el pool desde que se encola hasta que comienza, por proyecto.'),
+    'pipeline_commands_total': ('counter', 'Subprocesos lanzados por tipo de operación.'),
+    'pipeline_mirror_fetches_total': ('counter', 'Actualizaciones de los mirrors compartidos por upstream (fetched, cached, error).'),
+    'pipeline_git_native_reads_total': ('counter', 'Consultas locales de git resueltas leyendo .git (hit) o delegadas en git (fallback).'),
+    'pipeline_log_records_dropped_total': ('counter', 'Registros de log descartados porque la cola de log estaba llena.'),
+    'pipeline_jobs_in_flight': ('gauge', 'Proyectos con una tarea en ejecución.'),
+    'pipeline_jobs_queued': ('gauge', 'Tareas encoladas que aún no comenzaron.'),
+    'pipeline_cluster_leases': ('gauge', 'Proyectos con lease de esta instancia.'),
+    'pipeline_cluster_instances': ('gauge', 'Instancias vivas según los latidos de la base de coordinación.'),
+}
+
+_lock = threading.Lock()
+_values = {}          # nombre -> {etiquetas (tupla ordenada): valor | [conteos por bucket, suma, cantidad]}
+_callbacks = {}       # nombre de gauge -> función que devuelve el valor al momento de la consulta
+_listeners = []       # funciones (nombre, valor, etiquetas) que reciben cada registro, p. ej. el benchmark
+_service = HttpService('metrics-server', 'el endpoint de métricas')
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def add_listener(func):
+    """Registra una función que recibe (nombre, valor, etiquetas) en cada inc() y observe()."""
+    _listeners.append(func)
+
+
+def remove_listener(func):
+    if func in _listeners:
+        _listeners.remove(func)
+
+
+def _notify(name, value, labels):
+    for listener in list(_listeners):
+        listener(name, value, labels)
+
+
+def inc(name, value=1, **labels):
+    """Incrementa un contador."""
+    with _lock:
+        series = _values.setdefault(name, {})
+        key = _key(labels)
+        series[key] = series.get(key, 0) + value
+    _notify(name, value, labels)
+
+
+def observe(name, value, **labels):
+    """Registra una observación en un histograma."""
+    with _lock:
+        series = _values.setdefault(name, {})
+        key = _key(labels)
+        entry = series.get(key)
+        if entry is None:
+            entry = series[key] = [[0] * len(DEFAULT_BUCKETS), 0.0, 0]
+        for index, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                entry[0][index] += 1
+        entry[1] += value
+        entry[2] += 1
+    _notify(name, value, labels)
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    """Mide la duración del bloque y la registra en un histograma (también si el bloque lanza una excepción)."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - start, **labels)
+
+
+def register_gauge(name, func):
+    """Registra un gauge cuyo valor se obtiene llamando a `func` en cada consulta."""
+    _callbacks[name] = func
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Devuelve todas las métricas en el formato de texto de Prometheus."""
+    lines = []
+    with _lock:
+        snapshot = {name: {key: (list(value[0]), value[1], value[2]) if isinstance(value, list) else value
+                           for key, value in series.items()}
+                    for name, series in _values.items()}
+    for name, (kind, description) in DEFINITIONS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        if name in _callbacks:
+            try:
+                lines.append(f"{name} {_format_value(_callbacks[name]())}")
+            except Exception as e:
+                logging.debug(f"No se pudo calcular la métrica {name}: {e}")
+            continue
+        for key, value in sorted(snapshot.get(name, {}).items()):
+            if kind != 'histogram':
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+                continue
+            counts, total, count = value
+            for bound, bucket_count in zip(DEFAULT_BUCKETS, counts):
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Expone las métricas en GET /metrics."""
+
+    server_version = 'PipelineBot'
+
+    def log_message(self, format, *args):
+        logging.debug(f"Métricas {self.address_string()}: {format % args}")
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def configure(settings):
+    """
+    Inicia, reinicia o detiene el endpoint /metrics según la configuración ({'host', 'port'}).
+    Sin configuración el endpoint queda detenido; las métricas se siguen acumulando en memoria.
+    """
+    if settings:
+        settings = {
+            'host': settings.get('host', DEFAULT_HOST),
+            'port': settings.get('port', DEFAULT_PORT),
+        }
+    _service.configure(settings, _create_server, METRICS_PATH)
+
+
+def _create_server(settings):
+    return DaemonHTTPServer((settings['host'], settings['port']), MetricsHandler)
+
+
+def stop():
+    _service.stop()
@@ -0,0 +1,158 @@
+import logging
+import os
+import re
+import subprocess
+import threading
+import urllib.parse
+from command_manager import execute_command, run_command
+import git_backend
+import metrics
+
+# Un mirror nunca descarta objetos: los working trees que lo usan como alternate dependen de ellos
+MIRROR_CONFIG = {
+    'core.logAllRefUpdates': 'true',
+    'gc.auto': '0',
+    'gc.pruneExpire': 'never',
+    'gc.reflogExpire': 'never',
+    'gc.reflogExpireUnreachable': 'never',
+}
+
+_root = None
+_lock = threading.Lock()
+_mirror_locks = {}  # ruta del mirror -> Lock: un solo fetch a la vez por upstream
+
+
+def configure(settings=None):
+    """
+    Activa la caché de mirrors bare ({'path': carpeta}). Los proyectos 'pull' que siguen el mismo
+    upstream comparten un mirror: se descarga una vez y los working trees lo usan como alternate.
+    Sin configuración la caché queda desactivada.
+    """
+    global _root
+    path = (settings or {}).get('path')
+    root = os.path.abspath(os.path.expanduser(path)) if path else None
+    if root != _root:
+        if root:
+            logging.info(f"Caché de mirrors de git en {root}")
+        else:
+            logging.info("Caché de mirrors de git desactivada.")
+    _root = root
+
+
+def is_enabled():
+    return _root is not None
+
+
+def upstream_key(remote_url):
+    """Identifica un upstream por host y ruta, sin credenciales ni '.git' (ej. 'github.com/owner/repo')."""
+    parts = urllib.parse.urlsplit(remote_url)
+    if parts.scheme and parts.hostname:
+        host, path = parts.hostname, parts.path
+        if parts.port:
+            host = f"{host}_{parts.port}"
+    else:
+        # Formato scp de ssh: usuario@host:owner/repo.git
+        host, _, path = remote_url.rpartition('@')[2].partition(':')
+    path = path.strip('/')
+    if path.endswith('.git'):
+        path = path[:-len('.git')]
+    return '/'.join(re.sub(r'[^A-Za-z0-9._-]', '_', part) for part in [host.lower()] + path.split('/') if part)
+
+
+def mirror_path(remote_url):
+    return os.path.join(_root, *upstream_key(remote_url).split('/')) + '.git'
+
+
+def _mirror_lock(path):
+    with _lock:
+        return _mirror_locks.setdefault(path, threading.Lock())
+
+
+def _init_mirror(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    run_command(['git', 'init', '--bare', '--quiet', path], check=True, operation='git')
+    for key, value in MIRROR_CONFIG.items():
+        run_command(['git', 'config', key, value], cwd=path, check=True, operation='git')
+    logging.info(f"Mirror creado en {path}")
+
+
+def ensure_mirror(remote_url):
+    """Crea (si no existe) el mirror bare del upstream. Retorna su ruta, o None si está desactivado o falla."""
+    if not is_enabled():
+        return None
+    path = mirror_path(remote_url)
+    with _mirror_lock(path):
+        if os.path.isfile(os.path.join(path, 'HEAD')):
+            return path
+        try:
+            _init_mirror(path)
+            return path
+        except (OSError, subprocess.CalledProcessError) as e:
+            logging.error(f"No se pudo crear el mirror {path}: {e}")
+            return None
+
+
+def fetch(remote_url, branch_name, expected_hash=None):
+    """
+    Actualiza la rama en el mirror del upstream y retorna la ruta del mirror (None si falla).
+    Si el mirror ya tiene `expected_hash` en la punta de la rama (otro proyecto lo bajó en este
+    mismo tick), no se vuelve a descargar.
+    """
+    path = ensure_mirror(remote_url)
+    if path is None:
+        return None
+    upstream = upstream_key(remote_url)
+    ref = f"refs/heads/{branch_name}"
+    with _mirror_lock(path):
+        if expected_hash and git_backend.read_ref(path, ref) == expected_hash:
+            metrics.inc('pipeline_mirror_fetches_total', upstream=upstream, result='cached')
+            return path
+        fetched = execute_command(['git', 'fetch', '--quiet', remote_url, f'+{ref}:{ref}'], cwd=path, operation='git_remote')
+    metrics.inc('pipeline_mirror_fetches_total', upstream=upstream, result='fetched' if fetched else 'error')
+    if not fetched:
+        logging.error(f"No se pudo actualizar el mirror de {upstream} ({branch_name})")
+        return None
+    return path
+
+
+def _has_objects(objects_dir):
+    try:
+        return any(len(name) == 2 or (name == 'pack' and os.listdir(os.path.join(objects_dir, name)))
+                   for name in os.listdir(objects_dir))
+    except OSError:
+        return False
+
+
+def attach(cwd, path):
+    """
+    Agrega el mirror como alternate del repositorio: los objetos que ya están en el mirror no se
+    copian. Si el repositorio ya tenía historia propia, se reempaqueta una vez sin esos objetos.
+    """
+    git_dir = os.path.join(cwd, '.git')
+    if not os.path.isdir(git_dir):
+        logging.warning(f"{cwd} no tiene una carpeta .git: no se usa el mirror {path}")
+        return False
+    alternates = os.path.join(git_dir, 'objects', 'info', 'alternates')
+    objects = os.path.join(path, 'objects')
+    try:
+        with open(alternates, 'r', encoding='utf-8') as f:
+            current = f.read().splitlines()
+    except FileNotFoundError:
+        current = []
+    except OSError as e:
+        logging.error(f"No se pudo leer {alternates}: {e}")
+        return False
+    if objects in current:
+        return True
+    try:
+        os.makedirs(os.path.dirname(alternates), exist_ok=True)
+        with open(alternates, 'a', encoding='utf-8') as f:
+            f.write(objects + '\n')
+    except OSError as e:
+        logging.error(f"No se pudo registrar el mirror en {alternates}: {e}")
+        return False
+    logging.info(f"{cwd} usa el mirror {path} como alternate")
+    if _has_objects(os.path.join(git_dir, 'objects')):
+        # -l: el nuevo pack omite los objetos que ya provee el mirror
+        execute_command(['git', 'repack', '-a', '-d', '-l', '-q'], cwd=cwd, operation='git_maintenance')
+    return True
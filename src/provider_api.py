@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+GITHUB_API_URL = "https://api.github.com"
+DEFAULT_TIMEOUT = (5, 30)   # (conexión, lectura) en segundos
+MAX_RETRIES = 3
+MAX_RATE_LIMIT_WAIT = 60    # espera máxima en segundos ante un límite de tasa
+POOL_SIZE = 20
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class ProviderApiError(Exception):
+    """Error devuelto por la API del proveedor (GitHub/Gitea) o de conexión con ella."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_session():
+    """Devuelve la sesión HTTP compartida, con conexiones keep-alive reutilizadas entre proyectos."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def _rate_limit_wait(response):
+    """Calcula cuántos segundos esperar según las cabeceras de límite de tasa, o None si no aplica."""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            return None
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        reset = response.headers.get("X-RateLimit-Reset")
+        if reset:
+            try:
+                return max(0.0, float(reset) - time.time())
+            except ValueError:
+                return None
+    return None
+
+
+class ProviderClient:
+    """
+    Cliente base para la API REST de un proveedor Git.
+
+    Reutiliza la sesión compartida, aplica timeouts a cada petición y reintenta
+    ante límites de tasa (429/403 con Retry-After o X-RateLimit-Remaining: 0),
+    errores 5xx y fallos de conexión.
+    """
+
+    name = "provider"
+    page_param = "per_page"
+    page_size = 100
+
+    def __init__(self, api_base, token, session=None, timeout=DEFAULT_TIMEOUT, max_retries=MAX_RETRIES):
+        self.api_base = api_base.rstrip("/")
+        self.token = token
+        self.session = session or get_session()
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+    def _headers(self):
+        return {"Authorization": f"token {self.token}"} if self.token else {}
+
+    def request(self, method, path, **kwargs):
+        """Realiza una petición a la API con reintentos. Retorna el objeto Response."""
+        url = f"{self.api_base}{path}"
+        headers = dict(self._headers(), **kwargs.pop("headers", {}))
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                if attempt > self.max_retries:
+                    raise ProviderApiError(f"Error de conexión con {url}: {e}") from e
+                wait = 2 ** (attempt - 1)
+                logging.warning(f"Error de conexión con {url}: {e}. Reintentando en {wait}s...")
+                time.sleep(wait)
+                continue
+
+            wait = None
+            if response.status_code in (403, 429):
+                wait = _rate_limit_wait(response)
+            elif response.status_code >= 500:
+                wait = 2 ** (attempt - 1)
+
+            if wait is None or attempt > self.max_retries:
+                return response
+            if wait > MAX_RATE_LIMIT_WAIT:
+                logging.warning(f"Límite de tasa de {self.name} excedido; se liberará en {wait:.0f}s. No se reintenta.")
+                return response
+            logging.warning(f"{self.name} respondió {response.status_code} para {method} {path}. Reintentando en {wait:.1f}s...")
+            time.sleep(wait)
+
+    def _check(self, response, action):
+        if response.status_code >= 400:
+            raise ProviderApiError(f"Error al {action} en {self.name}: {response.status_code} {response.text[:200]}",
+                                   response.status_code)
+        return response
+
+    def list_repositories(self):
+        """Devuelve los nombres completos (owner/repo, en minúsculas) de los repositorios accesibles."""
+        names = set()
+        page = 1
+        while True:
+            params = dict(self._list_params(), page=page)
+            params[self.page_param] = self.page_size
+            response = self._check(self.request("GET", "/user/repos", params=params), "listar repositorios")
+            repos = response.json()
+            if not repos:
+                break
+            names.update(repo["full_name"].lower() for repo in repos)
+            if len(repos) < self.page_size:
+                break
+            page += 1
+        return names
+
+    def _list_params(self):
+        return {}
+
+    def repository_exists(self, owner, repo_name):
+        """Consulta si un repositorio existe. Retorna True o False."""
+        response = self.request("GET", f"/repos/{owner}/{repo_name}")
+        if response.status_code == 404:
+            return False
+        self._check(response, f"consultar el repositorio {owner}/{repo_name}")
+        return True
+
+    def create_repository(self, repo_name, private=False):
+        """Crea un repositorio para el usuario autenticado."""
+        data = {"name": repo_name, "private": private, "auto_init": True}
+        self._check(self.request("POST", "/user/repos", json=data), f"crear el repositorio {repo_name}")
+        logging.info(f"Repositorio '{repo_name}' creado en {self.name}.")
+        return True
+
+
+class GitHubClient(ProviderClient):
+    name = "GitHub"
+
+    def __init__(self, token, api_base=GITHUB_API_URL, **kwargs):
+        super().__init__(api_base, token, **kwargs)
+
+    def _headers(self):
+        return dict(super()._headers(), Accept="application/vnd.github.v3+json")
+
+    def _list_params(self):
+        return {"affiliation": "owner,collaborator,organization_member"}
+
+
+class GiteaClient(ProviderClient):
+    name = "Gitea"
+    page_param = "limit"
+    page_size = 50
+
+    def __init__(self, token, gitea_url, **kwargs):
+        super().__init__(f"{normalize_gitea_url(gitea_url)}/api/v1", token, **kwargs)
+
+
+def normalize_gitea_url(gitea_url):
+    """Agrega el protocolo (http por defecto) a la URL de Gitea si falta."""
+    if not gitea_url.startswith(('http://', 'https://')):
+        gitea_url = f"http://{gitea_url}"
+    return gitea_url.rstrip('/')
+
+
+def get_client(token, gitea_url=None, **kwargs):
+    """Devuelve el cliente del proveedor que corresponde a la configuración del proyecto."""
+    if gitea_url:
+        return GiteaClient(token, gitea_url, **kwargs)
+    return GitHubClient(token, **kwargs)
+
+
+class AsyncProviderClient:
+    """
+    Variante asíncrona para operaciones masivas (por ejemplo, consultar muchos repositorios a la vez).
+
+    Ejecuta las llamadas del cliente sincrónico en hilos, con un límite de concurrencia,
+    compartiendo el mismo pool de conexiones.
+    """
+
+    def __init__(self, client, concurrency=8):
+        self.client = client
+        self.concurrency = concurrency
+        self._semaphore = None
+
+    async def _call(self, func, *args, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def list_repositories(self):
+        return await self._call(self.client.list_repositories)
+
+    async def repository_exists(self, owner, repo_name):
+        return await self._call(self.client.repository_exists, owner, repo_name)
+
+    async def create_repository(self, repo_name, private=False):
+        return await self._call(self.client.create_repository, repo_name, private)
+
+    async def repositories_exist(self, repos):
+        """Consulta en paralelo una lista de (owner, repo). Retorna {(owner, repo): bool o excepción}."""
+        results = await asyncio.gather(*(self.repository_exists(owner, name) for owner, name in repos),
+                                       return_exceptions=True)
+        return dict(zip(repos, results))
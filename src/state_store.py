@@ -0,0 +1,121 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = 'pipeline_state.db'
+
+_connection = None
+_lock = threading.Lock()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS task_state (
+    project TEXT NOT NULL,
+    task TEXT NOT NULL,
+    last_run REAL,
+    last_duration REAL,
+    last_outcome TEXT,
+    in_progress INTEGER NOT NULL DEFAULT 0,
+    started_at REAL,
+    PRIMARY KEY (project, task)
+);
+CREATE TABLE IF NOT EXISTS project_state (
+    project TEXT PRIMARY KEY,
+    last_remote_sha TEXT,
+    last_deployed_sha TEXT,
+    updated_at REAL
+);
+"""
+
+_PROJECT_FIELDS = ('last_remote_sha', 'last_deployed_sha')
+
+
+def configure(path=DEFAULT_PATH):
+    """Abre (o crea) la base SQLite de estado en modo WAL. Si falla, el bot sigue sin persistencia."""
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            _connection = connection
+        except (sqlite3.Error, OSError) as e:
+            logging.error(f"No se pudo abrir la base de estado {path}: {e}. Se continúa sin persistencia.")
+            return False
+    logging.info(f"Estado persistente en {path}")
+    return True
+
+
+def _execute(sql, params=()):
+    with _lock:
+        if _connection is None:
+            return None
+        try:
+            return _connection.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Error en la base de estado: {e}")
+            return None
+
+
+def get_task_state(project, task):
+    """Devuelve {'last_run', 'last_duration', 'last_outcome', 'in_progress', 'started_at'} o None."""
+    rows = _execute("SELECT last_run, last_duration, last_outcome, in_progress, started_at FROM task_state "
+                    "WHERE project = ? AND task = ?", (project, task))
+    if not rows:
+        return None
+    last_run, duration, outcome, in_progress, started_at = rows[0]
+    return {'last_run': last_run, 'last_duration': duration, 'last_outcome': outcome,
+            'in_progress': bool(in_progress), 'started_at': started_at}
+
+
+def record_task_start(project, task):
+    """Marca una tarea como en curso; si el proceso muere, queda registrada como interrumpida."""
+    _execute("INSERT INTO task_state (project, task, in_progress, started_at) VALUES (?, ?, 1, ?) "
+             "ON CONFLICT (project, task) DO UPDATE SET in_progress = 1, started_at = excluded.started_at",
+             (project, task, time.time()))
+
+
+def record_task_result(project, task, outcome, duration):
+    """Registra el fin de una tarea con su resultado y duración."""
+    _execute("INSERT INTO task_state (project, task, last_run, last_duration, last_outcome, in_progress) VALUES (?, ?, ?, ?, ?, 0) "
+             "ON CONFLICT (project, task) DO UPDATE SET last_run = excluded.last_run, last_duration = excluded.last_duration, "
+             "last_outcome = excluded.last_outcome, in_progress = 0",
+             (project, task, time.time(), duration, outcome))
+
+
+def get_project_state(project):
+    """Devuelve {'last_remote_sha', 'last_deployed_sha'} del proyecto (valores None si no hay registro)."""
+    rows = _execute("SELECT last_remote_sha, last_deployed_sha FROM project_state WHERE project = ?", (project,))
+    if not rows:
+        return dict.fromkeys(_PROJECT_FIELDS)
+    return dict(zip(_PROJECT_FIELDS, rows[0]))
+
+
+def update_project_state(project, **fields):
+    """Actualiza last_remote_sha y/o last_deployed_sha del proyecto."""
+    fields = {key: value for key, value in fields.items() if key in _PROJECT_FIELDS}
+    if not fields:
+        return
+    columns = ', '.join(fields)
+    placeholders = ', '.join('?' for _ in fields)
+    updates = ', '.join(f"{key} = excluded.{key}" for key in fields)
+    _execute(f"INSERT INTO project_state (project, {columns}, updated_at) VALUES (?, {placeholders}, ?) "
+             f"ON CONFLICT (project) DO UPDATE SET {updates}, updated_at = excluded.updated_at",
+             (project, *fields.values(), time.time()))
+
+
+def close():
+    """Cierra la base de estado."""
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
@@ -1,24 +1,340 @@
+import contextlib
+import datetime
 import os
 import subprocess
 import logging
-import schedule
-from docker_manager import execute_docker_compose, is_docker_compose_project_running
+import time
+import timer_scheduler
+import command_manager
+import metrics
+from docker_manager import DEFAULT_HEALTH_TIMEOUT, execute_docker_compose, is_docker_compose_project_running
 import git_utils
 import genai_utils
+import job_executor
+import log_pipeline
+import mirror_cache
+import state_store
+import watch_manager
 
 jobs = []
+projects = {}  # project_key -> {'config': dict, 'tasks': [funciones], 'maintenance_task': función | None, 'jobs', 'first_runs', 'maintenance': [timer_scheduler.Job]}
+
+STARTUP_MODES = ('immediate', 'deferred')
+_startup_mode = 'immediate'
+_startup_jitter = 0
+
+# Claves del proyecto que solo afectan a la programación: si únicamente cambian estas,
+# basta con reprogramar las tareas existentes sin volver a sincronizar.
+SCHEDULE_ONLY_KEYS = ('interval', 'jitter', 'catch_up')
+
+# Opciones para repositorios grandes: solo se aplican a proyectos 'pull' (sin commits locales que subir)
+PULL_ONLY_KEYS = ('git_depth', 'git_filter', 'sparse_checkout')
+
+# Mantenimiento de git: cada cuántas horas se ejecuta por proyecto y cada cuántos minutos se revisa si toca
+DEFAULT_MAINTENANCE = {'interval': 24, 'window': None, 'tasks': None}
+MAINTENANCE_CHECK_INTERVAL = 10
+_maintenance = dict(DEFAULT_MAINTENANCE)
+
+def configure_startup(mode=None, jitter=None):
+    """
+    Configura cómo se lanza la primera ejecución de cada proyecto.
+
+    'immediate' encola la primera ejecución en el pool apenas se registra el proyecto.
+    'deferred' solo registra las tareas y delega la primera ejecución al scheduler,
+    con un retraso aleatorio de hasta `jitter` segundos para no lanzarlas todas juntas.
+    """
+    global _startup_mode, _startup_jitter
+    mode = mode or 'immediate'
+    if mode not in STARTUP_MODES:
+        logging.error(f"Modo de arranque no válido: {mode}. Debe ser 'immediate' o 'deferred'. Usando 'immediate'.")
+        mode = 'immediate'
+    _startup_mode = mode
+    _startup_jitter = max(0, jitter or 0)
+
+def _parse_window(window):
+    """Convierte 'HH:MM-HH:MM' en (minuto de inicio, minuto de fin) del día."""
+    try:
+        start, end = window.split('-')
+        return tuple(int(hours) * 60 + int(minutes) for hours, minutes in (start.split(':'), end.split(':')))
+    except (AttributeError, ValueError):
+        logging.error(f"Ventana de mantenimiento no válida: {window}. Debe tener el formato 'HH:MM-HH:MM'. Se ignora.")
+        return None
+
+def configure_maintenance(settings=None):
+    """
+    Configura el mantenimiento periódico de los repositorios locales ({'interval', 'window', 'tasks'}).
+
+    Cada `interval` horas (0 lo desactiva) se ejecuta 'git maintenance' en cada proyecto, pero solo
+    cuando el pool está ocioso y, si se indica, dentro de la ventana horaria `window` ('02:00-06:00').
+    Si el mantenimiento se atrasa más de un intervalo completo, se ejecuta aunque haya otras tareas.
+    """
+    global _maintenance
+    settings = settings or {}
+    maintenance = {
+        'interval': max(0, settings.get('interval', DEFAULT_MAINTENANCE['interval']) or 0),
+        'window': _parse_window(settings['window']) if settings.get('window') else None,
+        'tasks': settings.get('tasks') or None,
+    }
+    if maintenance == _maintenance:
+        return
+    _maintenance = maintenance
+    for key in list(projects):
+        _unschedule_project(key, groups=('maintenance',))
+        _schedule_maintenance(key)
+
+def project_key(config):
+    """Identifica un proyecto de la configuración por su carpeta y repositorio."""
+    return (config.get('folder_path'), config.get('repo_name'))
+
+def project_state_id(key):
+    """Identificador del proyecto en el estado persistente."""
+    return f"{key[1]}@{key[0]}"
+
+def _tracked(state_id, task):
+    """
+    Envuelve una tarea para registrar en el estado persistente su inicio, duración y resultado.
+    Si la tarea se canceló el resultado es 'cancelled'; si falló porque un comando superó su
+    tiempo máximo, 'timeout:<etapa>'.
+    """
+    def run():
+        with log_pipeline.context(project=state_id):
+            return run_task()
+
+    def run_task():
+        state_store.record_task_start(state_id, task.__name__)
+        start = time.monotonic()
+        outcome = 'error:exception'
+        try:
+            outcome = task() or 'ok'
+        finally:
+            token = command_manager.current_token()
+            if token is not None and token.cancelled:
+                outcome = 'cancelled'
+            elif token is not None and token.timed_out and outcome.startswith('error:'):
+                outcome = 'timeout:' + outcome.split(':', 1)[1]
+            if outcome != 'ok' and outcome != 'noop':
+                logging.warning(f"Tarea {task.__name__} de {state_id} finalizada con resultado {outcome}")
+            duration = time.monotonic() - start
+            state_store.record_task_result(state_id, task.__name__, outcome, duration)
+            kind, _, stage = outcome.partition(':')
+            metrics.inc('pipeline_task_outcomes_total', project=state_id, task=task.__name__, outcome=kind, stage=stage)
+            metrics.observe('pipeline_task_duration_seconds', duration, project=state_id, task=task.__name__)
+        return outcome
+    run.__name__ = task.__name__
+    run.project = state_id
+    return run
+
+def _add_job(key, job, group='jobs'):
+    jobs.append(job)
+    projects[key][group].append(job)
+
+def _remove_job(key, job):
+    if job in jobs:
+        jobs.remove(job)
+    entry = projects.get(key)
+    if entry:
+        for group in ('jobs', 'first_runs', 'maintenance'):
+            if job in entry[group]:
+                entry[group].remove(job)
+
+def _resume_delay(key, task, interval):
+    """
+    Segundos que faltan para la próxima ejecución según el estado persistente, o None si
+    debe ejecutarse ya (nunca corrió, quedó interrumpida o ya venció su intervalo).
+    """
+    state = state_store.get_task_state(project_state_id(key), task.__name__)
+    if not state or not state['last_run']:
+        return None
+    if state['in_progress']:
+        logging.warning(f"La tarea '{task.__name__}' de {key[1]} quedó interrumpida en la ejecución anterior. Se reejecuta.")
+        return None
+    remaining = state['last_run'] + interval * 60 - time.time()
+    return remaining if remaining > 0 else None
+
+def _schedule_first_run(key, task):
+    """Lanza la primera ejecución de una tarea según el modo de arranque configurado y el estado persistente."""
+    folder_path = key[0]
+    resume_delay = _resume_delay(key, task, projects[key]['config']['interval'])
+    if resume_delay is not None:
+        # Ya corrió hace menos de un intervalo antes del reinicio: se adelanta la tarea periódica
+        # para retomar el ciclo donde quedó, sin ejecución inicial
+        for job in projects[key]['jobs']:
+            if task in job.job_func.args:
+                timer_scheduler.reschedule(job, time.time() + resume_delay)
+                logging.info(f"Tarea '{task.__name__}' de {key[1]} reanudada. Próxima ejecución: {job.next_run}")
+        return
+    if _startup_mode == 'immediate':
+        job_executor.submit(folder_path, task)
+        return
+
+    def first_run():
+        job_executor.submit(folder_path, task)
+        _remove_job(key, job)
+        return timer_scheduler.CancelJob
+
+    job = timer_scheduler.every(1).seconds.jitter(_startup_jitter).do(first_run)
+    _add_job(key, job, group='first_runs')
+
+def _schedule_tasks(key):
+    """Programa las tareas periódicas registradas para un proyecto, con su jitter y política de recuperación."""
+    folder_path = key[0]
+    config = projects[key]['config']
+    interval = config['interval']
+    catch_up = config.get('catch_up', timer_scheduler.DEFAULT_CATCH_UP)
+    if catch_up not in timer_scheduler.CATCH_UP_POLICIES:
+        logging.error(f"Política catch_up no válida: {catch_up}. Debe ser una de {', '.join(timer_scheduler.CATCH_UP_POLICIES)}. Usando '{timer_scheduler.DEFAULT_CATCH_UP}'.")
+        catch_up = timer_scheduler.DEFAULT_CATCH_UP
+    for task in projects[key]['tasks']:
+        job = timer_scheduler.every(interval).minutes.jitter(config.get('jitter', 0)).catch_up(catch_up).tag(project_state_id(key)).do(job_executor.submit, folder_path, task)
+        _add_job(key, job)
+        logging.info(f"Tarea '{task.__name__}' programada para {key[1]} cada {interval} minutos. Próxima ejecución: {job.next_run}")
+
+def _in_maintenance_window():
+    window = _maintenance['window']
+    if not window:
+        return True
+    now = datetime.datetime.now()
+    minute = now.hour * 60 + now.minute
+    start, end = window
+    return start <= minute < end if start <= end else (minute >= start or minute < end)
+
+def _submit_maintenance_if_due(key, task):
+    """Encola el mantenimiento del proyecto si venció su intervalo, dentro de la ventana y con el pool ocioso."""
+    period = _maintenance['interval'] * 3600
+    state = state_store.get_task_state(project_state_id(key), task.__name__)
+    now = time.time()
+    if state and state['in_progress'] and state['started_at'] and now - state['started_at'] < period:
+        return
+    last_run = state['last_run'] if state else None
+    if last_run and now - last_run < period:
+        return
+    if not _in_maintenance_window():
+        return
+    starving = last_run is not None and now - last_run >= 2 * period
+    idle = job_executor.get_queue_depth() == 0 and job_executor.get_in_flight_count() == 0
+    if idle or starving:
+        logging.info(f"Mantenimiento de git encolado para {key[1]}")
+        job_executor.submit(key[0], task)
+
+def _schedule_maintenance(key):
+    """Programa la revisión periódica del mantenimiento de git de un proyecto."""
+    task = projects[key]['maintenance_task']
+    if task is None or not _maintenance['interval']:
+        return
+    job = timer_scheduler.every(MAINTENANCE_CHECK_INTERVAL).minutes.jitter(60).catch_up('skip') \
+        .tag(project_state_id(key)).do(_submit_maintenance_if_due, key, task)
+    _add_job(key, job, group='maintenance')
+
+def _unschedule_project(key, groups=('jobs', 'first_runs', 'maintenance')):
+    """Cancela las tareas programadas de un proyecto sin afectar la que esté en ejecución."""
+    entry = projects.get(key)
+    if not entry:
+        return
+    scheduled = [job for group in groups for job in entry[group]]
+    for job in scheduled:
+        timer_scheduler.cancel_job(job)
+        _remove_job(key, job)
+
+def remove_project(key, cancel_running=True):
+    """
+    Quita un proyecto: cancela sus tareas programadas, las pendientes en el pool y, con
+    `cancel_running`, la que esté en ejecución.
+    """
+    _unschedule_project(key)
+    projects.pop(key, None)
+    watch_manager.unwatch_project(key)
+    job_executor.cancel_pending(key[0])
+    if cancel_running and job_executor.cancel_running(key[0]):
+        logging.info(f"Tarea en ejecución de {key[1]} cancelada.")
+    logging.info(f"Proyecto {key[1]} en {key[0]} eliminado de la programación.")
+
+def reschedule_project(config):
+    """Reprograma las tareas de un proyecto con un nuevo intervalo sin volver a sincronizarlo."""
+    key = project_key(config)
+    # Las primeras ejecuciones diferidas que aún no corrieron y el mantenimiento se mantienen
+    _unschedule_project(key, groups=('jobs',))
+    projects[key]['config'] = config
+    _schedule_tasks(key)
+
+def reconcile_projects(new_projects, keep_running=()):
+    """
+    Aplica una nueva lista de proyectos comparándola con la actual.
+
+    Solo se agregan, quitan o reprograman los proyectos que cambiaron; el resto
+    sigue con sus tareas intactas, incluidas las que estén en ejecución. Los proyectos
+    quitados cuya clave está en `keep_running` dejan de programarse, pero su tarea en curso
+    termina normalmente.
+    """
+    new_configs = {}
+    for config in new_projects:
+        key = project_key(config)
+        if key in new_configs:
+            logging.warning(f"Proyecto duplicado en la configuración: {key[1]} en {key[0]}. Se usa la última entrada.")
+        new_configs[key] = config
+
+    removed = [key for key in projects if key not in new_configs]
+    for key in removed:
+        remove_project(key, cancel_running=key not in keep_running)
+
+    added = changed = rescheduled = 0
+    for key, config in new_configs.items():
+        entry = projects.get(key)
+        if entry is None:
+            sync_project(config)
+            added += 1
+            continue
+        old_config = entry['config']
+        if old_config == config:
+            continue
+        differing = {k for k in set(old_config) | set(config) if old_config.get(k) != config.get(k)}
+        if differing <= set(SCHEDULE_ONLY_KEYS):
+            reschedule_project(config)
+            rescheduled += 1
+        else:
+            # La tarea en curso termina con la configuración anterior (cortar un build o un
+            # 'git pull --rebase' a mitad puede dejar el repositorio roto); las nuevas se encolan detrás
+            remove_project(key, cancel_running=False)
+            sync_project(config)
+            changed += 1
+
+    logging.info(f"Proyectos recargados: {added} agregados, {len(removed)} eliminados, "
+                 f"{changed} modificados, {rescheduled} reprogramados, {len(new_configs) - added - changed - rescheduled} sin cambios.")
+
+def trigger_pull(owner, repo_name, branch):
+    """
+    Encola de inmediato el pull y despliegue de los proyectos que siguen ese repositorio y rama
+    (por ejemplo, al recibir un webhook push). Si ya hay uno pendiente no se duplica, así que las
+    ráfagas de eventos se agrupan en una sola ejecución. Retorna la cantidad de tareas encoladas.
+    """
+    queued = 0
+    for key, entry in list(projects.items()):
+        config = entry['config']
+        if (config.get('repo_name') or '').lower() != repo_name.lower():
+            continue
+        if config.get('git_branch', 'main') != branch:
+            continue
+        project_owner = config.get('github_user') or git_utils.get_default_user()
+        if owner and project_owner and project_owner.lower() != owner.lower():
+            continue
+        for task in entry['tasks']:
+            if task.__name__ == 'pull_and_deploy' and job_executor.submit(key[0], task):
+                queued += 1
+    return queued
 
 def cancel_jobs():
     """Cancela todas las tareas programadas."""
     global jobs
     for job in jobs:
-        schedule.cancel_job(job)
+        timer_scheduler.cancel_job(job)
     jobs.clear()
+    projects.clear()
+    watch_manager.unwatch_all()
+    job_executor.cancel_pending()
+    job_executor.cancel_running()
     logging.info("Todas las tareas programadas han sido canceladas.")
     
 def sync_project(config):
     """Sincroniza una carpeta con un repositorio en GitHub o Gitea."""
-    global jobs
     folder_path = config['folder_path']
     repo_name = config['repo_name']
     interval = config['interval']
@@ -27,12 +343,25 @@ def sync_project(config):
     docker_compose_file = config.get('docker_compose_file', None)
     docker_compose_project_name = config.get('docker_compose_project_name', None)
     env_file = config.get('env_file', None)
+    deploy_strategy = config.get('deploy_strategy', 'incremental')
+    health_timeout = config.get('health_timeout', DEFAULT_HEALTH_TIMEOUT)
+    one_shot_services = config.get('one_shot_services', None)
     
     github_token_api = config.get('github_token_api', None)
     github_email = config.get('github_email', None)
     github_user = config.get('github_user', None)
     gitea_url = config.get('gitea_url', None)
     git_branch = config.get('git_branch', 'main') # Default to 'main'
+    trigger = config.get('trigger', 'interval')
+    watch_debounce = config.get('watch_debounce', watch_manager.DEFAULT_DEBOUNCE)
+    git_depth = config.get('git_depth', None)
+    git_filter = config.get('git_filter', None)
+    sparse_checkout = config.get('sparse_checkout', None)
+    if option != 'pull':
+        ignored = [name for name in PULL_ONLY_KEYS if config.get(name)]
+        if ignored:
+            logging.warning(f"{', '.join(ignored)} solo se aplican a proyectos con option 'pull'. Se ignoran en {repo_name}.")
+        git_depth = git_filter = sparse_checkout = None
 
     logging.debug(f"Config for {repo_name}:")
     logging.debug(f"  github_token_api: {'*' * len(github_token_api) if github_token_api else 'None'}") # Mask token
@@ -41,72 +370,112 @@ def sync_project(config):
     logging.debug(f"  gitea_url: {gitea_url}")
 
     logging.info(f"Sincronizando proyecto: {repo_name} en {folder_path}")
-    
-    if not os.path.exists(folder_path):
-        logging.info(f"Creando carpeta {folder_path} para el repositorio {repo_name}")
-        try:
-            os.makedirs(folder_path)
-        except OSError as e:
-            logging.error(f"Error al crear la carpeta {folder_path}: {e}")
-            return
-    if not os.path.exists(os.path.join(folder_path, ".git")):
-        logging.info(f"Inicializando repositorio Git en {folder_path}")
-        if not git_utils.execute_command(["git", "init"], cwd=folder_path):
-            logging.error(f"Error al inicializar el repositorio Git en {folder_path}")
-            return
-
-        if not git_utils.execute_command(["git", "config", "pull.rebase", "true"], cwd=folder_path):
-            logging.error(f"Error al configurar pull.rebase en {folder_path}")
-            return
-        
-        # Configure the initial branch if the repository is new
-        if not git_utils.execute_command(["git", "branch", f"-M", git_branch], cwd=folder_path):
-            logging.error(f"Error al configurar la rama inicial a {git_branch} en {folder_path}")
-            return
-
-
-    remote_url = git_utils.get_remote_url(repo_name, github_token_api, github_user, gitea_url)
-
-    if not remote_url:
-        logging.error("No se pudo obtener la URL remota.")
-        return
 
-    # This part needs to be adapted for Gitea if a dedicated API is used.
-    # For now, it assumes the repo exists or creation is handled by git_utils (which currently only supports GitHub API)
-    try:
-        subprocess.check_output(['git', 'ls-remote', remote_url], cwd=folder_path)
-    except subprocess.CalledProcessError:  # Repository does not exist
-        logging.info(f"El repositorio remoto {remote_url} no existe. Creando...")
-        # This will need to be made generic for Gitea as well, or detect if it's GitHub
-        if not gitea_url and not git_utils.create_github_repo(repo_name, private, github_token_api):
-            logging.error(f"Error al crear el repositorio en GitHub para {repo_name}")
-            return
-        elif gitea_url:
-            logging.warning("Creación automática de repositorios en Gitea no implementada. Asegúrate de que el repositorio exista.")
-            # Assume it exists for now, or log an error if it doesn't and can't be created.
-            pass
-
-
-    # Agregar el remoto si no existe
-    try:
-        subprocess.check_output(['git', 'remote', 'get-url', 'origin'], cwd=folder_path)
-    except subprocess.CalledProcessError: # Remote 'origin' does not exist
-        logging.info(f"Agregando remoto 'origin' a {remote_url}")
-        if not git_utils.execute_command(["git", "remote", "add", "origin", remote_url], cwd=folder_path):
-            logging.error(f"Error al agregar el remoto 'origin' a {remote_url}")
-            return
+    key = project_key(config)
+    state_id = project_state_id(key)
+    registered_tasks = {}
+    setup_state = {'ready': False}
+
+    def watch_project():
+        watch_manager.watch_project(key, folder_path, lambda: job_executor.submit(folder_path, registered_tasks['commit_and_push']), watch_debounce)
+
+    @contextlib.contextmanager
+    def stage(name):
+        """Mide la duración de una etapa del proyecto para las métricas y la indica en el log."""
+        with metrics.timer('pipeline_stage_duration_seconds', project=state_id, stage=name), log_pipeline.context(stage=name):
+            yield
+
+    def prepare_repository():
+        """Inicializa la carpeta, el repositorio local y el remoto. Solo se ejecuta hasta que tiene éxito."""
+        if setup_state['ready']:
+            return True
+
+        if not os.path.exists(folder_path):
+            logging.info(f"Creando carpeta {folder_path} para el repositorio {repo_name}")
+            try:
+                os.makedirs(folder_path)
+            except OSError as e:
+                logging.error(f"Error al crear la carpeta {folder_path}: {e}")
+                return False
+        if not os.path.exists(os.path.join(folder_path, ".git")):
+            logging.info(f"Inicializando repositorio Git en {folder_path}")
+            if not git_utils.execute_command(["git", "init"], cwd=folder_path, operation='git'):
+                logging.error(f"Error al inicializar el repositorio Git en {folder_path}")
+                return False
+
+            if not git_utils.execute_command(["git", "config", "pull.rebase", "true"], cwd=folder_path, operation='git'):
+                logging.error(f"Error al configurar pull.rebase en {folder_path}")
+                return False
+
+            # Configure the initial branch if the repository is new
+            if not git_utils.execute_command(["git", "branch", f"-M", git_branch], cwd=folder_path, operation='git'):
+                logging.error(f"Error al configurar la rama inicial a {git_branch} en {folder_path}")
+                return False
 
+        remote_url = git_utils.get_remote_url(repo_name, github_token_api, github_user, gitea_url)
 
+        if not remote_url:
+            logging.error("No se pudo obtener la URL remota.")
+            return False
+
+        # La existencia se consulta primero en el listado cacheado de la cuenta (compartido entre proyectos)
+        # y, si no figura, con la API del repositorio; si no se puede determinar por API, se recurre a 'git ls-remote'.
+        exists = git_utils.repo_exists(repo_name, github_token_api, github_user, gitea_url)
+        if exists is None:
+            try:
+                git_utils.run_command(['git', 'ls-remote', remote_url], cwd=folder_path, check=True, operation='git_remote')
+                exists = True
+            except subprocess.CalledProcessError:
+                exists = False
+        if not exists:  # Repository does not exist
+            logging.info(f"El repositorio remoto {remote_url} no existe. Creando...")
+            if not git_utils.create_repo(repo_name, private, github_token_api, gitea_url):
+                logging.error(f"Error al crear el repositorio remoto para {repo_name}")
+                return False
+
+        # Agregar el remoto si no existe (o actualizarlo si cambió)
+        if not git_utils.ensure_local_config(folder_path, remote_url, partial_clone_filter=git_filter):
+            logging.error(f"Error al configurar el remoto 'origin' en {folder_path}")
+            return False
+
+        # Solo las carpetas necesarias para el despliegue quedan en el working tree
+        if not git_utils.set_sparse_checkout(folder_path, sparse_checkout):
+            return False
+
+        git_utils.enable_status_cache(folder_path)
+        setup_state['ready'] = True
+        return True
+
+    # Cada tarea devuelve su resultado ('ok', 'noop' o 'error:<etapa>'), que queda registrado en el estado persistente
     def commit_and_push():
         """Realiza el commit y push."""
         try:
-            if not git_utils.git_add(cwd=folder_path):
-                logging.error(f"Error al ejecutar 'git add .' en {folder_path}")
-                return
+            if not prepare_repository():
+                logging.error(f"No se pudo preparar el repositorio {repo_name}. Se reintentará en la próxima ejecución.")
+                return 'error:prepare'
+
+            # Si la carpeta no existía al programar el proyecto, se empieza a observar una vez creada
+            if trigger == 'watch':
+                watch_project()
+
+            # Chequeo barato antes de 'git add': si git status no reporta cambios, no hay nada que hacer
+            with stage('git_status'):
+                changed_paths = git_utils.get_changed_paths(cwd=folder_path)
+            if changed_paths == []:
+                logging.info(f"No hay cambios para subir en {repo_name}")
+                return 'noop'
+
+            with stage('git_add'):
+                added = git_utils.git_add(cwd=folder_path, paths=changed_paths)
+            if not added:
+                logging.error(f"Error al ejecutar 'git add' en {folder_path}")
+                return 'error:git_add'
 
-            diff = git_utils.get_git_diff(cwd=folder_path)
+            with stage('git_diff'):
+                diff = git_utils.get_git_diff(cwd=folder_path)
             if diff:
-                commit_message = genai_utils.generate_commit_message(diff)
+                with stage('commit_message'):
+                    commit_message = genai_utils.generate_commit_message(diff)
 
                 if not commit_message:
                     logging.warning("No se pudo generar un mensaje de commit.")
@@ -114,74 +483,162 @@ def sync_project(config):
                 
                 if "SYNTAX_ERROR" in commit_message:
                     logging.error("Error de sintaxis detectado en el mensaje de commit.")
-                    return
+                    return 'error:syntax'
                     
                 logging.info(f"Commit message: {commit_message}")
 
-                if not git_utils.git_commit(folder_path, commit_message):
+                with stage('git_commit'):
+                    committed = git_utils.git_commit(folder_path, commit_message)
+                if not committed:
                     logging.error(f"Error al ejecutar 'git commit' en {folder_path}")
-                    return
+                    return 'error:git_commit'
 
-                if not git_utils.git_pull(cwd=folder_path, repo_name=repo_name, github_token_api=github_token_api, project_email=github_email, project_user=github_user, branch_name=git_branch, gitea_url=gitea_url):
+                with stage('git_pull'):
+                    pulled = git_utils.git_pull(cwd=folder_path, repo_name=repo_name, github_token_api=github_token_api, project_email=github_email, project_user=github_user, branch_name=git_branch, gitea_url=gitea_url)
+                if not pulled:
                     logging.error(f"Error al ejecutar 'git pull' en {folder_path}")
-                    return
+                    return 'error:git_pull'
                 logging.info(f"Cambios bajados del repositorio {repo_name}")
 
-                if not git_utils.git_push(cwd=folder_path, repo_name=repo_name, github_token_api=github_token_api, project_email=github_email, project_user=github_user, branch_name=git_branch, gitea_url=gitea_url):
+                with stage('git_push'):
+                    pushed = git_utils.git_push(cwd=folder_path, repo_name=repo_name, github_token_api=github_token_api, project_email=github_email, project_user=github_user, branch_name=git_branch, gitea_url=gitea_url)
+                if not pushed:
                     logging.error(f"Error al ejecutar 'git push' en {folder_path}")
-                    return
+                    return 'error:git_push'
                 logging.info(f"Cambios subidos al repositorio {repo_name}")
+                return 'ok'
             else:
                 logging.info(f"No hay cambios para subir en {repo_name}")
+                return 'noop'
 
         except Exception as e:
             logging.error(f"Error durante el commit y push en {repo_name}: {e}")
+            return 'error:exception'
             
+    # El último SHA remoto visto y el último desplegado sobreviven reinicios: si el remoto no cambió,
+    # no se vuelve a hacer pull, pero un despliegue que falló o quedó a medias se reintenta
+    stored_state = state_store.get_project_state(state_id)
+    pull_state = {'remote_head_hash': stored_state['last_remote_sha'], 'deployed_hash': stored_state['last_deployed_sha']}
+
+    def deploy(changed_files=None, head_hash=None):
+        with stage('deploy'):
+            deployed = execute_docker_compose(folder_path=folder_path, docker_compose_file=docker_compose_file, project_name=docker_compose_project_name, env_file=env_file,
+                                              changed_files=changed_files, strategy=deploy_strategy, health_timeout=health_timeout,
+                                              one_shot_services=one_shot_services)
+        if not deployed:
+            return 'error:deploy'
+        pull_state['deployed_hash'] = head_hash or git_utils.get_head_hash(cwd=folder_path)
+        state_store.update_project_state(state_id, last_deployed_sha=pull_state['deployed_hash'])
+        return 'ok'
+
+    def deploy_pending(head_hash):
+        """Indica si HEAD quedó sin desplegar (el despliegue anterior falló o se interrumpió)."""
+        return bool(pull_state['deployed_hash'] and head_hash and head_hash != pull_state['deployed_hash'])
+
     def pull_and_deploy():
         """Realiza el pull y despliega con Docker Compose si está habilitado."""
         try:
+            if not prepare_repository():
+                logging.error(f"No se pudo preparar el repositorio {repo_name}. Se reintentará en la próxima ejecución.")
+                return 'error:prepare'
+
+            # Sondeo barato del remoto: si la punta de la rama no se movió desde el último pull, no se hace fetch/merge
+            with stage('remote_probe'):
+                remote_head_hash = git_utils.get_remote_head_hash(folder_path, repo_name, github_token_api, github_user, branch_name=git_branch, gitea_url=gitea_url)
+            if remote_head_hash and remote_head_hash == pull_state['remote_head_hash'] \
+                    and not git_utils.has_commit(folder_path, remote_head_hash):
+                # El SHA guardado no está en el repositorio local (carpeta borrada o reinicializada): hay que volver a bajarlo
+                logging.info(f"El commit {remote_head_hash} no está en {folder_path}. Se vuelve a hacer pull.")
+                pull_state['remote_head_hash'] = None
+                state_store.update_project_state(state_id, last_remote_sha=None)
+            if remote_head_hash and remote_head_hash == pull_state['remote_head_hash']:
+                logging.info(f"Sin cambios en la rama remota {git_branch} de {repo_name}")
+                if docker_compose_file and not is_docker_compose_project_running(docker_compose_project_name):
+                    logging.info(f"Desplegando {repo_name}: el proyecto no está corriendo")
+                    return deploy()
+                head_hash = git_utils.get_head_hash(cwd=folder_path)
+                if docker_compose_file and deploy_pending(head_hash):
+                    logging.info(f"Desplegando {repo_name}: {head_hash} no se desplegó (último despliegue: {pull_state['deployed_hash']})")
+                    return deploy(git_utils.get_changed_files(folder_path, pull_state['deployed_hash'], head_hash), head_hash)
+                return 'noop'
+
+            # Con la caché de mirrors, el upstream se descarga una sola vez y el pull se hace desde el mirror local
+            source = None
+            if option == 'pull' and mirror_cache.is_enabled():
+                remote_url = git_utils.get_remote_url(repo_name, github_token_api, github_user, gitea_url)
+                with stage('mirror_fetch'):
+                    mirror = mirror_cache.fetch(remote_url, git_branch, remote_head_hash) if remote_url else None
+                if mirror and mirror_cache.attach(folder_path, mirror):
+                    source = mirror
+
             initial_head_hash =  git_utils.get_head_hash(cwd=folder_path)
-            if not git_utils.git_pull(cwd=folder_path, repo_name=repo_name, github_token_api=github_token_api, project_email=github_email, project_user=github_user, branch_name=git_branch, gitea_url=gitea_url):
+            with stage('git_pull'):
+                pulled = git_utils.git_pull(cwd=folder_path, repo_name=repo_name, github_token_api=github_token_api, project_email=github_email, project_user=github_user, branch_name=git_branch, gitea_url=gitea_url, depth=git_depth, source=source)
+            if not pulled:
                 logging.error(f"Error al ejecutar 'git pull' en {folder_path}")
-                return
+                return 'error:git_pull'
             logging.info(f"Cambios bajados del repositorio {repo_name}")
+            pull_state['remote_head_hash'] = remote_head_hash
+            state_store.update_project_state(state_id, last_remote_sha=remote_head_hash)
             
             final_head_hash = git_utils.get_head_hash(cwd=folder_path)
             is_project_running = is_docker_compose_project_running(docker_compose_project_name)
             
             if (initial_head_hash != final_head_hash and docker_compose_file) \
-                or (not is_project_running and docker_compose_file):
+                or (not is_project_running and docker_compose_file) \
+                or (deploy_pending(final_head_hash) and docker_compose_file):
                 logging.info(f"Desplegando cambios en {repo_name}")
-                execute_docker_compose(folder_path=folder_path, docker_compose_file=docker_compose_file, project_name=docker_compose_project_name, env_file=env_file)
+                # Con el proyecto corriendo y ambos commits conocidos, solo se redespliega lo afectado por el diff
+                # desde el último despliegue (que puede ser anterior a este pull si uno falló)
+                changed_files = None
+                base_hash = pull_state['deployed_hash'] or initial_head_hash
+                if is_project_running and base_hash and final_head_hash:
+                    changed_files = git_utils.get_changed_files(folder_path, base_hash, final_head_hash)
+                return deploy(changed_files, final_head_hash)
             else:
                 logging.info(f"No hay cambios para desplegar en {repo_name}")
-                return
+                return 'noop'
         except Exception as e:
             logging.exception(f"Error durante el pull y despliegue en {repo_name}: {e}")
+            return 'error:exception'
             
+    def git_maintenance():
+        """Compacta el repositorio local: commit-graph, objetos sueltos, repack incremental y refs."""
+        if not os.path.isdir(os.path.join(folder_path, '.git')):
+            return 'noop'
+        with stage('git_maintenance'):
+            maintained = git_utils.run_maintenance(folder_path, _maintenance['tasks'])
+        return 'ok' if maintained else 'error:git_maintenance'
+
     if option == 'push':
-        job = schedule.every(interval).minutes.do(commit_and_push)
-        jobs.append(job)
-        logging.info(f"Tarea 'push' programada para {repo_name} cada {interval} minutos. Próxima ejecución: {job.next_run}")
-        # Ejecutar inmediatamente la primera vez
-        commit_and_push()
+        tasks = [commit_and_push]
     elif option == 'pull':
-        job = schedule.every(interval).minutes.do(pull_and_deploy)
-        jobs.append(job)
-        logging.info(f"Tarea 'pull' programada para {repo_name} cada {interval} minutos. Próxima ejecución: {job.next_run}")
-        # Ejecutar inmediatamente la primera vez
-        pull_and_deploy()
+        tasks = [pull_and_deploy]
     elif option == 'push_and_pull':
-        job = schedule.every(interval).minutes.do(commit_and_push)
-        job2 = schedule.every(interval).minutes.do(pull_and_deploy)
-        jobs.append(job)
-        jobs.append(job2)
-        logging.info(f"Tareas 'push' y 'pull' programadas para {repo_name} cada {interval} minutos. Próxima ejecución push: {job.next_run}, pull: {job2.next_run}")
-        # Ejecutar inmediatamente la primera vez
-        commit_and_push()
-        pull_and_deploy()
+        tasks = [commit_and_push, pull_and_deploy]
     else:
         logging.error(f"Opción no válida: {option}. Debe ser 'push', 'pull' o 'push_and_pull'.")
         return
+    tasks = [_tracked(state_id, task) for task in tasks]
+    registered_tasks.update((task.__name__, task) for task in tasks)
+
+    if trigger not in ('interval', 'watch'):
+        logging.error(f"Trigger no válido: {trigger}. Debe ser 'interval' o 'watch'. Usando 'interval'.")
+        trigger = 'interval'
+
+    # Las tareas se envían al pool de workers: un mismo proyecto nunca corre dos veces a la vez,
+    # pero proyectos distintos se ejecutan en paralelo.
+    maintenance_task = _tracked(state_id, git_maintenance) if config.get('git_maintenance', True) else None
+    projects[key] = {'config': config, 'tasks': tasks, 'maintenance_task': maintenance_task,
+                     'jobs': [], 'first_runs': [], 'maintenance': []}
+    _schedule_tasks(key)
+    _schedule_maintenance(key)
+    # En modo 'watch' el push se dispara por cambios en la carpeta; el intervalo queda como respaldo.
+    # Se observa desde ya, aunque la primera ejecución se difiera o se retome más adelante.
+    if trigger == 'watch' and 'commit_and_push' in registered_tasks and os.path.isdir(folder_path):
+        watch_project()
+    # Primera ejecución según el modo de arranque
+    for task in tasks:
+        _schedule_first_run(key, task)
 
     logging.info(f"Configuración completada para {repo_name}. Total de tareas programadas: {len(jobs)}")
@@ -0,0 +1,239 @@
+import datetime
+import functools
+import heapq
+import itertools
+import logging
+import metrics
+import random
+import threading
+import time
+
+CATCH_UP_POLICIES = ('run_once', 'coalesce', 'skip')
+DEFAULT_CATCH_UP = 'run_once'
+
+
+class CancelJob:
+    """Valor que puede devolver una tarea para no volver a programarse."""
+
+
+class Job:
+    """
+    Tarea periódica. Se construye como en la librería schedule:
+    `every(10).minutes.do(func, *args)`, con opcionales `.jitter(segundos)`, `.catch_up(política)`
+    y `.tag(nombre)` (el primer tag identifica a la tarea en las métricas).
+
+    Políticas de recuperación cuando la tarea se atrasa (por ejemplo, tras una pausa larga):
+      - 'run_once': se ejecuta una vez y el intervalo vuelve a contar desde ese momento.
+      - 'coalesce': se ejecuta una vez y se mantiene la grilla original de horarios.
+      - 'skip': si se perdió al menos un intervalo completo, no se ejecuta y espera al próximo horario.
+    """
+
+    def __init__(self, interval, scheduler):
+        self.interval = interval
+        self.unit = None
+        self.job_func = None
+        self.max_jitter = 0
+        self.catch_up_policy = DEFAULT_CATCH_UP
+        self.tags = []
+        self.last_run = None
+        self.last_lag = None      # segundos de atraso de la última ejecución respecto de lo planificado
+        self._scheduler = scheduler
+        self._base_due = None     # horario planificado sin jitter
+        self._due = None          # horario planificado con jitter
+        self._version = 0
+        self._cancelled = False
+
+    @property
+    def seconds(self):
+        self.unit = 'seconds'
+        return self
+
+    @property
+    def minutes(self):
+        self.unit = 'minutes'
+        return self
+
+    @property
+    def hours(self):
+        self.unit = 'hours'
+        return self
+
+    @property
+    def period(self):
+        """Intervalo en segundos."""
+        return self.interval * {'seconds': 1, 'minutes': 60, 'hours': 3600}[self.unit]
+
+    @property
+    def next_run(self):
+        return datetime.datetime.fromtimestamp(self._due) if self._due is not None else None
+
+    def jitter(self, seconds):
+        """Agrega a cada ejecución un retraso aleatorio de hasta `seconds` segundos."""
+        self.max_jitter = max(0, seconds or 0)
+        return self
+
+    def catch_up(self, policy):
+        if policy not in CATCH_UP_POLICIES:
+            raise ValueError(f"Política de recuperación no válida: {policy}. Debe ser una de {', '.join(CATCH_UP_POLICIES)}.")
+        self.catch_up_policy = policy
+        return self
+
+    def tag(self, *tags):
+        self.tags.extend(tags)
+        return self
+
+    def do(self, job_func, *args, **kwargs):
+        if self.unit is None:
+            raise ValueError("Falta la unidad del intervalo (seconds, minutes u hours).")
+        if self.period <= 0:
+            raise ValueError("El intervalo debe ser mayor que 0.")
+        self.job_func = functools.partial(job_func, *args, **kwargs)
+        functools.update_wrapper(self.job_func, job_func)
+        self._scheduler._add(self, time.time() + self.period)
+        return self
+
+    def _jittered(self, base_due):
+        return base_due + (random.uniform(0, self.max_jitter) if self.max_jitter else 0)
+
+    def __repr__(self):
+        name = getattr(self.job_func, '__name__', repr(self.job_func))
+        return f"Job(cada {self.interval} {self.unit}, {name}, próxima: {self.next_run})"
+
+
+class Scheduler:
+    """
+    Scheduler basado en un heap de horarios. En lugar de revisar todas las tareas cada
+    segundo, `wait()` duerme hasta la próxima tarea vencida o hasta que `wake()` lo despierte
+    (cambio de configuración, webhook, etc.).
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.RLock())
+        self._heap = []           # (horario, secuencia, versión, job)
+        self._jobs = set()
+        self._sequence = itertools.count()
+
+    def every(self, interval=1):
+        return Job(interval, self)
+
+    def _push(self, job, base_due):
+        job._base_due = base_due
+        job._due = job._jittered(base_due)
+        job._version += 1
+        heapq.heappush(self._heap, (job._due, next(self._sequence), job._version, job))
+
+    def _add(self, job, base_due):
+        with self._cond:
+            self._jobs.add(job)
+            self._push(job, base_due)
+            self._cond.notify_all()
+
+    def reschedule(self, job, when):
+        """Cambia el próximo horario de una tarea (datetime o timestamp)."""
+        if isinstance(when, datetime.datetime):
+            when = when.timestamp()
+        with self._cond:
+            if job not in self._jobs:
+                return
+            self._push(job, when)
+            self._cond.notify_all()
+
+    def cancel_job(self, job):
+        with self._cond:
+            job._cancelled = True
+            self._jobs.discard(job)
+            # La entrada del heap se descarta cuando llega al tope
+
+    def clear(self):
+        with self._cond:
+            for job in self._jobs:
+                job._cancelled = True
+            self._jobs.clear()
+            self._heap.clear()
+
+    def get_jobs(self):
+        with self._cond:
+            return list(self._jobs)
+
+    def _pop_due(self, now):
+        """Saca del heap las tareas vencidas, descartando las canceladas o reprogramadas."""
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, version, job = heapq.heappop(self._heap)
+                if job._cancelled or version != job._version:
+                    continue
+                due.append(job)
+        return due
+
+    def _next_base_due(self, job, now):
+        period = job.period
+        if job.catch_up_policy == 'run_once':
+            return now + period
+        # 'coalesce' y 'skip' mantienen la grilla original de horarios
+        missed = max(0, int((now - job._base_due) // period))
+        return job._base_due + (missed + 1) * period
+
+    def run_pending(self):
+        """Ejecuta las tareas vencidas y las vuelve a programar según su política de recuperación."""
+        now = time.time()
+        for job in self._pop_due(now):
+            stalled = now - job._base_due >= job.period
+            if job.catch_up_policy == 'skip' and stalled:
+                logging.info(f"Tarea atrasada {now - job._base_due:.0f}s, se omite hasta el próximo horario: {job}")
+                result = None
+            else:
+                job.last_lag = now - job._due
+                job.last_run = datetime.datetime.now()
+                metrics.observe('pipeline_scheduler_lag_seconds', job.last_lag, project=job.tags[0] if job.tags else '')
+                try:
+                    result = job.job_func()
+                except Exception as e:
+                    logging.exception(f"Error no controlado en la tarea programada {job}: {e}")
+                    result = None
+            with self._cond:
+                if job._cancelled:
+                    continue
+                if result is CancelJob or isinstance(result, CancelJob):
+                    job._cancelled = True
+                    self._jobs.discard(job)
+                    continue
+                self._push(job, self._next_base_due(job, time.time()))
+
+    def idle_seconds(self):
+        """Segundos hasta la próxima tarea, o None si no hay tareas."""
+        with self._cond:
+            while self._heap:
+                _, _, version, job = self._heap[0]
+                if job._cancelled or version != job._version:
+                    heapq.heappop(self._heap)
+                    continue
+                return self._heap[0][0] - time.time()
+            return None
+
+    def wait(self, timeout=None):
+        """Duerme hasta la próxima tarea vencida, hasta `wake()` o hasta `timeout` segundos."""
+        with self._cond:
+            idle = self.idle_seconds()
+            if idle is not None and idle <= 0:
+                return
+            delays = [d for d in (idle, timeout) if d is not None]
+            self._cond.wait(min(delays) if delays else None)
+
+    def wake(self):
+        """Despierta al bucle principal (por ejemplo, ante un evento externo)."""
+        with self._cond:
+            self._cond.notify_all()
+
+
+default_scheduler = Scheduler()
+
+every = default_scheduler.every
+cancel_job = default_scheduler.cancel_job
+clear = default_scheduler.clear
+get_jobs = default_scheduler.get_jobs
+reschedule = default_scheduler.reschedule
+run_pending = default_scheduler.run_pending
+idle_seconds = default_scheduler.idle_seconds
+wait = default_scheduler.wait
+wake = default_scheduler.wake
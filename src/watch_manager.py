@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+from command_manager import run_command
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+DEFAULT_DEBOUNCE = 5      # segundos sin eventos antes de disparar
+DEFAULT_MAX_WAIT = 60     # segundos máximos acumulando eventos de una ráfaga
+
+_observer = None
+_lock = threading.Lock()
+_watches = {}  # project_key -> (ObservedWatch, ProjectChangeHandler)
+
+
+class ProjectChangeHandler(FileSystemEventHandler):
+    """
+    Acumula los cambios de un proyecto y llama al callback una sola vez por ráfaga.
+
+    El callback se dispara cuando pasan `debounce` segundos sin eventos nuevos, o
+    como máximo `max_wait` segundos después del primer evento de la ráfaga.
+    Los cambios dentro de .git y los ignorados por .gitignore se descartan.
+    """
+
+    def __init__(self, folder_path, callback, debounce=DEFAULT_DEBOUNCE, max_wait=DEFAULT_MAX_WAIT):
+        super().__init__()
+        self.folder_path = os.path.abspath(folder_path)
+        self.callback = callback
+        self.debounce = debounce
+        self.max_wait = max(max_wait, debounce)
+        self._lock = threading.Lock()
+        self._paths = set()
+        self._timer = None
+        self._first_event = None
+
+    def on_any_event(self, event):
+        if event.event_type in ('opened', 'closed_no_write'):
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            if path:
+                self._record(path)
+
+    def _record(self, path):
+        relative = os.path.relpath(path, self.folder_path)
+        if relative == '.' or relative == '.git' or relative.startswith('.git' + os.sep):
+            return
+        with self._lock:
+            self._paths.add(relative)
+            if self._first_event is None:
+                self._first_event = time.monotonic()
+            delay = min(self.debounce, self._first_event + self.max_wait - time.monotonic())
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(max(delay, 0), self._flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush(self):
+        with self._lock:
+            paths = self._paths
+            self._paths = set()
+            self._timer = None
+            self._first_event = None
+        if not paths:
+            return
+        changed = _filter_ignored(self.folder_path, paths)
+        if not changed:
+            logging.debug(f"Cambios ignorados por .gitignore en {self.folder_path}")
+            return
+        logging.info(f"Detectados {len(changed)} archivos modificados en {self.folder_path}")
+        try:
+            self.callback()
+        except Exception as e:
+            logging.exception(f"Error al procesar cambios en {self.folder_path}: {e}")
+
+    def cancel(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+            self._paths = set()
+            self._first_event = None
+
+
+def _filter_ignored(folder_path, paths):
+    """Descarta las rutas ignoradas por git usando una sola llamada a 'git check-ignore'."""
+    paths = sorted(paths)
+    try:
+        result = run_command(
+            ['git', 'check-ignore', '--stdin', '-z'],
+            input='\0'.join(paths) + '\0',
+            cwd=folder_path,
+            operation='git'
+        )
+    except FileNotFoundError:
+        logging.error("Error: 'git' no se encuentra en la ruta del sistema. Asegúrate de que Git esté instalado.")
+        return paths
+    # Código 1: ninguna ruta ignorada. Cualquier otro error: no se filtra.
+    if result.returncode not in (0, 1):
+        logging.debug(f"No se pudo evaluar .gitignore en {folder_path}: {result.stderr.strip()}")
+        return paths
+    ignored = set(filter(None, result.stdout.split('\0')))
+    return [path for path in paths if path not in ignored]
+
+
+def _get_observer():
+    global _observer
+    if _observer is None:
+        _observer = Observer()
+        _observer.daemon = True
+        _observer.start()
+    return _observer
+
+
+def watch_project(project_key, folder_path, callback, debounce=DEFAULT_DEBOUNCE, max_wait=DEFAULT_MAX_WAIT):
+    """Empieza a observar recursivamente la carpeta de un proyecto. Es idempotente."""
+    with _lock:
+        if project_key in _watches:
+            return True
+        if not os.path.isdir(folder_path):
+            logging.error(f"No se puede observar {folder_path}: la carpeta no existe.")
+            return False
+        handler = ProjectChangeHandler(folder_path, callback, debounce, max_wait)
+        try:
+            watch = _get_observer().schedule(handler, path=folder_path, recursive=True)
+        except OSError as e:
+            logging.error(f"Error al observar la carpeta {folder_path}: {e}")
+            return False
+        _watches[project_key] = (watch, handler)
+    logging.info(f"Observando cambios en {folder_path} (debounce {debounce}s).")
+    return True
+
+
+def unwatch_project(project_key):
+    """Deja de observar la carpeta de un proyecto."""
+    with _lock:
+        entry = _watches.pop(project_key, None)
+    if entry is None:
+        return
+    watch, handler = entry
+    handler.cancel()
+    if _observer is not None:
+        try:
+            _observer.unschedule(watch)
+        except KeyError:
+            pass
+
+
+def unwatch_all():
+    """Deja de observar todas las carpetas."""
+    for project_key in list(_watches.keys()):
+        unwatch_project(project_key)
+
+
+def stop():
+    """Detiene el observador de archivos."""
+    global _observer
+    unwatch_all()
+    with _lock:
+        observer = _observer
+        _observer = None
+    if observer is not None:
+        observer.stop()
+        observer.join()
@@ -0,0 +1,140 @@
+import hashlib
+import hmac
+import json
+import logging
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler
+from http_service import DaemonHTTPServer, HttpService
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8088
+DEFAULT_PATH = '/webhook'
+MAX_BODY_SIZE = 5 * 1024 * 1024
+SEEN_DELIVERIES_SIZE = 1000
+
+_service = HttpService('webhook-server', 'el servidor de webhooks')
+
+
+def verify_signature(secret, body, headers):
+    """
+    Verifica la firma HMAC-SHA256 del cuerpo: 'X-Hub-Signature-256: sha256=<hex>' (GitHub)
+    o 'X-Gitea-Signature: <hex>' (Gitea).
+    """
+    expected = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    github_signature = headers.get('X-Hub-Signature-256')
+    if github_signature:
+        return hmac.compare_digest(github_signature, f"sha256={expected}")
+    gitea_signature = headers.get('X-Gitea-Signature')
+    if gitea_signature:
+        return hmac.compare_digest(gitea_signature, expected)
+    return False
+
+
+def parse_push_event(payload):
+    """Extrae (owner, repositorio, rama) de un evento push. Retorna None si no es un push a una rama."""
+    ref = payload.get('ref') or ''
+    if not ref.startswith('refs/heads/'):
+        return None
+    repository = payload.get('repository') or {}
+    name = repository.get('name')
+    if not name:
+        return None
+    owner = (repository.get('owner') or {}).get('login') or (repository.get('owner') or {}).get('username')
+    if not owner and repository.get('full_name'):
+        owner = repository['full_name'].split('/', 1)[0]
+    return owner, name, ref[len('refs/heads/'):]
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Recibe webhooks push de GitHub/Gitea y encola el pull del proyecto correspondiente."""
+
+    server_version = 'PipelineBot'
+
+    def log_message(self, format, *args):
+        logging.debug(f"Webhook {self.address_string()}: {format % args}")
+
+    def _reply(self, status, message):
+        body = json.dumps({'message': message}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        settings = self.server.settings
+        if self.path.split('?', 1)[0] != settings['path']:
+            return self._reply(404, 'not found')
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0 or length > MAX_BODY_SIZE:
+            return self._reply(413 if length > MAX_BODY_SIZE else 400, 'invalid body size')
+        body = self.rfile.read(length)
+
+        if not verify_signature(settings['secret'], body, self.headers):
+            logging.warning(f"Webhook con firma inválida desde {self.client_address[0]}")
+            return self._reply(401, 'invalid signature')
+
+        event = self.headers.get('X-GitHub-Event') or self.headers.get('X-Gitea-Event') or ''
+        if event == 'ping':
+            return self._reply(200, 'pong')
+        if event != 'push':
+            return self._reply(202, f"event '{event}' ignored")
+
+        delivery = self.headers.get('X-GitHub-Delivery') or self.headers.get('X-Gitea-Delivery')
+        if delivery and self.server.already_seen(delivery):
+            return self._reply(200, 'duplicate delivery')
+
+        try:
+            push = parse_push_event(json.loads(body))
+        except (ValueError, AttributeError):
+            return self._reply(400, 'invalid payload')
+        if push is None:
+            return self._reply(202, 'not a branch push')
+
+        owner, repo_name, branch = push
+        queued = self.server.on_push(owner, repo_name, branch)
+        logging.info(f"Webhook push {owner}/{repo_name}@{branch}: {queued} tareas encoladas.")
+        return self._reply(202, f"{queued} tasks queued")
+
+
+class WebhookServer(DaemonHTTPServer):
+    def __init__(self, settings, on_push):
+        super().__init__((settings['host'], settings['port']), WebhookHandler)
+        self.settings = settings
+        self.on_push = on_push
+        self._seen = OrderedDict()
+        self._seen_lock = threading.Lock()
+
+    def already_seen(self, delivery):
+        """Registra un id de entrega y devuelve True si ya se había recibido (reintentos del proveedor)."""
+        with self._seen_lock:
+            if delivery in self._seen:
+                return True
+            self._seen[delivery] = True
+            while len(self._seen) > SEEN_DELIVERIES_SIZE:
+                self._seen.popitem(last=False)
+            return False
+
+
+def configure(settings, on_push):
+    """
+    Inicia, reinicia o detiene el servidor de webhooks según la configuración
+    ({'host', 'port', 'path', 'secret'}). Sin configuración, el servidor queda detenido.
+    """
+    if settings:
+        settings = {
+            'host': settings.get('host', DEFAULT_HOST),
+            'port': settings.get('port', DEFAULT_PORT),
+            'path': settings.get('path', DEFAULT_PATH),
+            'secret': settings.get('secret'),
+        }
+        if not settings['secret']:
+            logging.error("El webhook requiere un 'secret' para verificar las firmas. No se inicia el servidor.")
+            settings = None
+    _service.configure(settings, lambda settings: WebhookServer(settings, on_push), settings['path'] if settings else '')
+
+
+def stop():
+    _service.stop()